@@ -7,18 +7,70 @@
 # Imports
 ##############################################################################
 
-import copy
-import re
 import socket
+import time
 
 import rospy
 import rosgraph
-import rocon_gateway_utils
-from gateway_msgs.msg import RemoteRuleWithStatus
+from gateway_msgs.msg import RemoteRule, RemoteRuleWithStatus, Rule
 
 from . import utils
 from . import interactive_interface
 
+##############################################################################
+# Utilities
+##############################################################################
+
+
+def _registration_key(registration):
+    '''
+      Key identifying the flip that a flipped in registration would loop back out as.
+    '''
+    return (registration.local_node, registration.remote_gateway, registration.connection.rule.name)
+
+
+def _flip_key(flip):
+    '''
+      Key for a flip (whose node is 'node,xmlrpc_uri') comparable with _registration_key.
+    '''
+    return (flip.rule.node.split(",")[0], flip.gateway, flip.rule.name)
+
+##############################################################################
+# Flip State
+##############################################################################
+
+
+class FlipState(object):
+
+    '''
+      The state of a single flip that is active, i.e. has been sent to a
+      remote gateway.
+
+       - remote_rule            (gateway_msgs.msg.RemoteRule, node is 'node,xmlrpc_uri')
+       - status                 (one of gateway_msgs.msg.RemoteRuleWithStatus constants)
+       - created                (wall time the flip became active)
+       - status_changed         (wall time the status was last changed)
+       - sent                   (whether the flip request has gone to the hub yet)
+    '''
+
+    def __init__(self, remote_rule, status=RemoteRuleWithStatus.UNKNOWN):
+        self.remote_rule = remote_rule
+        self.status = status
+        self.created = time.time()
+        self.status_changed = self.created
+        self.sent = False
+
+    def set_status(self, status):
+        '''
+          @return True if the status was changed, False otherwise
+          @rtype Boolean
+        '''
+        if self.status == status:
+            return False
+        self.status = status
+        self.status_changed = time.time()
+        return True
+
 ##############################################################################
 # Flipped Interface
 ##############################################################################
@@ -50,23 +102,37 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
 
         self.firewall = firewall
 
+        # Active flips, connection type keyed dicts of utils.remote_rule_key : FlipState, in the
+        # order they were flipped. This replaces the (list based) self.active of the parent.
+        self.flip_states = utils.create_empty_connection_type_dictionary(dict)
+
         # Function aliases
-        self.flipped = self.active
-        self.filtered_flips = []
-        self.flip_status = utils.create_empty_connection_type_dictionary()
         self.flip_all = self.add_all
         self.unflip_all = self.remove_all
 
+        # Flip rules matched by each local connection, kept between updates so that only
+        # added/lost connections need to be matched (connection type keyed dicts of
+        # utils.Connection : RemoteRule[]). Recomputed from scratch when the context
+        # (rules version, remote gateways) they were matched in changes.
+        self._matches = utils.create_empty_connection_type_dictionary(dict)
+        self._match_context = None
+        self._match_failed = False
+
     ##########################################################################
     # Monitoring
     ##########################################################################
 
-    def update(self, connections, remote_gateway_hub_index, unique_name, master):
+    def update(self, connections, remote_gateway_hub_index, unique_name, master,
+               added_connections=None, lost_connections=None):
         '''
           Computes a new flipped interface and returns two dictionaries -
           removed and newly added flips so the watcher thread can take
           appropriate action (inform the remote gateways).
 
+          Only the added and lost connections are matched against the flip
+          rules if they are provided. Everything is matched from scratch if they
+          aren't, or if the rules or remote gateways have changed since the last update.
+
           This is run in the watcher thread (warning: take care - other
           additions come from ros service calls in different threads!)
 
@@ -82,50 +148,49 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
           @param master : local master
           @type rocon_gateway.LocalMaster
 
+          @param added_connections : connections added to the local master since the last update
+          @type connection type keyed dictionary of utils.Connection sets or None
+
+          @param lost_connections : connections lost from the local master since the last update
+          @type connection type keyed dictionary of utils.Connection sets or None
+
           @return new_flips, removed_flips (i.e. those that are no longer on the local master)
           @rtype pair of connection type keyed dictionary of gateway_msgs.msg.Rule lists.
         '''
-        # SLOW, EASY METHOD
         remote_gateways = remote_gateway_hub_index.keys()
 
         self._lock.acquire()
 
         # Prune locally cached flip list for flips that have lost their remotes, keep the rules though
-        self.flipped = self._prune_unavailable_gateway_flips(self.flipped, remote_gateways)
+        self._prune_unavailable_gateway_flips(remote_gateways)
 
-        # Totally regenerate a new flipped interface, compare with old
-        new_flips, removed_flips, flipped = self._prepare_flips(connections, remote_gateways, unique_name, master)
+        self._update_matches(connections, added_connections, lost_connections, remote_gateways, unique_name, master)
+        new_flips, removed_flips, flipped = self._prepare_flips()
 
-        flip_status = self._prepare_flip_status(flipped)
         new_flips, filtered_flips = self._filter_flipped_in_interfaces(new_flips, self.registrations)
-        #rospy.loginfo("new_flips : {nf}".format(nf=new_flips))
-        self.flipped = self._update_flipped(flipped, filtered_flips)
+        self._update_flip_states(flipped, filtered_flips)
         self._lock.release()
         return new_flips, removed_flips
 
-        # OPTIMISED METHOD
-        #   Keep old rule state and old flip rules/patterns around
-        #
-        #   1 - If flip rules/patterns disappeared [diff(old_rules,new_rules)]
-        #         Check if the current flips are still valid
-        #         If not all are, remove and unflip them
-        #
-        #   2 - If rules disappeared [diff(old_conns,new_conns)]
-        #         If matching any in flipped, remove and unflip
-        #
-        #   3 - If flip rules/patterns appeared [diff(new_rules,old_rules)]
-        #         parse all conns, if match found, flip
-        #
-        #   4 - If rules appeared [diff(new_conns,old_conns)]
-        #         check for matches, if found, flou
-        #
-        # utils.difflist = lambda l1,l2: [x for x in l1 if x not in l2] # diff of lists
-
-    def _update_flipped(self, flipped, filtered_flips):
-        updated_flipped = {}
-        for connection_type in flipped.keys():
-            updated_flipped[connection_type] = [copy.deepcopy(r) for r in flipped[connection_type] if not r in filtered_flips[connection_type]]
-        return updated_flipped
+    def _update_flip_states(self, flipped, filtered_flips):
+        '''
+          Rebuild the flip state table for the new set of flips, carrying the
+          state of flips that were already active across.
+
+          @param flipped : the flips that should now be active, keyed by their remote rule key
+          @type connection type keyed dictionary of dicts
+          @param filtered_flips : flips that would loop flipped in connections back out
+          @type connection type keyed dictionary of gateway_msgs.msg.RemoteRule lists
+        '''
+        for connection_type in utils.connection_types:
+            filtered_keys = set([utils.remote_rule_key(flip) for flip in filtered_flips[connection_type]])
+            flip_states = {}
+            for key, flip in flipped[connection_type].items():
+                if key in filtered_keys:
+                    continue
+                flip_state = self.flip_states[connection_type].get(key, None)
+                flip_states[key] = flip_state if flip_state is not None else FlipState(flip)
+            self.flip_states[connection_type] = flip_states
 
     def _filter_flipped_in_interfaces(self, new_flips, flipped_in_registrations):
         '''
@@ -133,42 +198,30 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
         '''
         filtered_flips = utils.create_empty_connection_type_dictionary()
         for connection_type in utils.connection_types:
-            for rule in flipped_in_registrations[connection_type]:
-                r = self._is_registration_in_remote_rule(rule, new_flips[connection_type])
-                if r:
-                    filtered_flips[connection_type].append(r)
-
-        for connection_type in new_flips.keys():
-            new_flips[connection_type] = [r for r in new_flips[connection_type] if not r in filtered_flips[connection_type]]
+            registered = set([_registration_key(registration)
+                              for registration in flipped_in_registrations[connection_type].values()])
+            if not registered:
+                continue
+            filtered_flips[connection_type] = [r for r in new_flips[connection_type] if _flip_key(r) in registered]
+            new_flips[connection_type] = [r for r in new_flips[connection_type] if _flip_key(r) not in registered]
 
         rospy.logdebug("Gateway : filtered flip list to prevent cyclic flipping - %s"%str(filtered_flips))
 
         return new_flips, filtered_flips
 
-    def _is_registration_in_remote_rule(self, rule, new_flip_remote_rules):
-        for r in new_flip_remote_rules:
-            node = r.rule.node.split(",")[0]
-            if rule.local_node == node and rule.remote_gateway == r.gateway and rule.connection.rule.name == r.rule.name:
-                return r
-        return None
-
     def update_flip_status(self, flip, status):
         '''
           Update the status of a flip from the hub. This should be called right
-          after update once self.flipped is established
+          after update once the flip states are established
 
           @return True if status was indeed changed, False otherwise
           @rtype Boolean
         '''
         state_changed = False
         self._lock.acquire()
-        try:
-            index = self.flipped[flip.rule.type].index(flip)
-            state_changed = (self.flip_status[flip.rule.type][index] != status)
-            self.flip_status[flip.rule.type][index] = status
-            #rospy.loginfo("self.flip_status[{t}][{i}] = {s}".format(t=flip.rule.type, i=index, s=status))
-        except ValueError:
-            pass
+        flip_state = self.flip_states[flip.rule.type].get(utils.remote_rule_key(flip), None)
+        if flip_state is not None:
+            state_changed = flip_state.set_status(status)
         self._lock.release()
         return state_changed
 
@@ -177,17 +230,45 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
           Removes a flip, so that it can be resent as necessary
         '''
         self._lock.acquire()
-        try:
-            self.flipped[flip.rule.type].remove(flip)
-        except ValueError:
-            pass
+        self.flip_states[flip.rule.type].pop(utils.remote_rule_key(flip), None)
+        self._lock.release()
+
+    def get_unsent_flips(self):
+        '''
+          Gets the active flips whose requests haven't gone to the hub yet, i.e.
+          new flips and those that couldn't be sent before (e.g. the remote
+          gateway's public key wasn't available).
+
+          @return the flips to send, in the order they were flipped
+          @rtype gateway_msgs.msg.RemoteRule[]
+        '''
+        unsent_flips = []
+        self._lock.acquire()
+        for connection_type in utils.connection_types:
+            unsent_flips.extend([flip_state.remote_rule for flip_state in self.flip_states[connection_type].values()
+                                 if not flip_state.sent])
+        self._lock.release()
+        return unsent_flips
+
+    def mark_flips_sent(self, flips):
+        '''
+          Note that the flip requests for these flips are now on the hub.
+
+          @param flips : the flips that were sent
+          @type gateway_msgs.msg.RemoteRule[]
+        '''
+        self._lock.acquire()
+        for flip in flips:
+            flip_state = self.flip_states[flip.rule.type].get(utils.remote_rule_key(flip), None)
+            if flip_state is not None:
+                flip_state.sent = True
         self._lock.release()
 
     ##########################################################################
     # Utility Methods
     ##########################################################################
 
-    def _generate_flips(self, connection_type, name, node, remote_gateways, unique_name, master):
+    def _generate_flips(self, connection_type, name, node, rule_index, master):
         '''
           Checks if a local rule (obtained from master.get_system_state)
           is a suitable association with any of the rules or patterns. This can
@@ -206,8 +287,8 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
           @param node : ros node name (coming from master.get_system_state)
           @type str
 
-          @param gateways : gateways that are available (registered on the hub)
-          @type string
+          @param rule_index : the compiled watchlist, with gateways already resolved
+          @type interactive_interface.RuleIndex
 
           @param master : local master
           @type rocon_gateway.LocalMaster
@@ -216,96 +297,85 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
           @return list of RemoteRule objects updated with node names from self.watchlist
         '''
         matched_flip_rules = []
-        for flip_rule in self.watchlist[connection_type]:
+        for indexed_rule in rule_index.match(connection_type, name, node):
             # Check if the flip rule corresponds to an existing gateway
-            matched_gateways = self._get_matched_gateways(flip_rule, remote_gateways)
-            if not matched_gateways:
-                continue
-
-            # Check names
-            rule_name = flip_rule.rule.name
-            matched = self.is_matched(flip_rule, rule_name, name, node)
-
-            if not utils.is_all_pattern(flip_rule.rule.name):
-                if not matched:
-                    rule_name = '/' + unique_name + '/' + flip_rule.rule.name
-                    matched = self.is_matched(flip_rule, rule_name, name, node)
-
-                # If it is still not matching
-                if not matched:
-                    rule_name = '/' + flip_rule.rule.name
-                    matched = self.is_matched(flip_rule, rule_name, name, node)
-
-            if matched:
-                for gateway in matched_gateways:
-                    try:
-                        matched_flip = copy.deepcopy(flip_rule)
-                        matched_flip.gateway = gateway  # just in case we used a regex or matched basename
-                        matched_flip.rule.name = name  # just in case we used a regex
-                        matched_flip.rule.node = "%s,%s"%(node, master.lookupNode(node))  # just in case we used a regex
-                        matched_flip_rules.append(matched_flip)
-                    except rosgraph.masterapi.MasterError as e:
-                        # Node has been gone already. skips sliently
-                        pass
-                    except socket.error as e:
-                        rospy.logwarn("Gateway : socket error while generate flips [%s]"%str(e))
+            for gateway in indexed_rule.matched_gateways:
+                try:
+                    # gateway, name and node set just in case we used a regex or matched basename
+                    matched_flip_rules.append(RemoteRule(gateway, Rule(indexed_rule.remote_rule.rule.type, name,
+                                                                       "%s,%s" % (node, master.lookup_node_uri(node)))))
+                except rosgraph.masterapi.MasterError as e:
+                    # Node has been gone already. skips sliently
+                    pass
+                except socket.error as e:
+                    rospy.logwarn("Gateway : socket error while generate flips [%s]"%str(e))
+                    self._match_failed = True  # don't trust the cached matches, redo them next time
         return matched_flip_rules
 
-    def _prune_unavailable_gateway_flips(self, flipped, remote_gateways):
-        # Prune locally cached flip list for flips that have lost their remotes, keep the rules though
+    def _name_variants(self, rule_name, unique_name):
+        '''
+          The flip all pattern only ever gets checked as is.
+        '''
+        if utils.is_all_pattern(rule_name):
+            return [rule_name]
+        return interactive_interface.InteractiveInterface._name_variants(self, rule_name, unique_name)
+
+    def _prune_unavailable_gateway_flips(self, remote_gateways):
+        # Prune locally cached flips that have lost their remotes, keep the rules though
+        remote_gateways = set(remote_gateways)
         for connection_type in utils.connection_types:
             # flip.gateway is a hash name, so is the remote_gateways list
-            flipped[connection_type] = [flip for flip in self.flipped[connection_type] if flip.gateway in remote_gateways]
-        return flipped
+            self.flip_states[connection_type] = dict(
+                (key, flip_state) for key, flip_state in self.flip_states[connection_type].items()
+                if flip_state.remote_rule.gateway in remote_gateways)
+
+    def _update_matches(self, connections, added_connections, lost_connections, remote_gateways, unique_name, master):
+        '''
+          Bring the cached flip rule matches for each local connection up to date.
+          Note, don't need to lock here as the update() function takes care of it.
+        '''
+        match_context = (self.rules_version, frozenset(remote_gateways))
+        if added_connections is None or lost_connections is None or \
+           match_context != self._match_context or self._match_failed:
+            # match everything from scratch
+            self._match_context = match_context
+            self._match_failed = False
+            self._matches = utils.create_empty_connection_type_dictionary(dict)
+            added_connections = connections
+            lost_connections = utils.create_empty_connection_type_dictionary(set)
+        rule_index = self.get_rule_index(unique_name)
+        rule_index.resolve_gateways(remote_gateways)
+        for connection_type in utils.connection_types:
+            matches = self._matches[connection_type]
+            for connection in lost_connections[connection_type]:
+                matches.pop(connection, None)
+            for connection in added_connections[connection_type]:
+                matched_flip_rules = self._generate_flips(connection.rule.type, connection.rule.name, connection.rule.node, rule_index, master)
+                if matched_flip_rules:
+                    matches[connection] = matched_flip_rules
+
+    def _prepare_flips(self):
+        '''
+          Collect the flips for the current matches and compare them with those
+          currently active.
 
-    def _prepare_flips(self, connections, remote_gateways, unique_name, master):
+          @return new_flips, removed_flips, flipped (keyed by their remote rule key)
+          @rtype connection type keyed dictionaries of RemoteRule lists, RemoteRule lists and dicts
+        '''
         # Variable preparations
-        flipped         = utils.create_empty_connection_type_dictionary()
+        flipped         = utils.create_empty_connection_type_dictionary(dict)
         new_flips       = utils.create_empty_connection_type_dictionary()
         removed_flips   = utils.create_empty_connection_type_dictionary()
 
-        for connection_type in connections:
-            for connection in connections[connection_type]:
-                matched_flip_rules = self._generate_flips(connection.rule.type, connection.rule.name, connection.rule.node, remote_gateways, unique_name, master)
-                flipped[connection_type].extend(matched_flip_rules)
-
-            new_flips[connection_type] = utils.difflist(flipped[connection_type], self.flipped[connection_type])
-            removed_flips[connection_type] = utils.difflist(self.flipped[connection_type], flipped[connection_type])
-        return new_flips, removed_flips, flipped
-
-    def _prepare_flip_status(self, flipped):
-        flip_status     = utils.create_empty_connection_type_dictionary()
-
-        # set flip status to unknown first, and then read previous status if available
         for connection_type in utils.connection_types:
-            flip_status[connection_type] = [RemoteRuleWithStatus.UNKNOWN] * len(flipped[connection_type])
-
-        for connection_type in utils.connection_types:
-            #rospy.loginfo("flip_status[{ct}] = {f}".format(ct=connection_type, f=flip_status[connection_type]))
-            #rospy.loginfo("flipped[{ct}] = {f}".format(ct=connection_type, f=flipped[connection_type]))
-            for new_index, flip in enumerate(flipped[connection_type]):
-                try:
-                    index = self.flipped[connection_type].index(flip)
-                    flip_status[connection_type][new_index] = self.flip_status[connection_type][index]
-                    #rospy.loginfo("flipped[{idx}].status == {status}".format(idx=new_index, status=flip_status[connection_type][new_index]))
-                except:
-                    # The new flip probably did not exist. Let it remain unknown
-                    pass
-        self.flip_status = copy.deepcopy(flip_status)
-
-        return flip_status
-
-    def _get_matched_gateways(self, flip_rule, remote_gateways):
-        matched_gateways = []
-        for gateway in remote_gateways:
-            # check for regular expression or perfect match
-            gateway_match_result = re.match(flip_rule.gateway, gateway)
-            if gateway_match_result and gateway_match_result.group() == gateway:
-                matched_gateways.append(gateway)
-            elif flip_rule.gateway == rocon_gateway_utils.gateway_basename(gateway):
-                matched_gateways.append(gateway)
-        return matched_gateways
-
+            for matched_flip_rules in self._matches[connection_type].values():
+                for flip in matched_flip_rules:
+                    flipped[connection_type].setdefault(utils.remote_rule_key(flip), flip)
+            flip_states = self.flip_states[connection_type]
+            new_flips[connection_type] = [flip for key, flip in flipped[connection_type].items() if key not in flip_states]
+            removed_flips[connection_type] = [flip_state.remote_rule for key, flip_state in flip_states.items()
+                                              if key not in flipped[connection_type]]
+        return new_flips, removed_flips, flipped
 
     ##########################################################################
     # Accessors for Gateway Info
@@ -318,9 +388,11 @@ class FlippedInterface(interactive_interface.InteractiveInterface):
           @rtype RemoteRule[]
         '''
         flipped_connections = []
+        self._lock.acquire()
         for connection_type in utils.connection_types:
-            for i, connection in enumerate(self.flipped[connection_type]):
-                flipped_connections.append(RemoteRuleWithStatus(connection, self.flip_status[connection_type][i]))
+            for flip_state in self.flip_states[connection_type].values():
+                flipped_connections.append(RemoteRuleWithStatus(flip_state.remote_rule, flip_state.status))
+        self._lock.release()
         return flipped_connections
 
 
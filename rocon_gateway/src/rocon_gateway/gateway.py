@@ -13,6 +13,7 @@ import os
 import threading
 
 import rospy
+import diagnostic_msgs.msg as diagnostic_msgs
 import gateway_msgs.msg as gateway_msgs
 import gateway_msgs.srv as gateway_srvs
 import rocon_python_comms
@@ -27,6 +28,29 @@ from .public_interface import PublicInterface
 from .pulled_interface import PulledInterface
 from .master_api import LocalMaster
 from .network_interface_manager import NetworkInterfaceManager
+from .scheduler import WatcherScheduler
+from .gateway_hub import NOTIFY_FLIP_INS, NOTIFY_FLIP_STATUS, NOTIFY_ADVERTISEMENTS, NOTIFY_GATEWAYS, \
+    NOTIFY_PUBLIC_KEYS
+
+###############################################################################
+# Constants
+###############################################################################
+
+# The watcher stages that need to be rerun for each kind of update trigger
+_update_reason_stages = {
+    # local master
+    'local_connections': ['flipped', 'public', 'pulled'],
+    # hub notifications
+    NOTIFY_FLIP_INS: ['flip_ins'],
+    NOTIFY_FLIP_STATUS: ['flipped'],
+    NOTIFY_ADVERTISEMENTS: ['pulled'],
+    NOTIFY_GATEWAYS: ['remote_gateway_index'],
+    NOTIFY_PUBLIC_KEYS: ['flipped'],
+    # ros api
+    'advertise': ['public'],
+    'flip': ['flipped'],
+    'pull': ['pulled'],
+}
 
 ###############################################################################
 # Thread
@@ -39,7 +63,8 @@ class Gateway(object):
       Used to synchronise with hubs.
     '''
 
-    def __init__(self, hub_manager, param, unique_name, publish_gateway_info_callback):
+    def __init__(self, hub_manager, param, unique_name, publish_gateway_info_callback,
+                 publish_statistics_callback=None):
         '''
         @param hub_manager : container for all the hubs this gateway connects to
         @type hub_api.HubManmager
@@ -50,13 +75,20 @@ class Gateway(object):
         @param unique_name : gateway name (param['name']) with unique uuid hash appended
 
         @param publish_gateway_info_callback : callback for publishing gateway info
+
+        @param publish_statistics_callback : callback for publishing the watcher statistics
         '''
         self.hub_manager = hub_manager
+        self._param = param
+        self._unique_name = unique_name
+        self._publish_statistics = publish_statistics_callback
+        self._setup_scheduler()  # before the local master, its callbacks trigger updates
+        self._remote_gateway_hub_index = {}
         self.master = None
         # handling slow startup timeout
         while self.master is None:
             try:
-                self.master = LocalMaster()
+                self.master = LocalMaster(connection_change_hook=self._local_connections_changed)
             except rocon_python_comms.NotFoundException as exc:
                 rospy.logwarn(str(exc))
                 rospy.logwarn("Cannot create Gateway's LocalMaster. Retrying...")
@@ -64,8 +96,6 @@ class Gateway(object):
             rospy.rostime.wallsleep(1)
 
         self.ip = self.master.get_ros_ip()  # gateway is always assumed to sit on the same ip as the master
-        self._param = param
-        self._unique_name = unique_name
         self._publish_gateway_info = publish_gateway_info_callback
         default_rule_blacklist = ros_parameters.generate_rules(self._param["default_blacklist"])
         default_rules, all_targets = ros_parameters.generate_remote_rules(self._param["default_flips"])
@@ -86,29 +116,117 @@ class Gateway(object):
             self.public_interface.advertise_all([])
 
         self.network_interface_manager = NetworkInterfaceManager(self._param['network_interface'])
-        # TODO : Use self._param['watch_loop_period'] to set the connection_cache spin freq ( OR directly in connection_cache node ) ?
+        rospy.on_shutdown(self.scheduler.wakeup)
+
+    def _setup_scheduler(self):
+        '''
+          Splits the update pipeline into stages that run at their own cadence
+          (see the watcher_periods parameter) so cheap, urgent stages (pinging the hub,
+          accepting flip ins) don't wait on the expensive ones.
+        '''
+        periods = self._param['watcher_periods']
+        self.scheduler = WatcherScheduler(self._param['statistics_window'], self.hub_manager.round_trips)
+        self.scheduler.add_stage('hub_ping', periods['hub_ping'], self.hub_manager.refresh_ping)
+        self.scheduler.add_stage('network_statistics', periods['network_statistics'], self.update_network_information)
+        self.scheduler.add_stage('remote_gateway_index', periods['remote_gateway_index'], self._update_remote_gateway_hub_index)
+        self.scheduler.add_stage('flipped', periods['flipped'], self._update_flipped_stage)
+        self.scheduler.add_stage('public', periods['public'], self._update_public_stage)
+        self.scheduler.add_stage('pulled', periods['pulled'], self._update_pulled_stage)
+        self.scheduler.add_stage('flip_ins', periods['flip_ins'], self._update_flipped_in_stage)
+        if self._publish_statistics is not None:
+            self.scheduler.add_stage('statistics', periods['statistics'], self._publish_statistics)
+
+    def get_statistics(self):
+        '''
+          Timing statistics for each of the watcher stages (see WatcherStage.statistics).
+
+          @return one status per stage, warning if the stage's 95th percentile run time
+                  exceeds its period
+          @rtype diagnostic_msgs.DiagnosticStatus[]
+        '''
+        statuses = []
+        for stage in self.scheduler.stages():
+            statistics = stage.statistics()
+            status = diagnostic_msgs.DiagnosticStatus()
+            status.name = "gateway: %s" % stage.name
+            status.hardware_id = self._unique_name
+            if statistics['duration_p95'] > stage.period:
+                status.level = diagnostic_msgs.DiagnosticStatus.WARN
+                status.message = "95th percentile run time exceeds the stage period"
+            else:
+                status.level = diagnostic_msgs.DiagnosticStatus.OK
+                status.message = "ok"
+            for key in sorted(statistics.keys()):
+                status.values.append(diagnostic_msgs.KeyValue(key, str(statistics[key])))
+            statuses.append(status)
+        return statuses
+
+    def trigger_update(self, reason=None):
+        '''
+          Wake up the watcher so that the stages affected by the reason get run
+          immediately. Safe to call from any thread (connection cache callbacks,
+          hub notification listeners, ros service handlers).
+
+          @param reason : what triggered the update, one of the keys of _update_reason_stages
+                 (unknown reasons or None flag every stage)
+          @type str
+        '''
+        if isinstance(reason, bytes):  # payloads straight off a redis notification channel
+            reason = reason.decode()
+        rospy.logdebug("Gateway : update triggered [%s]" % reason)
+        self.scheduler.mark_dirty(_update_reason_stages.get(reason, None))
 
     def spin(self):
+        '''
+          Event driven watcher loop. Each stage of the update pipeline runs
+          whenever it has been flagged by a trigger, or at the latest every
+          period as a fallback resync in case a notification went missing.
+        '''
         if not rospy.core.is_initialized():
             raise rospy.exceptions.ROSInitException("client code must call rospy.init_node() first")
         rospy.logdebug("node[%s, %s] entering spin(), pid[%s]", rospy.core.get_caller_id(), rospy.core.get_node_uri(), os.getpid())
         try:
-            while not rospy.core.is_shutdown():
-                self.update_network_information()
-                remote_gateway_hub_index = self.hub_manager.create_remote_gateway_hub_index()
-
-                with self.master.get_connection_state() as connections:
-                    self.update_flipped_interface(connections, remote_gateway_hub_index)
-                    self.update_public_interface(connections)
-                    self.update_pulled_interface(connections, remote_gateway_hub_index)
-
-                registrations = self.hub_manager.get_flip_requests()
-                self.update_flipped_in_interface(registrations, remote_gateway_hub_index)
-                rospy.rostime.wallsleep(1)
+            self.scheduler.spin()
         except KeyboardInterrupt:
             rospy.logdebug("keyboard interrupt, shutting down")
             rospy.core.signal_shutdown('keyboard interrupt')
 
+    ##########################################################################
+    # Watcher Stages
+    ##########################################################################
+
+    def _local_connections_changed(self):
+        '''
+          Connection cache hook, called when the local master's system state has changed.
+        '''
+        self.trigger_update('local_connections')
+
+    def _update_remote_gateway_hub_index(self):
+        '''
+          Refresh the cached remote gateway-hub index, flagging the stages that depend
+          on it if it has changed.
+        '''
+        remote_gateway_hub_index = self.hub_manager.create_remote_gateway_hub_index()
+        if remote_gateway_hub_index != self._remote_gateway_hub_index:
+            self._remote_gateway_hub_index = remote_gateway_hub_index
+            self.scheduler.mark_dirty(['flipped', 'pulled', 'flip_ins'])
+
+    def _update_flipped_stage(self):
+        with self.master.get_connection_changes('flipped') as (connections, added, lost):
+            self.update_flipped_interface(connections, self._remote_gateway_hub_index, added, lost)
+
+    def _update_public_stage(self):
+        with self.master.get_connection_changes('public') as (connections, added, lost):
+            self.update_public_interface(connections, added, lost)
+
+    def _update_pulled_stage(self):
+        with self.master.get_connection_state() as connections:
+            self.update_pulled_interface(connections, self._remote_gateway_hub_index)
+
+    def _update_flipped_in_stage(self):
+        registrations = self.hub_manager.get_flip_requests()
+        self.update_flipped_in_interface(registrations, self._remote_gateway_hub_index)
+
     def is_connected(self):
         '''
           We often check if we're connected to any hubs often just to ensure we
@@ -128,12 +246,14 @@ class Gateway(object):
         '''
         self.hub_manager.disengage_hub(hub)
         self._publish_gateway_info()
+        self.trigger_update('hub disengaged')
 
     ###############################################################################
     # Update interface states (jobs assigned from connection_cache callback thread)
     ###############################################################################
 
-    def update_flipped_interface(self, local_connection_index, remote_gateway_hub_index):
+    def update_flipped_interface(self, local_connection_index, remote_gateway_hub_index,
+                                 added_connections=None, lost_connections=None):
         """
           Process the list of local connections and check against
           the current flip rules and patterns for changes. If a rule
@@ -144,16 +264,24 @@ class Gateway(object):
 
           @param gateways : list of remote gateway string id's
           @type string
+
+          @param added_connections, lost_connections : local connection changes since the last
+                 update, None if the flipped interface has to rescan all local connections
+          @type : dictionary of ConnectionType.xxx keyed sets of utils.Connections
         """
         state_changed = False
 
         # Get flip status of existing requests, and remove those requests that need to be resent
         flipped_connections = self.flipped_interface.get_flipped_connections()
+        flip_status_indices = self._get_flip_status_indices(flipped_connections, remote_gateway_hub_index)
+        # targets that flips/unflips are sent to, their statuses need refreshing afterwards
+        updated_targets = set()
         for flip in flipped_connections:
             if flip.remote_rule.gateway in remote_gateway_hub_index:
                 for hub in remote_gateway_hub_index[flip.remote_rule.gateway]:
-                    status = hub.get_flip_request_status(flip.remote_rule)
+                    status = hub.resolve_flip_request_status(flip_status_indices[hub.uri], flip.remote_rule)
                     if status == FlipStatus.RESEND:
+                        updated_targets.add(flip.remote_rule.gateway)
                         rospy.loginfo("Gateway : resend requested for flip request [%s]%s" %
                                       (flip.remote_rule.gateway, utils.format_rule(flip.remote_rule.rule)))
                         # Remove the flip, so that it will be resent as part of new_flips
@@ -166,33 +294,14 @@ class Gateway(object):
                         break
 
         new_flips, lost_flips = self.flipped_interface.update(
-            local_connection_index, remote_gateway_hub_index, self._unique_name, self.master)
+            local_connection_index, remote_gateway_hub_index, self._unique_name, self.master,
+            added_connections, lost_connections)
         for connection_type in utils.connection_types:
-            for flip in new_flips[connection_type]:
-                firewall_flag = self.hub_manager.get_remote_gateway_firewall_flag(flip.gateway)
-                if firewall_flag:
-                    continue
+            if new_flips[connection_type]:
                 state_changed = True
-                # for actions, need to post flip details here
-                connections = self.master.generate_connection_details(flip.rule.type, flip.rule.name, flip.rule.node)
-                if (connection_type == gateway_msgs.ConnectionType.ACTION_CLIENT or
-                        connection_type == gateway_msgs.ConnectionType.ACTION_SERVER):
-                    rospy.loginfo("Gateway : sending flip request [%s]%s" %
-                                  (flip.gateway, utils.format_rule(flip.rule)))
-                    hub = remote_gateway_hub_index[flip.gateway][0]
-                    hub.post_flip_details(flip.gateway, flip.rule.name, flip.rule.type, flip.rule.node)
-                    for connection in connections:
-                        hub.send_flip_request(flip.gateway, connection)  # flip the individual pubs/subs
-                else:
-                    for connection in connections:
-                        rospy.loginfo("Gateway : sending flip request [%s]%s" %
-                                      (flip.gateway, utils.format_rule(flip.rule)))
-                        hub = remote_gateway_hub_index[flip.gateway][0]
-                        hub.send_flip_request(flip.gateway, connection)
-                        hub.post_flip_details(
-                            flip.gateway, flip.rule.name, flip.rule.type, flip.rule.node)
             for flip in lost_flips[connection_type]:
                 state_changed = True
+                updated_targets.add(flip.gateway)
                 rospy.loginfo("Gateway : sending unflip request [%s]%s" % (flip.gateway, utils.format_rule(flip.rule)))
                 for hub in remote_gateway_hub_index[flip.gateway]:
                     rule = copy.deepcopy(flip.rule)
@@ -200,15 +309,37 @@ class Gateway(object):
                         # This hub was used to send the original flip request
                         hub.remove_flip_details(flip.gateway, flip.rule.name, flip.rule.type, flip.rule.node)
                         break
+        # new flips, and those that couldn't be sent before, are gathered up and sent in bulk for each target
+        unsent_flips_by_target = {}
+        firewall_flags = {}
+        for flip in self.flipped_interface.get_unsent_flips():
+            if flip.gateway not in firewall_flags:
+                firewall_flags[flip.gateway] = self.hub_manager.get_remote_gateway_firewall_flag(flip.gateway)
+            if firewall_flags[flip.gateway]:
+                continue
+            # for actions, these are the individual pubs/subs
+            connections = self.master.generate_connection_details(flip.rule.type, flip.rule.name, flip.rule.node)
+            unsent_flips_by_target.setdefault(flip.gateway, []).append((flip, connections))
+        for target, flips in unsent_flips_by_target.items():
+            hub = remote_gateway_hub_index[target][0]
+            if hub.send_flip_requests(target, [(flip.rule, connections) for flip, connections in flips]):
+                for flip, unused_connections in flips:
+                    rospy.loginfo("Gateway : sent flip request [%s]%s" % (target, utils.format_rule(flip.rule)))
+                self.flipped_interface.mark_flips_sent([flip for flip, unused_connections in flips])
+                state_changed = True
+                updated_targets.add(target)
+            # else the remote gateway's public key isn't available (yet), they stay pending and get retried
 
         # Update flip status
         flipped_connections = self.flipped_interface.get_flipped_connections()
-        # rospy.loginfo("flipped_connections = {}".format(flipped_connections))
+        # only need to go back to the hubs for targets whose flip requests we've just changed
+        for hub_uri, status_index in self._get_flip_status_indices(
+                flipped_connections, remote_gateway_hub_index, updated_targets).items():
+            flip_status_indices[hub_uri].update(status_index)
         for flip in flipped_connections:
             for hub in remote_gateway_hub_index[flip.remote_rule.gateway]:
-                remote_rule = copy.deepcopy(flip.remote_rule)
-                remote_rule.rule.node = remote_rule.rule.node.split(",")[0]  # get only node name, the xmlrpc_uri is not serialised
-                status = hub.get_flip_request_status(remote_rule)
+                # the xmlrpc_uri in the node is not serialised, resolve_flip_request_status takes care of it
+                status = hub.resolve_flip_request_status(flip_status_indices.get(hub.uri, {}), flip.remote_rule)
                 if status is not None:
                     flip_state_changed = self.flipped_interface.update_flip_status(flip.remote_rule, status)
                     state_changed = state_changed or flip_state_changed
@@ -217,6 +348,35 @@ class Gateway(object):
         if state_changed:
             self._publish_gateway_info()
 
+    def _get_flip_status_indices(self, flipped_connections, remote_gateway_hub_index, targets=None):
+        '''
+          Retrieve the status of our flip requests from each hub, with a
+          single round trip per hub, covering all the targets it serves.
+
+          @param flipped_connections : the flips to retrieve statuses for
+          @type gateway_msgs.msg.RemoteRuleWithStatus[]
+          @param remote_gateway_hub_index : key-value remote gateway name-hub list pairs
+          @type dictionary of remote_gateway_name-list of hub_api.Hub objects key-value pairs
+          @param targets : only retrieve statuses for these targets (all if None)
+          @type set of str
+
+          @return flip request status indices (see GatewayHub.get_flip_request_status_index)
+          @rtype dict of hub uri : status index
+        '''
+        hubs = {}
+        hub_targets = {}
+        for flip in flipped_connections:
+            gateway = flip.remote_rule.gateway
+            if targets is not None and gateway not in targets:
+                continue
+            for hub in remote_gateway_hub_index.get(gateway, []):
+                hubs[hub.uri] = hub
+                hub_targets.setdefault(hub.uri, set()).add(gateway)
+        flip_status_indices = dict([(hub_uri, {}) for hub_uri in hubs])
+        for hub_uri, hub in hubs.items():
+            flip_status_indices[hub_uri] = hub.get_flip_request_status_index(hub_targets[hub_uri])
+        return flip_status_indices
+
     def update_pulled_interface(self, unused_connections, remote_gateway_hub_index):
         """
           Process the list of local connections and check against
@@ -236,59 +396,64 @@ class Gateway(object):
         """
         state_changed = False
         remote_connections = {}
-        for remote_gateway in remote_gateway_hub_index.keys() + self.pulled_interface.list_remote_gateway_names():
+        # the same connections, keyed as per utils.remote_rule_key for resolving new pulls
+        remote_connection_index = {}
+        # one (mostly cached) batch per hub
+        hub_remote_gateways = {}  # hub uri : (hub, remote gateways)
+        for remote_gateway in set(list(remote_gateway_hub_index.keys()) + self.pulled_interface.list_remote_gateway_names()):
             remote_connections[remote_gateway] = {}
-            try:
-                for hub in remote_gateway_hub_index[remote_gateway]:
-                    remote_connections[remote_gateway].update(hub.get_remote_connection_state(remote_gateway))
-            except KeyError:
-                pass  # remote gateway no longer exists on the hub network
+            # remote gateways no longer on the hub network just get an empty state
+            for hub in remote_gateway_hub_index.get(remote_gateway, []):
+                hub_remote_gateways.setdefault(hub.uri, (hub, []))[1].append(remote_gateway)
+        for hub, remote_gateways in hub_remote_gateways.values():
+            for remote_gateway, state in hub.get_remote_connection_states(remote_gateways).items():
+                remote_connections[remote_gateway].update(state)
+        for remote_gateway in remote_connections:
+            for connections in remote_connections[remote_gateway].values():
+                for connection in connections:
+                    remote_connection_index[(remote_gateway, connection.rule.type,
+                                             connection.rule.name, connection.rule.node)] = connection
         new_pulls, lost_pulls = self.pulled_interface.update(remote_connections, self._unique_name)
+        registration_index = self.pulled_interface.get_registration_index()
+        new_pull_registrations = {}  # utils.remote_rule_key : (pull, utils.Registration)
+        lost_registrations = []
         for connection_type in utils.connection_types:
             for pull in new_pulls[connection_type]:
-                # dig out the corresponding connection (bit inefficient plouging back into this again
-                connection = None
-                for remote_gateway in remote_connections.keys():
-                    for c in remote_connections[remote_gateway][pull.rule.type]:
-                        if c.rule.name == pull.rule.name and \
-                           c.rule.node == pull.rule.node:
-                            connection = c
-                            break
-                    if connection:
-                        break
-                # Register this pull
-                existing_registration = self.pulled_interface.find_registration_match(
-                    pull.gateway, pull.rule.name, pull.rule.node, pull.rule.type)
-                if not existing_registration:
+                key = utils.remote_rule_key(pull)
+                if key not in registration_index and key not in new_pull_registrations:
                     rospy.loginfo("Gateway : pulling in connection %s[%s]" %
-                                  (utils.format_rule(pull.rule), remote_gateway))
-                    registration = utils.Registration(connection, pull.gateway)
-                    new_registration = self.master.register(registration)
-                    if new_registration is not None:
-                        self.pulled_interface.registrations[registration.connection.rule.type].append(new_registration)
-                        hub = remote_gateway_hub_index[pull.gateway][0]
-                        hub.post_pull_details(pull.gateway, pull.rule.name, pull.rule.type, pull.rule.node)
-                        state_changed = True
+                                  (utils.format_rule(pull.rule), pull.gateway))
+                    new_pull_registrations[key] = (pull, utils.Registration(remote_connection_index[key], pull.gateway))
             for pull in lost_pulls[connection_type]:
-                # Unregister this pull
-                existing_registration = self.pulled_interface.find_registration_match(
-                    pull.gateway, pull.rule.name, pull.rule.node, pull.rule.type)
+                existing_registration = registration_index.pop(utils.remote_rule_key(pull), None)
                 if existing_registration:
                     rospy.loginfo("Gateway : abandoning pulled connection %s[%s]" % (
                         utils.format_rule(pull.rule), pull.gateway))
-                    self.master.unregister(existing_registration)
-                    # This code was here, but causing bugs...actually it should never remove details from the hub,
-                    # that is the responsibility of the advertising gateway. TODO confirm this.
-                    #hub = remote_gateway_hub_index[pull.gateway][0]
-                    # if hub:
-                    #    hub.remove_pull_details(pull.gateway, pull.rule.name, pull.rule.type, pull.rule.node)
-                    self.pulled_interface.registrations[
-                        existing_registration.connection.rule.type].remove(existing_registration)
-                    state_changed = True
+                    lost_registrations.append(existing_registration)
+        # Unregister/register with the local master in batches
+        if lost_registrations:
+            self.master.unregister_multiple(lost_registrations)
+            # This code was here, but causing bugs...actually it should never remove details from the hub,
+            # that is the responsibility of the advertising gateway. TODO confirm this.
+            #hub = remote_gateway_hub_index[pull.gateway][0]
+            # if hub:
+            #    hub.remove_pull_details(pull.gateway, pull.rule.name, pull.rule.type, pull.rule.node)
+            for existing_registration in lost_registrations:
+                self.pulled_interface.remove_registration(existing_registration)
+            state_changed = True
+        new_pulls_and_registrations = list(new_pull_registrations.values())
+        new_registrations = self.master.register_multiple(
+            [registration for (unused_pull, registration) in new_pulls_and_registrations])
+        for (pull, unused_registration), new_registration in zip(new_pulls_and_registrations, new_registrations):
+            if new_registration is not None:
+                self.pulled_interface.add_registration(new_registration)
+                hub = remote_gateway_hub_index[pull.gateway][0]
+                hub.post_pull_details(pull.gateway, pull.rule.name, pull.rule.type, pull.rule.node)
+                state_changed = True
         if state_changed:
             self._publish_gateway_info()
 
-    def update_public_interface(self, local_connection_index):
+    def update_public_interface(self, local_connection_index, added_connections=None, lost_connections=None):
         """
           Process the list of local connections and check against
           the current rules and patterns for changes. If a rule
@@ -296,11 +461,16 @@ class Gateway(object):
 
           @param local_connection_index : list of current local connections parsed from the master
           @type : { utils.ConnectionType.xxx : utils.Connection[] } dictionaries
+
+          @param added_connections, lost_connections : local connection changes since the last
+                 update, None if the public interface has to rescan all local connections
+          @type : { utils.ConnectionType.xxx : utils.Connection[] } dictionaries
         """
         state_changed = False
         # new_conns, lost_conns are of type { gateway_msgs.ConnectionType.xxx : utils.Connection[] }
         new_conns, lost_conns = self.public_interface.update(
-            local_connection_index, self.master.generate_advertisement_connection_details)
+            local_connection_index, self.master.generate_advertisement_connection_details,
+            added_connections, lost_connections)
         # public_interface is of type gateway_msgs.Rule[]
         public_interface = self.public_interface.getInterface()
         for connection_type in utils.connection_types:
@@ -349,21 +519,36 @@ class Gateway(object):
             return
 
         state_changed = False
-
-        # Add new registrations
+        incoming_registrations = dict((utils.registration_key(registration), registration)
+                                      for (registration, unused_status) in registrations)
+
+        # Remove local registrations that are no longer flipped to this gateway, or whose
+        # connection details (e.g. xmlrpc uri) have changed - they get re-registered below.
+        lost_registrations = []
+        for (key, local_registration) in self.flipped_interface.get_registration_index().items():
+            incoming_registration = incoming_registrations.get(key, None)
+            if incoming_registration is None or incoming_registration.connection != local_registration.connection:
+                rospy.loginfo("Gateway : unflipping received flip %s" % str(local_registration))
+                lost_registrations.append(local_registration)
+        if lost_registrations:
+            state_changed = True
+            self.master.unregister_multiple(lost_registrations)
+            for local_registration in lost_registrations:
+                self.flipped_interface.remove_registration(local_registration)
+
+        # Add new registrations (all registered with the local master in one batch)
+        new_registrations = {}
         for (registration, status) in registrations:
+            key = utils.registration_key(registration)
             # probably not necessary as the flipping gateway will already check this
             existing_registration = self.flipped_interface.find_registration_match(
                 registration.remote_gateway,
                 registration.connection.rule.name,
                 registration.connection.rule.node,
                 registration.connection.rule.type)
-            if not existing_registration:
+            if not existing_registration and key not in new_registrations:
                 rospy.loginfo("Gateway : received a flip request %s" % str(registration))
-                state_changed = True
-                new_registration = self.master.register(registration)
-                if new_registration is not None:
-                    self.flipped_interface.registrations[registration.connection.rule.type].append(new_registration)
+                new_registrations[key] = registration
             # Update this flip's status
             if status != FlipStatus.ACCEPTED:
                 for hub in remote_gateway_hub_index[registration.remote_gateway]:
@@ -371,29 +556,17 @@ class Gateway(object):
                         update_flip_status[hub.uri] = []
                     update_flip_status[hub.uri].append((registration, FlipStatus.ACCEPTED))
 
+        if new_registrations:
+            state_changed = True
+            for new_registration in self.master.register_multiple(list(new_registrations.values())):
+                if new_registration is not None:
+                    self.flipped_interface.add_registration(new_registration)
+
         # Update the flip status for newly added registrations
         for hub_uri, hub in hubs.iteritems():
             if hub_uri in update_flip_status:
                 hub.update_multiple_flip_request_status(update_flip_status[hub_uri])
 
-        # Remove local registrations that are no longer flipped to this gateway
-        local_registrations = copy.deepcopy(self.flipped_interface.registrations)
-        for connection_type in utils.connection_types:
-            for local_registration in local_registrations[connection_type]:
-                matched_registration = None
-                for (registration, status) in registrations:
-                    if registration.connection == local_registration.connection and \
-                       registration.remote_gateway == local_registration.remote_gateway:
-                        matched_registration = registration
-                        break
-                    else:
-                        continue
-                if matched_registration is None:
-                    state_changed = True
-                    rospy.loginfo("Gateway : unflipping received flip %s" % str(local_registration))
-                    self.master.unregister(local_registration)
-                    self.flipped_interface.registrations[connection_type].remove(local_registration)
-
         if state_changed:
             self._publish_gateway_info()
 
@@ -425,11 +598,12 @@ class Gateway(object):
     #     self.watcher_thread.set_watch_loop_period(request.period)
     #     return gateway_srvs.SetWatcherPeriodResponse(self.watcher_thread.get_watch_loop_period())
     #
-    # def ros_subscriber_force_update(self, data):
-    #     '''
-    #       Trigger a watcher loop update
-    #     '''
-    #     self.watcher_thread.trigger_update = True
+
+    def ros_subscriber_force_update(self, data):
+        '''
+          Trigger a watcher loop update
+        '''
+        self.trigger_update('force_update')
 
     def ros_service_advertise(self, request):
         '''
@@ -464,7 +638,7 @@ class Gateway(object):
 
         # Let the watcher get on with the update asap
         if response.result == gateway_msgs.ErrorCodes.SUCCESS:
-            #self.watcher_thread.trigger_update = True
+            self.trigger_update('advertise')
             self._publish_gateway_info()
         else:
             rospy.logerr("Gateway : %s." % response.error_message)
@@ -497,7 +671,7 @@ class Gateway(object):
 
         # Let the watcher get on with the update asap
         if response.result == gateway_msgs.ErrorCodes.SUCCESS:
-            #self.watcher_thread.trigger_update = True
+            self.trigger_update('advertise')
             self._publish_gateway_info()
         else:
             rospy.logerr("Gateway : %s." % response.error_message)
@@ -532,7 +706,7 @@ class Gateway(object):
         # Post processing
         if response.result == gateway_msgs.ErrorCodes.SUCCESS:
             self._publish_gateway_info()
-            #self.watcher_thread.trigger_update = True
+            self.trigger_update('flip')
         else:
             rospy.logerr("Gateway : %s." % response.error_message)
         return response
@@ -562,7 +736,7 @@ class Gateway(object):
                 rospy.loginfo("Gateway : cancelling a previous flip all request [%s]" % (request.gateway))
         if response.result == gateway_msgs.ErrorCodes.SUCCESS:
             self._publish_gateway_info()
-            #self.watcher_thread.trigger_update = True
+            self.trigger_update('flip')
         else:
             rospy.logerr("Gateway : %s." % response.error_message)
         return response
@@ -606,7 +780,7 @@ class Gateway(object):
                         rospy.loginfo("Gateway : removed pull rule [%s:%s]" % (remote.gateway, remote.rule.name))
         if response.result == gateway_msgs.ErrorCodes.SUCCESS:
             self._publish_gateway_info()
-            #self.watcher_thread.trigger_update = True
+            self.trigger_update('pull')
         else:
             if added_rules:  # completely abort any added rules
                 for added_rule in added_rules:
@@ -639,7 +813,7 @@ class Gateway(object):
                 rospy.loginfo("Gateway : cancelling a previous pull all request [%s]" % (request.gateway))
         if response.result == gateway_msgs.ErrorCodes.SUCCESS:
             self._publish_gateway_info()
-            #self.watcher_thread.trigger_update = True
+            self.trigger_update('pull')
         else:
             rospy.logerr("Gateway : %s." % response.error_message)
         return response
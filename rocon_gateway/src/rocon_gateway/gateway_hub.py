@@ -7,6 +7,7 @@
 # Imports
 ###############################################################################
 
+import socket
 import threading
 import rospy
 import re
@@ -27,6 +28,28 @@ from .exceptions import GatewayUnavailableError
 
 import rocon_console.console as console
 
+###############################################################################
+# Notifications
+###############################################################################
+
+# Payloads published on the hub notification channels so that listening
+# gateways can work out what changed without polling.
+NOTIFY_FLIP_INS = 'flip_ins'            # flip requests for the target gateway were added/removed
+NOTIFY_FLIP_STATUS = 'flip_status'      # the status of flips sent by the target gateway changed
+NOTIFY_ADVERTISEMENTS = 'advertisements'  # a gateway (un)advertised something (hub wide)
+NOTIFY_GATEWAYS = 'gateways'            # a gateway (un)registered on the hub (hub wide)
+# Not published, passed to the gateway's notification hook when a gateway registers
+# while flips are held up waiting for a remote gateway's public key.
+NOTIFY_PUBLIC_KEYS = 'public_keys'
+
+# Value of rocon:<gateway>:encryption for gateways that accept connections sealed with
+# session keys (see utils.seal_connection). Anything else only reads rsa encrypted flips.
+ENCRYPTION_SESSION_KEYS = 'session_keys'
+
+# Fallback maximum age (seconds) of the cached remote gateway directory, in case
+# a gateways notification was missed (e.g. while the listener was reconnecting)
+DIRECTORY_MAX_AGE = 5.0
+
 ###############################################################################
 # Redis Connection Checker
 ##############################################################################
@@ -67,6 +90,135 @@ class HubConnectionCheckerThread(threading.Thread):
             self._hub_connection_lost_hook()
         # else shutting down thread by request
 
+##############################################################################
+# Redis Notification Listener
+##############################################################################
+
+
+class HubNotificationListenerThread(threading.Thread):
+    '''
+      Listens on the hub's pubsub notification channels and passes any
+      notifications on to the gateway so it can wake up and resynchronise
+      instead of waiting for its next periodic update.
+    '''
+
+    def __init__(self, redis_server, channels, notification_hook):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._redis_server = redis_server
+        self._channels = channels
+        self._notification_hook = notification_hook
+        self.terminate_requested = False
+
+    def run(self):
+        while not self.terminate_requested:
+            try:
+                pubsub = self._redis_server.pubsub()
+                pubsub.subscribe(self._channels)
+                for message in pubsub.listen():
+                    if self.terminate_requested:
+                        break
+                    if message['type'] == 'message':
+                        self._notification_hook(message['data'])
+            except (redis.exceptions.RedisError, socket.error, AttributeError):
+                # Socket timeouts on a quiet channel land here, as do lost hubs (the
+                # connection checker thread takes care of disengaging those). Anything
+                # missed in the meantime gets picked up by the gateway's periodic resync.
+                if not self.terminate_requested:
+                    rospy.rostime.wallsleep(1.0)
+
+##############################################################################
+# Remote Gateway Directory
+##############################################################################
+
+
+class RemoteGatewayDirectory(object):
+    '''
+      Snapshot of the remote gateways registered on a hub, along with the
+      details that get looked up for every flip.
+
+       - names                  (remote gateway hash names)
+       - timestamp              (wall time the snapshot was taken)
+    '''
+
+    def __init__(self, names, firewalls, public_keys, encryptions, previous=None):
+        '''
+          @param names : remote gateway hash names
+          @type str[]
+          @param firewalls : raw firewall flag values keyed by remote gateway name (None if unset)
+          @type dict
+          @param public_keys : serialised public keys keyed by remote gateway name (None if unset)
+          @type dict
+          @param encryptions : encryption schemes keyed by remote gateway name (None if unset)
+          @type dict
+          @param previous : the directory this replaces, deserialised keys that haven't changed are reused
+          @type RemoteGatewayDirectory
+        '''
+        self.names = names
+        self.timestamp = time.time()
+        self._firewalls = firewalls
+        self._public_keys = public_keys
+        self._encryptions = encryptions
+        self._deserialized_public_keys = {}
+        if previous is not None:
+            for name, (serialized_key, key) in previous._deserialized_public_keys.items():
+                if public_keys.get(name, None) == serialized_key:
+                    self._deserialized_public_keys[name] = (serialized_key, key)
+
+    def get_firewall_flag(self, name):
+        '''
+          @return state of the remote gateway's firewall flag, None if not known
+          @rtype Bool
+        '''
+        firewall = self._firewalls.get(name, None)
+        if firewall is None:
+            return None
+        return True if int(firewall) else False
+
+    def get_serialized_public_key(self, name):
+        '''
+          @return the remote gateway's public key as posted on the hub, None if not known
+          @rtype str
+        '''
+        return self._public_keys.get(name, None)
+
+    def supports_session_keys(self, name):
+        '''
+          @return whether the remote gateway accepts connections sealed with a session key
+          @rtype Bool
+        '''
+        return _supports_session_keys(self._encryptions.get(name, None))
+
+    def get_public_key(self, name):
+        '''
+          @return the remote gateway's (deserialised) public key, None if not known
+          @rtype Crypto.PublicKey.RSA key object
+        '''
+        serialized_key = self._public_keys.get(name, None)
+        if serialized_key is None:
+            return None
+        try:
+            cached_serialized_key, key = self._deserialized_public_keys[name]
+            if cached_serialized_key == serialized_key:
+                return key
+        except KeyError:
+            pass
+        key = utils.deserialize_key(serialized_key)
+        self._deserialized_public_keys[name] = (serialized_key, key)
+        return key
+
+
+def _supports_session_keys(encryption):
+    return encryption in [ENCRYPTION_SESSION_KEYS, ENCRYPTION_SESSION_KEYS.encode()]
+
+
+def _is_wrong_type(error):
+    '''
+      Gateways from before the flip_ins hash still keep flip ins in a set,
+      any hash operation on one of those fails with this error.
+    '''
+    return isinstance(error, redis.ResponseError) and 'WRONGTYPE' in str(error)
+
 ##############################################################################
 # Hub
 ##############################################################################
@@ -98,14 +250,45 @@ class GatewayHub(rocon_hub_client.Hub):
 
         # Setting up some basic parameters in-case we use this API without registering a gateway
         self._redis_keys['gatewaylist'] = hub_api.create_rocon_hub_key('gatewaylist')
+        self._redis_keys['notifications'] = hub_api.create_rocon_hub_key('notifications')
+        # bumped whenever a gateway registers, see get_remote_connection_states
+        self._redis_keys['epoch'] = hub_api.create_rocon_hub_key('epoch')
         self._unique_gateway_name = ''
         self.hub_connection_checker_thread = None
+        self.hub_notification_listener_thread = None
+        # remote gateway names, firewall flags and public keys, only cached while we're listening
+        # for notifications (so we know when to throw it out), otherwise it is read fresh every time
+        self._directory = None
+        self._directory_lock = threading.Lock()
+        self._directory_max_age = None
+        # the caches below can be used by several threads at once (e.g. via rocon_hub_client.AsyncHub),
+        # _encryption_lock guards the session keys and awaited public keys, _flip_ins_lock the flip in caches
+        # and _advertisement_cache_lock the advertisement cache
+        self._encryption_lock = threading.Lock()
+        self._flip_ins_lock = threading.Lock()
+        self._advertisement_cache_lock = threading.Lock()
+        # session keys for sealing flips to remote gateways (remote gateway : (their public key, session key, wrapped session key))
+        self._session_keys = {}
+        # session keys remote gateways sent us (remote gateway : (wrapped session key, session key))
+        self._received_session_keys = {}
+        # decrypted connections of the flip ins we've seen, keyed by their (still encrypted) contents
+        self._flip_in_cache = {}
+        # fields of the compound action flip ins, keyed by the fields their pubs/subs would have
+        self._flip_in_fields = {}
+        # decoded advertisements of remote gateways (remote gateway : ((epoch, generation), connections))
+        self._advertisement_cache = {}
+        # remote gateways whose public keys flips are waiting on (remote gateway : deadline)
+        self._awaited_public_keys = {}
+        # remote gateways whose public keys didn't turn up in time, skipped until a gateway
+        # registers on the hub (remote gateway : True if due another look)
+        self._failed_public_keys = {}
 
     ##########################################################################
     # Hub Connections
     ##########################################################################
 
-    def register_gateway(self, firewall, unique_gateway_name, hub_connection_lost_gateway_hook, gateway_ip):
+    def register_gateway(self, firewall, unique_gateway_name, hub_connection_lost_gateway_hook, gateway_ip,
+                         hub_notification_hook=None, key_pair=None):
         '''
           Register a gateway with the hub.
 
@@ -114,13 +297,19 @@ class GatewayHub(rocon_hub_client.Hub):
           @param hub_connection_lost_gateway_hook : used to trigger Gateway.disengage_hub(hub)
                  on lost hub connections in redis pubsub listener thread.
           @gateway_ip
+          @param hub_notification_hook : called with the notification payload (one of the
+                 NOTIFY_XXX constants) whenever something relevant to this gateway changes on the hub.
+          @param key_pair : the gateway's private and public key (see KeyStore), generated here if not provided
+          @type (Crypto.PublicKey.RSA key object, Crypto.PublicKey.RSA key object)
 
           @raise HubConnectionLostError if for some reason, the redis server has become unavailable.
         '''
         if not self._redis_server:
             raise HubConnectionLostError()
         self._unique_gateway_name = unique_gateway_name
-        self.private_key, public_key = utils.generate_private_public_key()
+        if key_pair is None or key_pair[0] is None:
+            key_pair = utils.generate_private_public_key()
+        self.private_key, public_key = key_pair
 
         serialized_public_key = utils.serialize_key(public_key)
         ping_key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, ':ping')
@@ -130,6 +319,12 @@ class GatewayHub(rocon_hub_client.Hub):
         self._redis_keys['gateway'] = hub_api.create_rocon_key(unique_gateway_name)
         self._redis_keys['firewall'] = hub_api.create_rocon_gateway_key(unique_gateway_name, 'firewall')
         self._redis_keys['public_key'] = hub_api.create_rocon_gateway_key(unique_gateway_name, 'public_key')
+        self._redis_keys['gateway_notifications'] = hub_api.create_rocon_gateway_key(unique_gateway_name, 'notifications')
+        self._redis_keys['encryption'] = hub_api.create_rocon_gateway_key(unique_gateway_name, 'encryption')
+        self._redis_keys['session_keys'] = hub_api.create_rocon_gateway_key(unique_gateway_name, 'session_keys')
+        self._redis_keys['advertisements'] = hub_api.create_rocon_gateway_key(unique_gateway_name, 'advertisements')
+        self._redis_keys['advertisements_generation'] = \
+            hub_api.create_rocon_gateway_key(unique_gateway_name, 'advertisements_generation')
 
         self._firewall = 1 if firewall else 0
         self._hub_connection_lost_gateway_hook = hub_connection_lost_gateway_hook
@@ -147,13 +342,22 @@ class GatewayHub(rocon_hub_client.Hub):
             pipe.get(self._redis_keys['public_key'])
             pipe.set(self._redis_keys['public_key'], serialized_public_key)
             pipe.sadd(self._redis_keys['gatewaylist'], self._redis_keys['gateway'])
+            pipe.set(self._redis_keys['encryption'], ENCRYPTION_SESSION_KEYS)
+            # (re)registering gateways may have the same name as a previous one, but
+            # different advertisements, so make sure no-one trusts old generations
+            pipe.incr(self._redis_keys['epoch'])
+            pipe.setnx(self._redis_keys['advertisements_generation'], 0)
 
             # Let hub know we are alive
             pipe.set(ping_key, True)
             pipe.expire(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL)
 
+            # Let everyone else know we are here
+            pipe.publish(self._redis_keys['notifications'], NOTIFY_GATEWAYS)
+
             ret_pipe = pipe.execute()
-            [r_check_gateway, r_firewall, r_ip, r_oldkey, r_newkey, r_add_gateway, r_ping, r_expire] = ret_pipe
+            [r_check_gateway, r_firewall, r_ip, r_oldkey, r_newkey, r_add_gateway, r_encryption, r_epoch,
+             r_generation, r_ping, r_expire, r_publish] = ret_pipe
 
         except (redis.WatchError, redis.ConnectionError) as e:
             raise HubConnectionFailedError("Connection Failed while registering hub[%s]" % str(e))
@@ -169,6 +373,11 @@ class GatewayHub(rocon_hub_client.Hub):
         if serialized_public_key != r_oldkey:
             rospy.loginfo('Gateway : found existing mismatched public key on the hub, ' +
                           'requesting resend for all flip-ins.')
+            # session keys wrapped with the old key are of no use any longer either
+            self._redis_server.delete(self._redis_keys['session_keys'])
+            self._encryption_lock.acquire()
+            self._received_session_keys = {}
+            self._encryption_lock.release()
             self._resend_all_flip_ins()
 
         # Mark this gateway as now available
@@ -177,6 +386,33 @@ class GatewayHub(rocon_hub_client.Hub):
         self.hub_connection_checker_thread.start()
         self.connection_lost_lock = threading.Lock()
 
+        if hub_notification_hook is not None:
+            def notification_hook(notification):
+                if notification in [NOTIFY_GATEWAYS, NOTIFY_GATEWAYS.encode()]:
+                    self.invalidate_directory()
+                    self._encryption_lock.acquire()
+                    for remote_gateway in self._failed_public_keys:
+                        self._failed_public_keys[remote_gateway] = True
+                    waiting = bool(self._awaited_public_keys or self._failed_public_keys)
+                    self._encryption_lock.release()
+                    if waiting:
+                        hub_notification_hook(NOTIFY_PUBLIC_KEYS)
+                hub_notification_hook(notification)
+            self._directory_max_age = DIRECTORY_MAX_AGE
+            self.hub_notification_listener_thread = HubNotificationListenerThread(
+                self._redis_server,
+                [self._redis_keys['gateway_notifications'], self._redis_keys['notifications']],
+                notification_hook)
+            self.hub_notification_listener_thread.start()
+
+    def disconnect(self):
+        '''
+          Stop listening for notifications before dropping the redis connections.
+        '''
+        if self.hub_notification_listener_thread is not None:
+            self.hub_notification_listener_thread.terminate_requested = True
+        super(GatewayHub, self).disconnect()
+
     def _hub_connection_lost_hook(self):
         '''
           This gets triggered by the redis connection checker thread when the hub connection is lost.
@@ -211,6 +447,24 @@ class GatewayHub(rocon_hub_client.Hub):
             #               "(likely that hub is temporarily out of network).")
             pass
 
+    def refresh_ping(self):
+        '''
+          Let hub know that we are alive - even for wired connections. Perhaps something can
+          go wrong for them too, though no idea what. Anyway, writing one entry is low cost
+          and it makes the logic easier on the hub side. The hub uses the ttl on this key
+          to work out how long it has been since this gateway was last seen, so this needs
+          to be called more often than the network statistics are published.
+        '''
+        try:
+            ping_key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, ':ping')
+            pipe = self._redis_server.pipeline()
+            pipe.set(ping_key, True)
+            pipe.expire(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL)
+            pipe.execute()
+            # rospy.loginfo("=>{0} TTL {1}".format(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL))
+        except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError):
+            rospy.logdebug("Gateway : unable to ping the hub [no connection to the hub]")
+
     def publish_network_statistics(self, statistics):
         '''
           Publish network interface information to the hub
@@ -219,13 +473,6 @@ class GatewayHub(rocon_hub_client.Hub):
           @type gateway_msgs.RemoteGateway
         '''
         try:
-            # Let hub know that we are alive - even for wired connections. Perhaps something can
-            # go wrong for them too, though no idea what. Anyway, writing one entry is low cost
-            # and it makes the logic easier on the hub side.
-            ping_key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, ':ping')
-            self._redis_server.set(ping_key, True)
-            self._redis_server.expire(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL)
-            # rospy.loginfo("=>{0} TTL {1}".format(ping_key, gateway_msgs.ConnectionStatistics.MAX_TTL))
             # this should probably be posted independently  of whether the hub is contactable or not
             # refer to https://github.com/robotics-in-concert/rocon_multimaster/pull/273/files#diff-22b726fec736c73a96fd98c957d9de1aL189
             if not statistics.network_info_available:
@@ -263,6 +510,7 @@ class GatewayHub(rocon_hub_client.Hub):
             pipe = self._redis_server.pipeline()
             pipe.delete(*gateway_keys)
             pipe.srem(self._redis_keys['gatewaylist'], gateway_key)
+            pipe.publish(self._redis_keys['notifications'], NOTIFY_GATEWAYS)
             pipe.execute()
         except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError):
             pass
@@ -419,6 +667,15 @@ class GatewayHub(rocon_hub_client.Hub):
           e.g. ['gateway32adcda32','pirate21fasdf']. If not connected, just
           returns an empty list.
         '''
+        directory = self._get_directory()
+        if directory is not None:
+            return list(directory.names)
+        return self._list_remote_gateway_names()
+
+    def _list_remote_gateway_names(self):
+        '''
+          List the gateways straight from the hub (see list_remote_gateway_names).
+        '''
         if not self._redis_server:
             rospy.logerr("Gateway : cannot retrieve remote gateway names [%s][%s]." % (self.name, self.uri))
             return []
@@ -436,6 +693,70 @@ class GatewayHub(rocon_hub_client.Hub):
             pass
         return gateways
 
+    def refresh_directory(self):
+        '''
+          Reload the remote gateway names, firewall flags and public keys from
+          the hub (two round trips, regardless of the number of gateways).
+          The watcher calls this once a loop via the remote gateway hub index,
+          everything else in the loop uses the cached copy.
+          If the details can't be read, the previous directory is kept.
+
+          @return the remote gateway names
+          @rtype str[]
+        '''
+        names = self._list_remote_gateway_names()
+        firewalls = {}
+        public_keys = {}
+        encryptions = {}
+        if names:
+            try:
+                pipe = self._redis_server.pipeline()
+                for name in names:
+                    pipe.get(hub_api.create_rocon_gateway_key(name, 'firewall'))
+                    pipe.get(hub_api.create_rocon_gateway_key(name, 'public_key'))
+                    pipe.get(hub_api.create_rocon_gateway_key(name, 'encryption'))
+                values = pipe.execute()
+            except (redis.ConnectionError, AttributeError) as unused_e:
+                # probably disconnected from the hub, keep the directory we have (if any) rather
+                # than caching one in which nobody has a firewall flag or public key
+                return list(names)
+            for index, name in enumerate(names):
+                firewalls[name] = values[3 * index]
+                public_keys[name] = values[3 * index + 1]
+                encryptions[name] = values[3 * index + 2]
+        self._directory_lock.acquire()
+        self._directory = RemoteGatewayDirectory(names, firewalls, public_keys, encryptions, self._directory)
+        self._directory_lock.release()
+        return list(names)
+
+    def invalidate_directory(self):
+        '''
+          Throw out the cached directory, the next lookup will reload it.
+        '''
+        self._directory_lock.acquire()
+        if self._directory is not None:
+            self._directory.timestamp = 0.0  # keep it around for its deserialised keys
+        self._directory_lock.release()
+
+    def _get_directory(self):
+        '''
+          The cached remote gateway directory, reloaded if it has expired.
+
+          @return the directory, or None if caching is disabled (not listening for notifications)
+          @rtype RemoteGatewayDirectory
+        '''
+        if self._directory_max_age is None:
+            return None
+        self._directory_lock.acquire()
+        directory = self._directory
+        self._directory_lock.release()
+        if directory is None or time.time() - directory.timestamp > self._directory_max_age:
+            self.refresh_directory()
+            self._directory_lock.acquire()
+            directory = self._directory
+            self._directory_lock.release()
+        return directory
+
     def matches_remote_gateway_name(self, gateway):
         '''
           Use this when gateway can be a regular expression and
@@ -477,17 +798,72 @@ class GatewayHub(rocon_hub_client.Hub):
           @return dictionary of remote advertisements
           @rtype dictionary of connection type keyed connection values
        '''
-        connections = utils.create_empty_connection_type_dictionary()
-        key = hub_api.create_rocon_gateway_key(remote_gateway, 'advertisements')
+        return self.get_remote_connection_states([remote_gateway])[remote_gateway]
+
+    def get_remote_connection_states(self, remote_gateways):
+        '''
+          Bulk version of get_remote_connection_state. Gateways bump their
+          advertisements generation whenever they (un)advertise, so only the
+          generations (and the hub's epoch) are read every time and the
+          advertisements are only fetched (in a single pipeline) and decoded
+          for remote gateways whose generation has moved on.
+
+          @param remote_gateways : hash names of remote gateways
+          @type str[]
+          @return dictionaries of remote advertisements keyed by remote gateway (cached, so don't modify them)
+          @rtype dict of connection type keyed connection values
+        '''
+        remote_gateways = list(remote_gateways)
+        states = {}
+        if not remote_gateways:
+            return states
         try:
-            public_interface = self._redis_server.smembers(key)
+            values = self._redis_server.mget(
+                [self._redis_keys['epoch']] +
+                [hub_api.create_rocon_gateway_key(remote_gateway, 'advertisements_generation')
+                 for remote_gateway in remote_gateways])
+            epoch, generations = values[0], values[1:]
+            stale = []
+            self._advertisement_cache_lock.acquire()
+            for remote_gateway, generation in zip(remote_gateways, generations):
+                try:
+                    (cached_epoch, cached_generation), connections = self._advertisement_cache[remote_gateway]
+                    # gateways that don't keep a generation get fetched every time
+                    if generation is not None and (cached_epoch, cached_generation) == (epoch, generation):
+                        states[remote_gateway] = connections
+                        continue
+                except KeyError:
+                    pass
+                stale.append((remote_gateway, generation))
+            self._advertisement_cache_lock.release()
+            if stale:
+                pipe = self._redis_server.pipeline()
+                for remote_gateway, unused_generation in stale:
+                    pipe.smembers(hub_api.create_rocon_gateway_key(remote_gateway, 'advertisements'))
+                encoded_public_interfaces = pipe.execute()
+            else:
+                encoded_public_interfaces = []
+        except redis.exceptions.ConnectionError:
+            # will arrive here if the hub happens to have been lost last update and arriving here
+            return dict([(remote_gateway, utils.create_empty_connection_type_dictionary())
+                         for remote_gateway in remote_gateways])
+        for (remote_gateway, generation), public_interface in zip(stale, encoded_public_interfaces):
+            connections = utils.create_empty_connection_type_dictionary()
             for connection_str in public_interface:
                 connection = utils.deserialize_connection(connection_str)
                 connections[connection.rule.type].append(connection)
-        except redis.exceptions.ConnectionError:
-            # will arrive here if the hub happens to have been lost last update and arriving here
-            pass
-        return connections
+            states[remote_gateway] = connections
+        self._advertisement_cache_lock.acquire()
+        for (remote_gateway, generation) in stale:
+            connections = states[remote_gateway]
+            if generation is not None:
+                # the generation was read first, so at worst these are newer than it says and get fetched again
+                self._advertisement_cache[remote_gateway] = ((epoch, generation), connections)
+            else:
+                # gone from the hub (or not keeping a generation)
+                self._advertisement_cache.pop(remote_gateway, None)
+        self._advertisement_cache_lock.release()
+        return states
 
     def get_remote_gateway_firewall_flag(self, gateway):
         '''
@@ -502,6 +878,12 @@ class GatewayHub(rocon_hub_client.Hub):
 
           @raise GatewayUnavailableError when specified gateway is not on the hub
         '''
+        directory = self._get_directory()
+        if directory is not None:
+            firewall_flag = directory.get_firewall_flag(gateway)
+            if firewall_flag is None:
+                raise GatewayUnavailableError
+            return firewall_flag
         firewall = self._redis_server.get(hub_api.create_rocon_gateway_key(gateway, 'firewall'))
         if firewall is not None:
             return True if int(firewall) else False
@@ -550,6 +932,34 @@ class GatewayHub(rocon_hub_client.Hub):
     # Posting Information to the Hub
     ##########################################################################
 
+    def _notify_gateway(self, gateway, notification):
+        '''
+          Let a remote gateway know that something relevant to it has changed
+          on the hub. This is fire and forget - the remote gateway will in any
+          case catch up on its next periodic update.
+
+          @param gateway : hash name of the gateway to notify
+          @type str
+          @param notification : one of the NOTIFY_XXX constants
+          @type str
+        '''
+        try:
+            self._redis_server.publish(hub_api.create_rocon_gateway_key(gateway, 'notifications'), notification)
+        except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError):
+            pass
+
+    def _notify_hub(self, notification):
+        '''
+          Let all gateways on the hub know that something of hub wide interest has changed.
+
+          @param notification : one of the NOTIFY_XXX constants
+          @type str
+        '''
+        try:
+            self._redis_server.publish(self._redis_keys['notifications'], notification)
+        except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError):
+            pass
+
     def advertise(self, connection):
         '''
           Places a topic, service or action on the public interface. On the
@@ -563,9 +973,12 @@ class GatewayHub(rocon_hub_client.Hub):
           @type  connection: str
           @raise .exceptions.ConnectionTypeError: if connection arg is invalid.
         '''
-        key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'advertisements')
         msg_str = utils.serialize_connection(connection)
-        self._redis_server.sadd(key, msg_str)
+        pipe = self._redis_server.pipeline()
+        pipe.sadd(self._redis_keys['advertisements'], msg_str)
+        pipe.incr(self._redis_keys['advertisements_generation'])
+        pipe.execute()
+        self._notify_hub(NOTIFY_ADVERTISEMENTS)
 
     def unadvertise(self, connection):
         '''
@@ -575,9 +988,12 @@ class GatewayHub(rocon_hub_client.Hub):
           @type  connection: str
           @raise .exceptions.ConnectionTypeError: if connectionarg is invalid.
         '''
-        key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'advertisements')
         msg_str = utils.serialize_connection(connection)
-        self._redis_server.srem(key, msg_str)
+        pipe = self._redis_server.pipeline()
+        pipe.srem(self._redis_keys['advertisements'], msg_str)
+        pipe.incr(self._redis_keys['advertisements_generation'])
+        pipe.execute()
+        self._notify_hub(NOTIFY_ADVERTISEMENTS)
 
     def post_flip_details(self, gateway, name, connection_type, node):
         '''
@@ -661,22 +1077,149 @@ class GatewayHub(rocon_hub_client.Hub):
           will not be processed
         '''
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flip_ins')
-        encoded_flip_ins = []
         try:
-            encoded_flip_ins = self._redis_server.smembers(key)
-            self._redis_server.delete(key)
-            for flip_in in encoded_flip_ins:
-                status, source, connection_list = utils.deserialize_request(flip_in)
-                connection = utils.get_connection_from_list(connection_list)
-                status = FlipStatus.RESEND
-                serialized_data = utils.serialize_connection_request(status,
-                                                                     source,
-                                                                     connection)
-                self._redis_server.sadd(key, serialized_data)
-        except (redis.ConnectionError, AttributeError) as unused_e:
+            encoded_flip_ins, unused_wrapped_session_keys = self._get_flip_ins()
+            statuses = dict([(field, FlipStatus.RESEND) for field in encoded_flip_ins.keys()])
+            old_statuses = self._set_flip_request_statuses(key, statuses)
+            sources = set()
+            for field, flip_in in encoded_flip_ins.items():
+                if old_statuses.get(field, None) is not None:
+                    unused_status, source, unused_connection_list = utils.deserialize_request(flip_in)
+                    sources.add(source)
+            for source in sources:
+                self._notify_gateway(source, NOTIFY_FLIP_STATUS)
+        except (redis.ConnectionError, redis.ResponseError, AttributeError) as unused_e:
             # probably disconnected from the hub
             pass
 
+    def _set_flip_request_statuses(self, key, statuses):
+        '''
+          Change the status of flip requests in a flip_ins hash. Requests that
+          have been removed in the meantime (e.g. unflipped) are not recreated.
+
+          @param key : the flip_ins hash key
+          @type str
+          @param statuses : new statuses keyed by flip_ins field (see utils.flip_request_field)
+          @type dict
+
+          @return the status of each request before the update, None if it doesn't exist
+          @rtype dict of field : same as gateway_msgs.msg.RemoteRuleWithStatus.status or None
+
+          @raise redis.ConnectionError : if the hub is unavailable
+        '''
+        fields = list(statuses.keys())
+        if not fields:
+            return {}
+        pipe = self._redis_server.pipeline()
+        while True:
+            try:
+                pipe.watch(key)
+                encoded_flip_ins = pipe.hmget(key, fields)
+                old_statuses = {}
+                updates = {}
+                for field, flip_in in zip(fields, encoded_flip_ins):
+                    old_statuses[field] = None
+                    if flip_in is None:
+                        continue
+                    old_status, source, connection_list = utils.deserialize_request(flip_in)
+                    old_statuses[field] = old_status
+                    if old_status != statuses[field]:
+                        updates[field] = utils.serialize([statuses[field], source] + list(connection_list))
+                pipe.multi()
+                if updates:
+                    pipe.hmset(key, updates)
+                pipe.execute()
+                return old_statuses
+            except redis.WatchError:
+                continue  # the flip ins changed under our feet, try again
+            except redis.ResponseError as e:
+                if not _is_wrong_type(e) or not self._migrate_flip_ins(key):
+                    raise
+                continue  # now a hash, try again
+            finally:
+                pipe.reset()
+
+    def _get_flip_ins(self):
+        '''
+          Read this gateway's flip ins along with the session keys they were
+          sealed with. Flip ins an older gateway has left in a set (the layout
+          before the hash) are converted to the hash layout first.
+
+          @return serialised flip requests keyed by flip_ins field, wrapped session keys keyed by remote gateway
+          @rtype (dict, dict)
+
+          @raise redis.ConnectionError : if the hub is unavailable
+        '''
+        key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flip_ins')
+        pipe = self._redis_server.pipeline()
+        pipe.hgetall(key)
+        pipe.hgetall(hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'session_keys'))
+        try:
+            encoded_flip_ins, wrapped_session_keys = pipe.execute()
+        except redis.ResponseError as e:
+            if not _is_wrong_type(e) or not self._migrate_flip_ins(key):
+                raise
+            pipe.hgetall(key)
+            pipe.hgetall(hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'session_keys'))
+            encoded_flip_ins, wrapped_session_keys = pipe.execute()
+        return encoded_flip_ins, wrapped_session_keys
+
+    def _get_old_flip_ins(self, key):
+        '''
+          Read flip ins kept in the layout used before the hash, i.e. a set of
+          serialised requests, along with the flip_ins field each one would have.
+
+          @param key : the flip_ins set key
+          @type str
+
+          @return field and serialised flip request pairs (a set may hold more than one request for a field)
+          @rtype [(str, str)]
+
+          @raise redis.ConnectionError : if the hub is unavailable
+        '''
+        flip_ins = []
+        for flip_in in self._redis_server.smembers(key):
+            unused_status, source, connection_list = utils.deserialize_request(flip_in)
+            flip_ins.append((utils.flip_request_field(source, utils.get_rule_from_list(connection_list)), flip_in))
+        return flip_ins
+
+    def _migrate_flip_ins(self, key):
+        '''
+          Convert this gateway's flip ins from the old layout (a set) to a hash
+          keyed by utils.flip_request_field. Gateways from before the hash
+          still flip to us in the old layout, their flips are carried over, but
+          they can't add to (or read the status from) the hash afterwards.
+
+          @param key : our flip_ins key
+          @type str
+
+          @return True if the flip ins are now a hash, False if they are something else altogether
+          @rtype Bool
+
+          @raise redis.ConnectionError : if the hub is unavailable
+        '''
+        pipe = self._redis_server.pipeline()
+        while True:
+            try:
+                pipe.watch(key)
+                key_type = pipe.type(key)
+                if key_type in ['hash', b'hash', 'none', b'none']:
+                    return True
+                if key_type not in ['set', b'set']:
+                    return False
+                flip_ins = dict(self._get_old_flip_ins(key))
+                pipe.multi()
+                pipe.delete(key)
+                if flip_ins:
+                    pipe.hmset(key, flip_ins)
+                pipe.execute()
+                rospy.loginfo("Gateway : converted %s flip ins from an older gateway to the hash layout" % len(flip_ins))
+                return True
+            except redis.WatchError:
+                continue  # the flip ins changed under our feet, try again
+            finally:
+                pipe.reset()
+
     def get_unblocked_flipped_in_connections(self):
         '''
           Gets all the flipped in connections listed on the hub that are interesting
@@ -688,20 +1231,61 @@ class GatewayHub(rocon_hub_client.Hub):
         '''
         registrations = []
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flip_ins')
-        encoded_flip_ins = []
         try:
-            encoded_flip_ins = self._redis_server.smembers(key)
-        except (redis.ConnectionError, AttributeError) as unused_e:
+            encoded_flip_ins, wrapped_session_keys = self._get_flip_ins()
+            encoded_flip_ins = encoded_flip_ins.values()
+            remote_gateway_names = self.list_remote_gateway_names()
+        except (redis.ConnectionError, redis.ResponseError, AttributeError) as unused_e:
             # probably disconnected from the hub
-            pass
-        for flip_in in encoded_flip_ins:
-            status, source, connection_list = utils.deserialize_request(flip_in)
-            if source not in self.list_remote_gateway_names():
-                continue
-            connection = utils.get_connection_from_list(connection_list)
-            connection = utils.decrypt_connection(connection, self.private_key)
-            if status != FlipStatus.BLOCKED and status != FlipStatus.RESEND:
-                registrations.append((utils.Registration(connection, source), status))
+            return registrations
+        # Decrypting is expensive (private key rsa), so only do it the first time we see a flip in.
+        # Anything no longer on the hub (or no longer of interest) drops out of the cache.
+        flip_in_cache = {}
+        flip_in_fields = {}
+        undecryptable = {}
+        # held throughout, else concurrent calls would each decrypt and then clobber each other's caches
+        self._flip_ins_lock.acquire()
+        try:
+            for flip_in in encoded_flip_ins:
+                status, source, connection_list = utils.deserialize_request(flip_in)
+                if source not in remote_gateway_names:
+                    continue
+                if status == FlipStatus.BLOCKED or status == FlipStatus.RESEND:
+                    continue
+                # status is left out of the key, it changes without changing the connection
+                cache_key = (source,) + tuple(connection_list)
+                connections = self._flip_in_cache.get(cache_key, None)
+                if connections is None:
+                    connection = utils.get_connection_from_list(connection_list)
+                    session_key = self._get_received_session_key(source, wrapped_session_keys)
+                    try:
+                        if connection.rule.type in utils.action_connection_types:
+                            connections = utils.unseal_action_connection(connection, session_key, source)
+                        else:
+                            connections = [utils.decrypt_connection(connection, self.private_key, session_key, source)]
+                    except ValueError as e:
+                        # e.g. sealed with a session key the hub lost when it restarted, get it resent
+                        rospy.logwarn("Gateway : could not decrypt flip in, requesting resend [%s][%s]" % (source, str(e)))
+                        undecryptable[utils.flip_request_field(source, connection.rule)] = source
+                        continue
+                flip_in_cache[cache_key] = connections
+                if connection_list[0] in utils.action_connection_types:
+                    # the pubs/subs of a compound action flip request all share its status
+                    field = utils.flip_request_field(source, utils.get_rule_from_list(connection_list))
+                    for connection in connections:
+                        flip_in_fields[utils.flip_request_field(source, connection.rule)] = field
+                registrations.extend([(utils.Registration(connection, source), status) for connection in connections])
+            self._flip_in_cache = flip_in_cache
+            self._flip_in_fields = flip_in_fields
+        finally:
+            self._flip_ins_lock.release()
+        if undecryptable:
+            try:
+                self._set_flip_request_statuses(key, dict([(field, FlipStatus.RESEND) for field in undecryptable]))
+                for source in set(undecryptable.values()):
+                    self._notify_gateway(source, NOTIFY_FLIP_STATUS)
+            except (redis.ConnectionError, redis.ResponseError, AttributeError) as unused_e:
+                pass
         return registrations
 
     def update_flip_request_status(self, registration_with_status):
@@ -734,32 +1318,28 @@ class GatewayHub(rocon_hub_client.Hub):
           @rtype Boolean
         '''
         result = [False] * len(registrations_with_status)
-        update_registrations = []
-        hub_found = False
         key = hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flip_ins')
+        fields = []
+        statuses = {}
+        self._flip_ins_lock.acquire()
+        for (registration, new_status) in registrations_with_status:
+            field = utils.flip_request_field(registration.remote_gateway, registration.connection.rule)
+            field = self._flip_in_fields.get(field, field)
+            fields.append(field)
+            statuses[field] = new_status
+        self._flip_ins_lock.release()
         try:
-            encoded_flip_ins = self._redis_server.smembers(key)
-            for flip_in in encoded_flip_ins:
-                old_status, source, connection_list = utils.deserialize_request(flip_in)
-                connection = utils.get_connection_from_list(connection_list)
-                connection = utils.decrypt_connection(connection, self.private_key)
-                for index, (registration, new_status) in enumerate(registrations_with_status):
-                    if source == registration.remote_gateway and connection == registration.connection:
-                        if new_status != old_status:
-                            self._redis_server.srem(key, flip_in)
-                            update_registrations.append((index, (registration, new_status)))
-                        else:
-                            result[index] = True
-
-            for (index, (registration, new_status)) in update_registrations:
-                encrypted_connection = utils.encrypt_connection(registration.connection,
-                                                                self.private_key)
-                serialized_data = utils.serialize_connection_request(new_status,
-                                                                     registration.remote_gateway,
-                                                                     encrypted_connection)
-                self._redis_server.sadd(key, serialized_data)
-                result[index] = True
-        except redis.exceptions.ConnectionError:
+            old_statuses = self._set_flip_request_statuses(key, statuses)
+            sources = set()
+            for index, (registration, new_status) in enumerate(registrations_with_status):
+                old_status = old_statuses[fields[index]]
+                result[index] = old_status is not None
+                if old_status is not None and old_status != new_status:
+                    sources.add(registration.remote_gateway)
+            # let the flippers know their flips have been processed
+            for source in sources:
+                self._notify_gateway(source, NOTIFY_FLIP_STATUS)
+        except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError):
             # Means the hub has gone down (typically on shutdown so just be quiet)
             # If we really need to know that a hub is crashed, change this policy
             pass
@@ -787,58 +1367,121 @@ class GatewayHub(rocon_hub_client.Hub):
           @return the flip status, ordered as per the input remote rules
           @rtype list of gateway_msgs.msg.RemoteRuleWithStatus.status or None
         '''
-        gateway_specific_rules = {}
-        status = [None] * len(remote_rules)
-        for i, remote_rule in enumerate(remote_rules):
-            if remote_rule.gateway not in gateway_specific_rules:
-                gateway_specific_rules[remote_rule.gateway] = []
-            gateway_specific_rules[remote_rule.gateway].append((i, remote_rule))
-
         source_gateway = self._unique_gateway_name  # me!
-
-        for gateway in gateway_specific_rules:
-            key = hub_api.create_rocon_gateway_key(gateway, 'flip_ins')
+        # look up just the (exploded) requests we're interested in
+        requests = []
+        for remote_rule in remote_rules:
+            if remote_rule.rule.type in utils.action_connection_types:
+                requests.append((remote_rule.gateway, remote_rule.rule))  # compound flip request
+            for rule in self.rule_explode([remote_rule.rule]):
+                requests.append((remote_rule.gateway, rule))
+        status_index = {}
+        try:
+            pipe = self._redis_server.pipeline()
+            for (gateway, rule) in requests:
+                pipe.hget(hub_api.create_rocon_gateway_key(gateway, 'flip_ins'), utils.flip_request_field(source_gateway, rule))
+            encoded_flips = pipe.execute(raise_on_error=False) if requests else []
+            old_flip_ins = {}
+            for index, (gateway, rule) in enumerate(requests):
+                if _is_wrong_type(encoded_flips[index]):
+                    # an older gateway, its flip ins are still a set
+                    if gateway not in old_flip_ins:
+                        old_flip_ins[gateway] = dict(self._get_old_flip_ins(hub_api.create_rocon_gateway_key(gateway, 'flip_ins')))
+                    encoded_flips[index] = old_flip_ins[gateway].get(utils.flip_request_field(source_gateway, rule), None)
+        except (redis.ConnectionError, AttributeError) as unused_e:
+            # probably disconnected from the hub
             encoded_flips = []
-            try:
-                encoded_flips = self._redis_server.smembers(key)
-            except (redis.ConnectionError, AttributeError) as unused_e:
-                # probably disconnected from the hub
-                pass
+        for (gateway, rule), flip in zip(requests, encoded_flips):
+            if flip is not None and not isinstance(flip, redis.ResponseError):
+                rule_status, unused_source, unused_connection_list = utils.deserialize_request(flip)
+                status_index[(gateway, rule.type, rule.name, rule.node.split(",")[0])] = rule_status
+        return [self.resolve_flip_request_status(status_index, remote_rule) for remote_rule in remote_rules]
+
+    def get_flip_request_status_index(self, remote_gateways):
+        '''
+          Fetch the status of every flip request this gateway has sent to the
+          specified remote gateways in a single (pipelined) round trip to the hub,
+          decoding each of the remote gateways' flip ins just the once. Cheaper than
+          get_multiple_flip_request_status when checking most of the flips to a target. Use with
+          resolve_flip_request_status to look up the status of individual flips.
+
+          @param remote_gateways : hash names of the flip targets
+          @type str[]
+
+          @return the status of the flip requests, keyed by (remote gateway, type, name, node)
+          @rtype dict
+        '''
+        remote_gateways = list(remote_gateways)
+        status_index = {}
+        if not remote_gateways:
+            return status_index
+        source_gateway = self._unique_gateway_name  # me!
+        try:
+            pipe = self._redis_server.pipeline()
+            for gateway in remote_gateways:
+                pipe.hvals(hub_api.create_rocon_gateway_key(gateway, 'flip_ins'))
+            encoded_flip_sets = pipe.execute(raise_on_error=False)
+            for index, gateway in enumerate(remote_gateways):
+                if _is_wrong_type(encoded_flip_sets[index]):
+                    # an older gateway, its flip ins are still a set
+                    encoded_flip_sets[index] = [flip for unused_field, flip in
+                                                self._get_old_flip_ins(hub_api.create_rocon_gateway_key(gateway, 'flip_ins'))]
+        except (redis.ConnectionError, AttributeError) as unused_e:
+            # probably disconnected from the hub
+            return status_index
+        for gateway, encoded_flips in zip(remote_gateways, encoded_flip_sets):
+            if isinstance(encoded_flips, redis.ResponseError):
+                continue
             for flip in encoded_flips:
                 rule_status, source, connection_list = utils.deserialize_request(flip)
                 if source != source_gateway:
                     continue
-                connection = utils.get_connection_from_list(connection_list)
                 # Compare rules only as xmlrpc_uri and type_info are encrypted
+                rule = utils.get_rule_from_list(connection_list)
+                status_index[(gateway, rule.type, rule.name, rule.node)] = rule_status
+        return status_index
 
-                # print(console.cyan + "Connection Rule: " + console.yellow + "%s-%s" % (connection.rule.type, connection.rule.name))
-                for (index, remote_rule) in gateway_specific_rules[gateway]:
-                    # print(console.cyan + "Remote Rule: " + console.yellow + "%s-%s" % (remote_rule.rule.type, remote_rule.rule.name))
-                    # Important to consider actions - gateway rules can be actions, but connections on the redis server are only
-                    # handled as fundamental types (pub, sub, server), so explode the gateway rule and then check
-                    exploded_remote_rules = self.rule_explode([remote_rule])
-
-                    # If the connection (from flips) match one of the remote rules (once exploded for handling action)
-                    if len([r for r in exploded_remote_rules if connection.rule == r.rule]) > 0:
-                        if status[index] is None:
-                            # a pub, sub, service or first connection in an exploded action rule will land here
-                            status[index] = rule_status
-                        elif status[index] != rule_status:
-                            # when another part of an exploded action's status doesn't match the status of formely read
-                            # parts, it lands here...need some good exception handling logic to represent the combined group
-                            if rule_status == FlipStatus.UNKNOWN:
-                                # if something unknown whole action connection is unknown
-                                status[index] = rule_status
-                                break
-                            # RESEND or BLOCKED do not follow basic flow so we want to make it obvious at action level
-                            # This might have to be improved to distinguish between blocked and resend
-                            if ((status[index] == FlipStatus.PENDING or status[index] == FlipStatus.ACCEPTED) and
-                                (rule_status == FlipStatus.BLOCKED or rule_status == FlipStatus.RESEND)
-                            ):
-                                # print(console.green + " Action Connection w/ unsynchronised components : %s/%s" % (connection.rule.name, remote_rule.rule.name) + console.reset)
-                                status[index] = rule_status
-                                break
-                        break
+    def resolve_flip_request_status(self, status_index, remote_rule):
+        '''
+          Look up the status of a flip request in a status index retrieved by
+          get_flip_request_status_index.
+
+          @param status_index : flip request status index for the remote rule's gateway
+          @type dict
+          @param remote_rule : the flip to check (node may be either 'node' or 'node,xmlrpc_uri')
+          @type gateway_msgs.msg.RemoteRule
+
+          @return the flip status or None if the flip request does not exist
+          @rtype same as gateway_msgs.msg.RemoteRuleWithStatus.status or None
+        '''
+        status = None
+        node = remote_rule.rule.node.split(",")[0]  # only the node name gets sent with the flip
+        if remote_rule.rule.type in utils.action_connection_types:
+            # actions sent as a single compound flip request
+            status = status_index.get((remote_rule.gateway, remote_rule.rule.type, remote_rule.rule.name, node), None)
+            if status is not None:
+                return status
+        # Important to consider actions - gateway rules can be actions, but connections on the redis server are only
+        # handled as fundamental types (pub, sub, server), so explode the gateway rule and then check
+        for rule in self.rule_explode([remote_rule.rule]):
+            rule_status = status_index.get((remote_rule.gateway, rule.type, rule.name, node), None)
+            if rule_status is None:
+                continue
+            if status is None:
+                # a pub, sub, service or first connection in an exploded action rule will land here
+                status = rule_status
+            elif status != rule_status:
+                # when another part of an exploded action's status doesn't match the status of formely read
+                # parts, it lands here...need some good exception handling logic to represent the combined group
+                if rule_status == FlipStatus.UNKNOWN:
+                    # if something unknown whole action connection is unknown
+                    return rule_status
+                # RESEND or BLOCKED do not follow basic flow so we want to make it obvious at action level
+                # This might have to be improved to distinguish between blocked and resend
+                if ((status == FlipStatus.PENDING or status == FlipStatus.ACCEPTED) and
+                    (rule_status == FlipStatus.BLOCKED or rule_status == FlipStatus.RESEND)
+                ):
+                    return rule_status
         return status
 
     def send_flip_request(self, remote_gateway, connection, timeout=15.0):
@@ -867,38 +1510,225 @@ class GatewayHub(rocon_hub_client.Hub):
 
           @param xmlrpc_uri : the node uri
           @param str
+
+          @param timeout : how long to keep trying if the remote gateway's public key isn't on the hub yet
+          @type float
+
+          @return True if sent, False if the public key isn't available (yet), in which case try again later
+          @rtype Bool
+        '''
+        return self.send_flip_requests(remote_gateway, [(connection.rule, [connection])], post_details=False,
+                                       timeout=timeout)
+
+    def send_flip_requests(self, remote_gateway, flips, post_details=True, timeout=15.0):
+        '''
+          Bulk version of send_flip_request (e.g. for flip_all bursts). The
+          connections are all encrypted up front and then written, along with
+          the flip details (see post_flip_details) and the notification for the
+          remote gateway, in a single transaction.
+
+          Actions go as a single compound flip request (see utils.seal_action_connection)
+          to remote gateways that accept session keys, or as their individual pubs/subs
+          to older gateways.
+
+          @param remote_gateway : the target of the flips
+          @type str
+          @param flips : rules to flip along with their connections (i.e. the individual pubs/subs for actions)
+          @type [(gateway_msgs.msg.Rule, utils.Connection[])]
+          @param post_details : also post flip details for the rules
+          @type Bool
+          @param timeout : how long to keep trying if the remote gateway's public key isn't on the hub yet
+          @type float
+
+          @return True if sent, False if the public key isn't available (yet) and nothing was sent
+          @rtype Bool
         '''
         key = hub_api.create_rocon_gateway_key(remote_gateway, 'flip_ins')
         source = hub_api.key_base_name(self._redis_keys['gateway'])
 
-        # Check if a flip request already exists on the hub
-        if self.get_flip_request_status(RemoteRule(remote_gateway, connection.rule)) is not None:
-            # We remove the old one before creating the new one,
-            # to avoid broken flips from previous gateway instance
-            self._send_unflip_request(remote_gateway, connection.rule)
-
         # Encrypt the transmission
-        start_time = time.time()
-        while time.time() - start_time <= timeout:
-            remote_gateway_public_key_str = self._redis_server.get(
-                hub_api.create_rocon_gateway_key(remote_gateway, 'public_key'))
-            if remote_gateway_public_key_str is not None:
-                break
-        if remote_gateway_public_key_str is None:
-            rospy.logerr("Gateway : flip to " + remote_gateway +
-                         " failed as public key not found")
+        serialized_public_key, public_key, session_keys_supported = self._get_remote_encryption(remote_gateway, timeout)
+        if public_key is None:
             return False
-
-        remote_gateway_public_key = utils.deserialize_key(remote_gateway_public_key_str)
-        encrypted_connection = utils.encrypt_connection(connection, remote_gateway_public_key)
+        session_key = None
+        encrypted_connections = []
+        if session_keys_supported:
+            session_key, wrapped_session_key = self._get_session_key(remote_gateway, serialized_public_key, public_key)
+            for rule, connections in flips:
+                if rule.type in utils.action_connection_types:
+                    if connections:
+                        encrypted_connections.append(utils.seal_action_connection(rule, connections, session_key, source))
+                else:
+                    encrypted_connections.extend([utils.seal_connection(c, session_key, source) for c in connections])
+        else:
+            for unused_rule, connections in flips:
+                encrypted_connections.extend([utils.encrypt_connection(c, public_key) for c in connections])
+        flip_requests = {}
+        for encrypted_connection in encrypted_connections:
+            flip_requests[utils.flip_request_field(source, encrypted_connection.rule)] = \
+                utils.serialize_connection_request(FlipStatus.PENDING, source, encrypted_connection)
 
         # Send data
-        serialized_data = utils.serialize_connection_request(
-            FlipStatus.PENDING, source, encrypted_connection)
-        self._redis_server.sadd(key, serialized_data)
+        pipe = self._redis_server.pipeline()
+        if session_key is not None:
+            # always along with the flips, the remote gateway's copy may have been lost (e.g. hub restarts)
+            pipe.hset(hub_api.create_rocon_gateway_key(remote_gateway, 'session_keys'), source, wrapped_session_key)
+        if flip_requests:
+            # replaces any existing requests for these flips, e.g. broken ones from a previous gateway instance
+            pipe.hmset(key, flip_requests)
+        if post_details and flips:
+            pipe.sadd(hub_api.create_rocon_gateway_key(self._unique_gateway_name, 'flips'),
+                      *[utils.serialize([remote_gateway, rule.name, rule.type, rule.node]) for rule, unused_connections in flips])
+        pipe.publish(hub_api.create_rocon_gateway_key(remote_gateway, 'notifications'), NOTIFY_FLIP_INS)
+        try:
+            pipe.execute()
+        except redis.ResponseError as e:
+            if not _is_wrong_type(e):
+                raise
+            # an older gateway, its flip ins are still a set (everything else in the transaction went through)
+            self._send_old_flip_requests(key, flip_requests)
         return True
 
+    def _send_old_flip_requests(self, key, flip_requests):
+        '''
+          Send flip requests to a gateway that still keeps its flip ins in a
+          set (the layout before the hash), replacing any it already has
+          from us for the same flips.
+
+          @param key : the remote gateway's flip_ins key
+          @type str
+          @param flip_requests : serialised flip requests keyed by flip_ins field
+          @type dict
+        '''
+        replaced = [flip_in for field, flip_in in self._get_old_flip_ins(key) if field in flip_requests]
+        pipe = self._redis_server.pipeline()
+        if replaced:
+            pipe.srem(key, *replaced)
+        pipe.sadd(key, *flip_requests.values())
+        pipe.execute()
+
+    def _get_remote_encryption(self, remote_gateway, timeout):
+        '''
+          Look up how to encrypt flips for a remote gateway, from the directory
+          if we have one, else straight from the hub.
+
+          This doesn't wait for a public key that isn't there yet, it starts
+          the clock instead and returns so that other flips can carry on. A
+          gateway registering on the hub wakes up the flipped stage
+          (NOTIFY_PUBLIC_KEYS) to try again. Once the timeout runs out, the
+          remote gateway isn't looked up again until the next gateway
+          registers (or unregisters) on the hub, but the flips stay pending.
+
+          @return serialised and deserialised public key (None if not found), whether it accepts session keys
+          @rtype (str, Crypto.PublicKey.RSA key object, Bool)
+        '''
+        self._encryption_lock.acquire()
+        # without notifications, there is nothing to say when to look again, so always look (quietly)
+        skip = self._failed_public_keys.get(remote_gateway, None) is False and \
+            self.hub_notification_listener_thread is not None
+        if remote_gateway in self._failed_public_keys:
+            self._failed_public_keys[remote_gateway] = False  # this is its one more look
+        self._encryption_lock.release()
+        if skip:
+            return None, None, False
+        directory = self._get_directory()
+        if directory is not None:
+            serialized_public_key = directory.get_serialized_public_key(remote_gateway)
+            public_key = directory.get_public_key(remote_gateway)
+            session_keys_supported = directory.supports_session_keys(remote_gateway)
+        else:
+            try:
+                pipe = self._redis_server.pipeline()
+                pipe.get(hub_api.create_rocon_gateway_key(remote_gateway, 'public_key'))
+                pipe.get(hub_api.create_rocon_gateway_key(remote_gateway, 'encryption'))
+                serialized_public_key, encryption = pipe.execute()
+            except (redis.ConnectionError, AttributeError) as unused_e:
+                serialized_public_key, encryption = None, None
+            public_key = utils.deserialize_key(serialized_public_key) if serialized_public_key is not None else None
+            session_keys_supported = _supports_session_keys(encryption)
+        self._encryption_lock.acquire()
+        if public_key is not None:
+            self._awaited_public_keys.pop(remote_gateway, None)
+            self._failed_public_keys.pop(remote_gateway, None)
+            self._encryption_lock.release()
+            return serialized_public_key, public_key, session_keys_supported
+        if remote_gateway in self._failed_public_keys:
+            self._encryption_lock.release()
+            return None, None, False
+        deadline = self._awaited_public_keys.setdefault(remote_gateway, time.time() + timeout)
+        expired = time.time() > deadline
+        if expired:
+            del self._awaited_public_keys[remote_gateway]
+            self._failed_public_keys[remote_gateway] = False
+        self._encryption_lock.release()
+        if expired:
+            rospy.logerr("Gateway : flip to " + remote_gateway +
+                         " failed as public key not found, waiting for it to register again")
+        else:
+            rospy.logdebug("Gateway : waiting for the public key of [%s] to flip to it" % remote_gateway)
+        return None, None, False
+
+    def _get_session_key(self, remote_gateway, serialized_public_key, public_key):
+        '''
+          Get the session key for sealing flips to a remote gateway. A new one
+          is generated (and wrapped with the public key) the first time, or if
+          the remote gateway's public key has changed (i.e. it restarted).
+
+          @return the session key and the session key wrapped for the remote gateway
+          @rtype (bytes, bytes)
+        '''
+        # cached straight away, so concurrent flips to the same gateway all use the same key
+        # (it is sent along with every flip, so it doesn't matter which send gets there first)
+        self._encryption_lock.acquire()
+        cached = self._session_keys.get(remote_gateway, None)
+        self._encryption_lock.release()
+        if cached is not None and cached[0] == serialized_public_key:
+            return cached[1], cached[2]
+        session_key = utils.generate_session_key()
+        wrapped_session_key = utils.wrap_session_key(session_key, public_key)
+        self._encryption_lock.acquire()
+        cached = self._session_keys.get(remote_gateway, None)
+        if cached is not None and cached[0] == serialized_public_key:
+            # somebody else got in first, theirs is the one in use
+            unused_public_key, session_key, wrapped_session_key = cached
+        else:
+            self._session_keys[remote_gateway] = (serialized_public_key, session_key, wrapped_session_key)
+        self._encryption_lock.release()
+        return session_key, wrapped_session_key
+
+    def _get_received_session_key(self, source, wrapped_session_keys):
+        '''
+          Unwrap (only the first time it is seen) the session key a remote gateway sent us.
+
+          @param source : the remote gateway
+          @type str
+          @param wrapped_session_keys : wrapped session keys keyed by remote gateway, as read from the hub
+          @type dict
+
+          @return the session key or None if it hasn't sent one (or it couldn't be unwrapped)
+          @rtype bytes
+        '''
+        wrapped_session_key = wrapped_session_keys.get(source, wrapped_session_keys.get(source.encode(), None))
+        if wrapped_session_key is None:
+            return None
+        self._encryption_lock.acquire()
+        cached = self._received_session_keys.get(source, None)
+        self._encryption_lock.release()
+        if cached is not None and cached[0] == wrapped_session_key:
+            return cached[1]
+        try:
+            session_key = utils.unwrap_session_key(wrapped_session_key, self.private_key)
+        except ValueError:
+            rospy.logwarn("Gateway : could not unwrap the session key from [%s]" % source)
+            session_key = None
+        self._encryption_lock.acquire()
+        self._received_session_keys[source] = (wrapped_session_key, session_key)
+        self._encryption_lock.release()
+        return session_key
+
     def send_unflip_request(self, remote_gateway, rule):
+        if rule.type in utils.action_connection_types and self._send_unflip_request(remote_gateway, rule):
+            return True  # it went as a single compound flip request
         unflipped = True
         exp_rules = self.rule_explode([rule])
         for r in exp_rules:
@@ -915,17 +1745,21 @@ class GatewayHub(rocon_hub_client.Hub):
           @rtype Boolean
         '''
         key = hub_api.create_rocon_gateway_key(remote_gateway, 'flip_ins')
-        # rule.node is two parts (node_name, xmlrpc_uri) - but serialised connection rule is only node name
-        # strip the xmlrpc_uri for comparision tests
-        rule.node = rule.node.split(",")[0]
+        source = hub_api.key_base_name(self._redis_keys['gateway'])
         try:
-            encoded_flip_ins = self._redis_server.smembers(key)
-            for flip_in in encoded_flip_ins:
-                unused_status, source, connection_list = utils.deserialize_request(flip_in)
-                connection = utils.get_connection_from_list(connection_list)
-                if source == hub_api.key_base_name(self._redis_keys['gateway']) and rule == connection.rule:
-                    self._redis_server.srem(key, flip_in)
-                    return True
+            # rule.node is two parts (node_name, xmlrpc_uri) - flip_request_field only uses the node name
+            try:
+                removed = self._redis_server.hdel(key, utils.flip_request_field(source, rule))
+            except redis.exceptions.ResponseError as e:
+                if not _is_wrong_type(e):
+                    raise
+                # an older gateway, its flip ins are still a set
+                field = utils.flip_request_field(source, rule)
+                old_flip_ins = [flip_in for old_field, flip_in in self._get_old_flip_ins(key) if old_field == field]
+                removed = self._redis_server.srem(key, *old_flip_ins) if old_flip_ins else 0
+            if removed:
+                self._notify_gateway(remote_gateway, NOTIFY_FLIP_INS)
+                return True
         except redis.exceptions.ConnectionError:
             # usually just means the hub has gone down just before us or is in the
             # middle of doing so let it die nice and peacefully
@@ -10,6 +10,8 @@
 import rospy
 import rocon_gateway
 import uuid
+import diagnostic_msgs.msg as diagnostic_msgs
+import diagnostic_msgs.srv as diagnostic_srvs
 import gateway_msgs.msg as gateway_msgs
 import gateway_msgs.srv as gateway_srvs
 import std_msgs.msg as std_msgs
@@ -19,6 +21,7 @@ import rocon_hub_client
 
 from . import gateway
 from . import hub_manager
+from . import key_store
 
 ##############################################################################
 # Gateway Configuration and Main Loop Class
@@ -45,6 +48,8 @@ class GatewayNode():
             key = uuid.uuid4()
             self._unique_name = self._param['name'] + key.hex
             rospy.loginfo("Gateway : generated unique hash name [%s]" % self._unique_name)
+        # get the (slow) key generation going in the background as early as possible
+        self._key_store = key_store.KeyStore(self._param['name'], self._param['persistent_keys'])
         self._disallowed_hubs = {}
         self._disallowed_hubs_error_codes = [gateway_msgs.ErrorCodes.HUB_CONNECTION_NOT_IN_NONEMPTY_WHITELIST,
                                              gateway_msgs.ErrorCodes.HUB_CONNECTION_BLACKLISTED,
@@ -55,12 +60,14 @@ class GatewayNode():
                                              ]
         self._hub_manager = hub_manager.HubManager(
             hub_whitelist=self._param['hub_whitelist'],
-            hub_blacklist=self._param['hub_blacklist']
+            hub_blacklist=self._param['hub_blacklist'],
+            hub_concurrency=self._param['hub_concurrency']
         )
         # Be careful of the construction sequence here, parts depend on others.
         self._gateway_publishers = self._setup_ros_publishers()
         # self._publish_gateway_info needs self._gateway_publishers
-        self._gateway = gateway.Gateway(self._hub_manager, self._param, self._unique_name, self._publish_gateway_info)
+        self._gateway = gateway.Gateway(self._hub_manager, self._param, self._unique_name, self._publish_gateway_info,
+                                        self._publish_statistics)
         self._gateway_services = self._setup_ros_services()  # Needs self._gateway
         self._gateway_subscribers = self._setup_ros_subscribers()  # Needs self._gateway
         # 'ip:port' : (error_code, error_code_str) dictionary of hubs that this gateway has tried to register,
@@ -89,6 +96,8 @@ class GatewayNode():
 
             # we still need this to cleanup threads locally
             self._hub_discovery_thread.shutdown()
+            self._hub_manager.shutdown()
+            self._gateway.master.shutdown()
 
             self._gateway = None
         except Exception as e:
@@ -166,11 +175,14 @@ class GatewayNode():
                 self._unique_name,
                 self._disengage_hub,
                 self._gateway.ip,
-                existing_advertisements
+                existing_advertisements,
+                self._gateway.trigger_update,
+                self._key_store.get_key_pair()
             )
         if hub:
             rospy.loginfo("Gateway : registering on the hub [%s]" % hub.name)
             self._publish_gateway_info()
+            self._gateway.trigger_update('hub registered')
 
         return error_code, error_code_str
 
@@ -216,6 +228,8 @@ class GatewayNode():
             '~pull', gateway_srvs.Remote, self._gateway.ros_service_pull)  # @IgnorePep8
         gateway_services['pull_all'] = rospy.Service(
             '~pull_all', gateway_srvs.RemoteAll, self._gateway.ros_service_pull_all)  # @IgnorePep8
+        gateway_services['get_statistics'] = rospy.Service(
+            '~get_statistics', diagnostic_srvs.SelfTest, self.ros_service_get_statistics)  # @IgnorePep8
         #gateway_services['set_watcher_period'] = rospy.Service(
         #    '~set_watcher_period',
         #    gateway_srvs.SetWatcherPeriod,
@@ -225,12 +239,13 @@ class GatewayNode():
     def _setup_ros_publishers(self):
         gateway_publishers = {}
         gateway_publishers['gateway_info'] = rospy.Publisher('~gateway_info', gateway_msgs.GatewayInfo, latch=True, queue_size=5)
+        gateway_publishers['statistics'] = rospy.Publisher('~statistics', diagnostic_msgs.DiagnosticArray, queue_size=5)
         return gateway_publishers
 
     def _setup_ros_subscribers(self):
         gateway_subscribers = {}
-        #gateway_subscribers['force_update'] = rospy.Subscriber(
-        #    '~force_update', std_msgs.Empty, self._gateway.ros_subscriber_force_update)
+        gateway_subscribers['force_update'] = rospy.Subscriber(
+            '~force_update', std_msgs.Empty, self._gateway.ros_subscriber_force_update)
         return gateway_subscribers
 
     ##########################################################################
@@ -279,6 +294,27 @@ class GatewayNode():
         except AttributeError:
             pass  # occurs if self._gateway is reset to None in the middle of all this.
 
+    def _publish_statistics(self):
+        '''
+          Publish the watcher's per stage timing statistics. This gets run as one of the
+          watcher stages.
+        '''
+        statistics = diagnostic_msgs.DiagnosticArray()
+        statistics.header.stamp = rospy.Time.now()
+        statistics.status = self._gateway.get_statistics()
+        self._gateway_publishers['statistics'].publish(statistics)
+
+    def ros_service_get_statistics(self, request):
+        '''
+          Return the watcher's per stage timing statistics on request. The test passes
+          if none of the stages are regularly overrunning their periods.
+        '''
+        response = diagnostic_srvs.SelfTestResponse()
+        response.id = self._unique_name
+        response.status = self._gateway.get_statistics()
+        response.passed = all([status.level == diagnostic_msgs.DiagnosticStatus.OK for status in response.status])
+        return response
+
     def ros_service_remote_gateway_info(self, request):
         """
           Sends out to the hubs to get the remote gateway information for either the specified,
@@ -7,6 +7,7 @@
 # Imports
 ###############################################################################
 
+import concurrent.futures
 import threading
 
 import rospy
@@ -17,6 +18,17 @@ from .exceptions import GatewayUnavailableError
 from . import gateway_hub
 from . import utils
 
+##############################################################################
+# Functions
+##############################################################################
+
+
+def _match_remote_gateway_name(hub, remote_gateway_name):
+    '''
+      Strong and weak remote gateway name matches on a single hub (see HubManager.match_remote_gateway_name).
+    '''
+    return hub.matches_remote_gateway_name(remote_gateway_name), hub.matches_remote_gateway_basename(remote_gateway_name)
+
 ##############################################################################
 # Hub Manager
 ##############################################################################
@@ -32,16 +44,79 @@ class HubManager(object):
     # Init & Shutdown
     ##########################################################################
 
-    def __init__(self, hub_whitelist, hub_blacklist):
+    def __init__(self, hub_whitelist, hub_blacklist, hub_concurrency=4):
+        '''
+          @param hub_whitelist, hub_blacklist : hub names/ips to work with/avoid
+          @type str[]
+          @param hub_concurrency : maximum number of hubs to talk to in parallel
+          @type int
+        '''
         self._param = {}
         self._param['hub_whitelist'] = hub_whitelist
         self._param['hub_blacklist'] = hub_blacklist
         self.hubs = []
         self._hub_lock = threading.Lock()
+        self._disengaged_hub_round_trips = 0  # keeps round_trips() monotonic as hubs come and go
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, hub_concurrency))
+
+    def shutdown(self):
+        '''
+          Stop the worker threads used for talking to hubs in parallel.
+        '''
+        self._executor.shutdown(wait=False)
 
     def is_connected(self):
         return True if self.hubs else False
 
+    def round_trips(self):
+        '''
+          Total number of requests made to hubs, used for the watcher statistics.
+
+          @return running total of hub round trips
+          @rtype int
+        '''
+        self._hub_lock.acquire()
+        round_trips = self._disengaged_hub_round_trips + sum([hub.round_trips() for hub in self.hubs])
+        self._hub_lock.release()
+        return round_trips
+
+    def _map_hubs(self, function, *args):
+        '''
+          Call a function on every hub in parallel, so a slow hub only delays
+          the caller by its own latency rather than adding to everyone else's.
+          A failure on one hub is logged and doesn't affect the results from
+          the others.
+
+          @param function : called as function(hub, *args)
+          @type method
+          @param args : extra arguments for the function
+
+          @return results from the hubs the call succeeded on, in hub order
+          @rtype (rocon_gateway.GatewayHub, result)[]
+        '''
+        self._hub_lock.acquire()
+        hubs = list(self.hubs)
+        self._hub_lock.release()
+        if len(hubs) < 2:
+            # no point handing off to a worker thread
+            futures = []
+            for hub in hubs:
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(function(hub, *args))
+                except Exception as e:
+                    future.set_exception(e)
+                futures.append((hub, future))
+        else:
+            futures = [(hub, self._executor.submit(function, hub, *args)) for hub in hubs]
+        results = []
+        for hub, future in futures:
+            try:
+                results.append((hub, future.result()))
+            except Exception as e:
+                rospy.logwarn("Gateway : error while talking to the hub [%s][%s][%s]" % (hub.name, function.__name__, str(e)))
+        return results
+
     ##########################################################################
     # Introspection
     ##########################################################################
@@ -56,10 +131,8 @@ class HubManager(object):
           @rtype list of str
         '''
         remote_gateway_names = []
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            remote_gateway_names.extend(hub.list_remote_gateway_names())
-        self._hub_lock.release()
+        for unused_hub, names in self._map_hubs(gateway_hub.GatewayHub.list_remote_gateway_names):
+            remote_gateway_names.extend(names)
         # return the list without duplicates
         return list(set(remote_gateway_names))
 
@@ -71,16 +144,17 @@ class HubManager(object):
             dic['remote_gateway_name'] = ['hub1', 'hub2']
 
           where the hub list is a list of actual hub object references.
+
+          This also refreshes each hub's remote gateway directory, which the
+          rest of the watcher loop then works from.
         '''
         dic = {}
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            for remote_gateway in hub.list_remote_gateway_names():
+        for hub, remote_gateway_names in self._map_hubs(gateway_hub.GatewayHub.refresh_directory):
+            for remote_gateway in remote_gateway_names:
                 if remote_gateway in dic:
                     dic[remote_gateway].append(hub)
                 else:
                     dic[remote_gateway] = [hub]
-        self._hub_lock.release()
         return dic
 
     def get_flip_requests(self):
@@ -91,10 +165,8 @@ class HubManager(object):
           @rtype list of utils.Registration
         '''
         registrations = []
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            registrations.extend(hub.get_unblocked_flipped_in_connections())
-        self._hub_lock.release()
+        for unused_hub, hub_registrations in self._map_hubs(gateway_hub.GatewayHub.get_unblocked_flipped_in_connections):
+            registrations.extend(hub_registrations)
         return registrations
 
     def remote_gateway_info(self, remote_gateway_name):
@@ -177,7 +249,9 @@ class HubManager(object):
                        gateway_unique_name,
                        gateway_disengage_hub,  # hub connection lost hook
                        gateway_ip,
-                       existing_advertisements
+                       existing_advertisements,
+                       hub_notification_hook=None,
+                       key_pair=None
                        ):
         '''
           Attempts to make a connection and register the gateway with a hub.
@@ -194,6 +268,10 @@ class HubManager(object):
           @param gateway_ip
           @param existing advertisements
           @type { utils.ConnectionTypes : utils.Connection[] }
+          @param hub_notification_hook : called when the hub notifies of relevant changes
+          @type method : Gateway.trigger_update()
+          @param key_pair : the gateway's private and public key
+          @type (Crypto.PublicKey.RSA key object, Crypto.PublicKey.RSA key object)
 
           @return an integer indicating error (important for the service call)
           @rtype gateway_msgs.ErrorCodes
@@ -206,6 +284,8 @@ class HubManager(object):
                                      gateway_unique_name,
                                      gateway_disengage_hub,  # hub connection lost hook
                                      gateway_ip,
+                                     hub_notification_hook,
+                                     key_pair
                                      )
             for connection_type in utils.connection_types:
                 for advertisement in existing_advertisements[connection_type]:
@@ -213,6 +293,7 @@ class HubManager(object):
 
             # forcefully replace obsolete hub if needed
             if new_hub in self.hubs:
+                self._disengaged_hub_round_trips += self.hubs[self.hubs.index(new_hub)].round_trips()
                 self.hubs.remove(new_hub)
 
             self.hubs.append(new_hub)
@@ -261,20 +342,15 @@ class HubManager(object):
         if hub_to_be_disengaged in self.hubs:
             rospy.loginfo("Gateway : disengaged connection with the hub [%s][%s]" % (
                 hub_to_be_disengaged.name, hub_to_be_disengaged.uri))
+            self._disengaged_hub_round_trips += sum([hub.round_trips() for hub in self.hubs if hub == hub_to_be_disengaged])
             self.hubs[:] = [hub for hub in self.hubs if hub != hub_to_be_disengaged]
         self._hub_lock.release()
 
     def advertise(self, connection):
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            hub.advertise(connection)
-        self._hub_lock.release()
+        self._map_hubs(gateway_hub.GatewayHub.advertise, connection)
 
     def unadvertise(self, connection):
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            hub.unadvertise(connection)
-        self._hub_lock.release()
+        self._map_hubs(gateway_hub.GatewayHub.unadvertise, connection)
 
     def match_remote_gateway_name(self, remote_gateway_name):
         '''
@@ -283,16 +359,20 @@ class HubManager(object):
         '''
         matches = []
         weak_matches = []  # doesn't match any hash names, but matches a base name
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            matches.extend(hub.matches_remote_gateway_name(remote_gateway_name))
-            weak_matches.extend(hub.matches_remote_gateway_basename(remote_gateway_name))
-        self._hub_lock.release()
+        for unused_hub, (hub_matches, hub_weak_matches) in self._map_hubs(_match_remote_gateway_name, remote_gateway_name):
+            matches.extend(hub_matches)
+            weak_matches.extend(hub_weak_matches)
         # these are hash name lists, make sure they didn't pick up matches for a single hash name from multiple hubs
         matches = list(set(matches))
         weak_matches = list(set(weak_matches))
         return matches, weak_matches
 
+    def refresh_ping(self):
+        '''
+          Let every hub this gateway is connected to know that it is still alive.
+        '''
+        self._map_hubs(gateway_hub.GatewayHub.refresh_ping)
+
     def publish_network_statistics(self, statistics):
         '''
           Publish network statistics to every hub this gateway is connected to.
@@ -300,7 +380,4 @@ class HubManager(object):
           @param statistics
           @type gateway_msgs.ConnectionStatistics
         '''
-        self._hub_lock.acquire()
-        for hub in self.hubs:
-            hub.publish_network_statistics(statistics)
-        self._hub_lock.release()
+        self._map_hubs(gateway_hub.GatewayHub.publish_network_statistics, statistics)
@@ -12,10 +12,157 @@ import re
 import copy
 import threading
 
+import rocon_gateway_utils
 from gateway_msgs.msg import RemoteRule
 
 from . import utils
 
+##############################################################################
+# Rule Index
+##############################################################################
+
+_regex_special_characters = frozenset('.^$*+?{}[]\\|()')
+
+
+def _is_literal(pattern):
+    '''
+      @return True if the pattern has no regex special characters, i.e. it only fully matches itself
+      @rtype Bool
+    '''
+    return not any([c in _regex_special_characters for c in pattern])
+
+
+def _full_match(compiled_pattern, string):
+    '''
+      The gateway's usual definition of a match - the regex has to match the whole string.
+    '''
+    match_result = compiled_pattern.match(string)
+    return match_result is not None and match_result.group() == string
+
+
+class IndexedRule(object):
+
+    '''
+      A watchlist rule with its patterns compiled ahead of time.
+
+       - position               (index of the rule in the watchlist, to preserve ordering)
+       - remote_rule            (the watchlist rule, gateway_msgs.msg.RemoteRule)
+       - name_variants          ((name, compiled name pattern) list, tried in order)
+       - matched_gateways       (remote gateways this rule matches, see RuleIndex.resolve_gateways)
+    '''
+
+    def __init__(self, position, remote_rule, name_variants):
+        self.position = position
+        self.remote_rule = remote_rule
+        self.name_variants = [(variant, re.compile(variant)) for variant in name_variants]
+        self.node_pattern = re.compile(remote_rule.rule.node) if remote_rule.rule.node else None
+        self._gateway_pattern = re.compile(remote_rule.gateway)
+        self.matched_gateways = []
+
+    def matches_gateway(self, gateway):
+        '''
+          Check for regular expression, perfect or basename match.
+        '''
+        return _full_match(self._gateway_pattern, gateway) or \
+            self.remote_rule.gateway == rocon_gateway_utils.gateway_basename(gateway)
+
+    def matches(self, name, node, blacklist):
+        '''
+          Equivalent to InteractiveInterface.is_matched over each of the name variants.
+
+          @param blacklist : compiled blacklist for the rule type and gateway (see RuleIndex)
+          @type (compiled name pattern, compiled node pattern or None)[]
+        '''
+        for variant, name_pattern in self.name_variants:
+            if not _full_match(name_pattern, name):
+                continue
+            if utils.is_all_pattern(variant) and _is_blacklisted(blacklist, name, node):
+                continue
+            if self.node_pattern is None or _full_match(self.node_pattern, node):
+                return True
+        return False
+
+
+def _is_blacklisted(blacklist, name, node):
+    for name_pattern, node_pattern in blacklist:
+        if _full_match(name_pattern, name):
+            if node_pattern is None or _full_match(node_pattern, node):
+                return True
+    return False
+
+
+class RuleIndex(object):
+
+    '''
+      Watchlist rules indexed for fast matching against connections. Rules with
+      literal names are looked up by name, only rules with regex names need to
+      be checked one by one. This is rebuilt whenever the watchlist changes
+      (see InteractiveInterface.get_rule_index).
+    '''
+
+    def __init__(self, watchlist, blacklists, name_variants):
+        '''
+          @param watchlist : the interface's watchlist
+          @type connection type keyed dictionary of gateway_msgs.msg.RemoteRule lists
+          @param blacklists : the interface's flip/pull all blacklists
+          @type gateway keyed dictionary of connection type keyed dictionaries of gateway_msgs.msg.Rule lists
+          @param name_variants : generates the names to try for a rule name
+          @type method
+        '''
+        self._literal_rules = utils.create_empty_connection_type_dictionary(dict)
+        self._pattern_rules = utils.create_empty_connection_type_dictionary()
+        self._rules = []
+        for connection_type in utils.connection_types:
+            for position, remote_rule in enumerate(watchlist[connection_type]):
+                indexed_rule = IndexedRule(position, remote_rule, name_variants(remote_rule.rule.name))
+                self._rules.append(indexed_rule)
+                variants = [variant for variant, unused_pattern in indexed_rule.name_variants]
+                if all([_is_literal(variant) for variant in variants]):
+                    for variant in variants:
+                        self._literal_rules[connection_type].setdefault(variant, []).append(indexed_rule)
+                else:
+                    self._pattern_rules[connection_type].append(indexed_rule)
+        self._blacklists = {}
+        for gateway, blacklist in blacklists.items():
+            self._blacklists[gateway] = utils.create_empty_connection_type_dictionary()
+            for connection_type in utils.connection_types:
+                for rule in blacklist[connection_type]:
+                    self._blacklists[gateway][connection_type].append(
+                        (re.compile(rule.name), re.compile(rule.node) if rule.node else None))
+        self._resolved_gateways = None
+
+    def resolve_gateways(self, remote_gateways):
+        '''
+          Work out which of the remote gateways each rule applies to. Only
+          redone when the set of remote gateways changes.
+
+          @param remote_gateways : remote gateway hash names
+          @type str[]
+        '''
+        remote_gateways = list(remote_gateways)
+        if frozenset(remote_gateways) == self._resolved_gateways:
+            return
+        self._resolved_gateways = frozenset(remote_gateways)
+        for indexed_rule in self._rules:
+            indexed_rule.matched_gateways = [gateway for gateway in remote_gateways if indexed_rule.matches_gateway(gateway)]
+
+    def match(self, connection_type, name, node):
+        '''
+          Find the rules matching a connection, in watchlist order.
+
+          @return the matching rules
+          @rtype IndexedRule[]
+        '''
+        candidates = self._literal_rules[connection_type].get(name, []) + self._pattern_rules[connection_type]
+        if len(candidates) > 1:
+            candidates = sorted(candidates, key=lambda indexed_rule: indexed_rule.position)
+        matched_rules = []
+        for indexed_rule in candidates:
+            blacklist = self._blacklists.get(indexed_rule.remote_rule.gateway, {}).get(connection_type, [])
+            if indexed_rule.matches(name, node, blacklist):
+                matched_rules.append(indexed_rule)
+        return matched_rules
+
 ##############################################################################
 # Classes
 ##############################################################################
@@ -50,14 +197,20 @@ class InteractiveInterface(object):
         # Specific rules used to determine what local rules to flip
         self.watchlist = utils.create_empty_connection_type_dictionary()
 
-        # keys are connection_types, elements are lists of utils.Registration objects
+        # keys are connection_types, elements are utils.Registration objects keyed by utils.registration_key
         # Flips from remote gateways that have been locally registered
-        self.registrations = utils.create_empty_connection_type_dictionary()
+        self.registrations = utils.create_empty_connection_type_dictionary(dict)
 
         # Blacklists when doing flip all - different for each gateway, each value
         # is one of our usual rule type dictionaries
         self._blacklist = {}
 
+        # Bumped whenever the watchlist or blacklists change, so that
+        # incremental updates know when they need to recompute from scratch
+        self.rules_version = 0
+        self._rule_index = None
+        self._rule_index_key = None
+
         self._lock = threading.Lock()
 
         # Load up static rules.
@@ -93,6 +246,7 @@ class InteractiveInterface(object):
                 break
         if not rule_already_exists:
             self.watchlist[remote_rule.rule.type].append(remote_rule)
+            self.rules_version += 1
             result = remote_rule
         self._lock.release()
         return result
@@ -116,6 +270,7 @@ class InteractiveInterface(object):
             try:
                 self._lock.acquire()
                 self.watchlist[remote_rule.rule.type].remove(remote_rule)
+                self.rules_version += 1
                 self._lock.release()
                 return [remote_rule]
             except ValueError:
@@ -131,6 +286,8 @@ class InteractiveInterface(object):
                     existing_rules.append(existing_rule)
             for rule in existing_rules:
                 self.watchlist[remote_rule.rule.type].remove(rule)  # not terribly optimal
+            if existing_rules:
+                self.rules_version += 1
             self._lock.release()
             return existing_rules
 
@@ -168,6 +325,7 @@ class InteractiveInterface(object):
                 rule for rule in self.watchlist[connection_type] if rule.gateway != gateway]
             # basically self.add_rule() - do it manually here so we don't deadlock locks
             self.watchlist[connection_type].append(remote_rule)
+        self.rules_version += 1
         self._lock.release()
         return True
 
@@ -189,8 +347,33 @@ class InteractiveInterface(object):
                         self.watchlist[connection_type].remove(rule)
                     except ValueError:
                         pass  # should never get here
+        self.rules_version += 1
         self._lock.release()
 
+    def get_rule_index(self, unique_name):
+        '''
+          The watchlist, compiled for matching. Only rebuilt when the rules change.
+          Callers need to hold the lock.
+
+          @param unique_name : this gateway's unique hash name
+          @type str
+
+          @rtype RuleIndex
+        '''
+        key = (self.rules_version, unique_name)
+        if self._rule_index is None or key != self._rule_index_key:
+            self._rule_index = RuleIndex(self.watchlist, self._blacklist,
+                                         lambda rule_name: self._name_variants(rule_name, unique_name))
+            self._rule_index_key = key
+        return self._rule_index
+
+    def _name_variants(self, rule_name, unique_name):
+        '''
+          Names a connection name is checked against for a rule name, in order : the
+          rule name itself, then prefixed with this gateway's namespace or a slash.
+        '''
+        return [rule_name, '/' + unique_name + '/' + rule_name, '/' + rule_name]
+
     ##########################################################################
     # Accessors for Gateway Info
     ##########################################################################
@@ -223,7 +406,7 @@ class InteractiveInterface(object):
         '''
         local_registrations = []
         for connection_type in utils.connection_types:
-            for registration in self.registrations[connection_type]:
+            for registration in self.registrations[connection_type].values():
                 remote_rule = RemoteRule()
                 remote_rule.gateway = registration.remote_gateway
                 remote_rule.rule.name = registration.connection.rule.name
@@ -269,21 +452,50 @@ class InteractiveInterface(object):
           @return matching registration or none
           @rtype utils.Registration
         '''
-
-        matched_registration = None
         self._lock.acquire()
-        for registration in self.registrations[connection_type]:
-            if (registration.remote_gateway == remote_gateway) and \
-               (registration.connection.rule.name == remote_name) and \
-               (registration.connection.rule.node == remote_node) and \
-               (registration.connection.rule.type == connection_type):
-                matched_registration = registration
-                break
-            else:
-                continue
+        matched_registration = self.registrations[connection_type].get(
+            (remote_gateway, connection_type, remote_name, remote_node), None)
         self._lock.release()
         return matched_registration
 
+    def add_registration(self, registration):
+        '''
+          Store a registration, replacing any existing one for the same remote connection.
+
+          @param registration : the registration
+          @type utils.Registration
+        '''
+        self._lock.acquire()
+        self.registrations[registration.connection.rule.type][utils.registration_key(registration)] = registration
+        self._lock.release()
+
+    def remove_registration(self, registration):
+        '''
+          Remove a registration (or whichever is stored for the same remote connection).
+
+          @param registration : the registration
+          @type utils.Registration
+        '''
+        self._lock.acquire()
+        self.registrations[registration.connection.rule.type].pop(utils.registration_key(registration), None)
+        self._lock.release()
+
+    def get_registration_index(self):
+        '''
+          Snapshot of the registrations for quick lookups, e.g. when processing
+          a large batch of changes. Like find_registration_match, it doesn't
+          use the local node name.
+
+          @return the registrations keyed as per utils.registration_key, i.e. (remote gateway, type, name, node)
+          @rtype dict of utils.Registration
+        '''
+        self._lock.acquire()
+        registration_index = {}
+        for connection_type in utils.connection_types:
+            registration_index.update(self.registrations[connection_type])
+        self._lock.release()
+        return registration_index
+
     def _is_in_blacklist(self, gateway, connection_type, name, node):
         '''
           Check if a particular connection is in the blacklist. Use this to
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import os
+import threading
+
+import rospkg
+import rospy
+
+from . import utils
+
+###############################################################################
+# Key Store
+###############################################################################
+
+
+class KeyStore(object):
+
+    '''
+      Provides the gateway's rsa key pair. Generating a key is slow (seconds
+      on some robot computers), so it is done once, in the background, as soon
+      as the store is created and then reused for every hub registration. If
+      persistent, the private key is saved (readable only by the owner) under
+      the ros home directory, keyed by gateway name, and reused on restarts.
+      Remote gateways then see the same public key and have no need to resend
+      their flips.
+    '''
+
+    def __init__(self, name, persistent=True, directory=None):
+        '''
+          @param name : the gateway's (human readable) name
+          @type str
+          @param persistent : load/save the key from/to disk
+          @type Bool
+          @param directory : where to keep keys, defaults to ROS_HOME/rocon/gateway/keys
+          @type str
+        '''
+        if directory is None:
+            directory = os.path.join(rospkg.get_ros_home(), 'rocon', 'gateway', 'keys')
+        self.filename = os.path.join(directory, name.lower().replace(" ", "_") + '.pem') if persistent else None
+        self._private_key = None
+        self._public_key = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._load_or_generate)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_key_pair(self, timeout=None):
+        '''
+          Get the key pair, waiting for it to be loaded/generated if necessary.
+
+          @param timeout : maximum time to wait (seconds), None to wait as long as it takes
+          @type float
+
+          @return private and public key, (None, None) if not ready before the timeout
+          @rtype (Crypto.PublicKey.RSA key object, Crypto.PublicKey.RSA key object)
+        '''
+        self._ready.wait(timeout)
+        return self._private_key, self._public_key
+
+    def _load_or_generate(self):
+        try:
+            private_key = self._load()
+            if private_key is None:
+                private_key, unused_public_key = utils.generate_private_public_key()
+                self._save(private_key)
+            self._private_key = private_key
+            self._public_key = private_key.publickey()
+        finally:
+            self._ready.set()
+
+    def _load(self):
+        '''
+          @return the saved private key, None if there isn't one (or it couldn't be read)
+          @rtype Crypto.PublicKey.RSA key object
+        '''
+        if self.filename is None or not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename, 'rb') as f:
+                private_key = utils.deserialize_key(f.read())
+        except (IOError, OSError, ValueError, IndexError, TypeError) as e:
+            rospy.logwarn("Gateway : could not load the saved key, generating a new one [%s][%s]" % (self.filename, str(e)))
+            return None
+        if not private_key.has_private():
+            rospy.logwarn("Gateway : saved key is not a private key, generating a new one [%s]" % self.filename)
+            return None
+        rospy.loginfo("Gateway : loaded key [%s]" % self.filename)
+        return private_key
+
+    def _save(self, private_key):
+        '''
+          Write the private key out atomically, readable only by the owner.
+        '''
+        if self.filename is None:
+            return
+        temporary_filename = self.filename + '.tmp'
+        try:
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd = os.open(temporary_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(utils.serialize_key(private_key))
+            os.rename(temporary_filename, self.filename)
+            rospy.loginfo("Gateway : saved key [%s]" % self.filename)
+        except (IOError, OSError) as e:
+            # not fatal, we just have to generate another on restart
+            rospy.logwarn("Gateway : could not save the key [%s][%s]" % (self.filename, str(e)))
@@ -7,6 +7,7 @@
 # Imports
 ##############################################################################
 
+import concurrent.futures
 import os
 import socket
 import http.client as httplib
@@ -14,8 +15,6 @@ import errno
 from xmlrpc import client
 from contextlib import contextmanager
 
-from rosmaster.util import xmlrpcapi
-
 import rocon_python_comms
 
 try:
@@ -27,13 +26,100 @@ import threading
 
 import rospy
 import rosgraph
-import rostopic
-import rosservice
 import roslib.names
 import gateway_msgs.msg as gateway_msgs
 import rocon_gateway_utils
 
 from . import utils, GatewayError
+from .xmlrpc_transport import ServerProxyPool
+
+##############################################################################
+# Constants
+##############################################################################
+
+# Connection cache system state channels and the functions that convert them to gateway connections
+_connection_cache_channels = {
+    gateway_msgs.ConnectionType.ACTION_SERVER: ('action_servers', utils._get_connections_from_action_chan_dict),
+    gateway_msgs.ConnectionType.ACTION_CLIENT: ('action_clients', utils._get_connections_from_action_chan_dict),
+    gateway_msgs.ConnectionType.PUBLISHER: ('publishers', utils._get_connections_from_pub_sub_chan_dict),
+    gateway_msgs.ConnectionType.SUBSCRIBER: ('subscribers', utils._get_connections_from_pub_sub_chan_dict),
+    gateway_msgs.ConnectionType.SERVICE: ('services', utils._get_connections_from_service_chan_dict),
+}
+
+# Publisher/subscriber topics backing each connection type's registration on the master,
+# (connection type of the topic, name suffix, type suffix or None if the type is fixed, fixed type)
+_registration_topics = {
+    rocon_python_comms.PUBLISHER: [(rocon_python_comms.PUBLISHER, '', '', None)],
+    rocon_python_comms.SUBSCRIBER: [(rocon_python_comms.SUBSCRIBER, '', '', None)],
+    rocon_python_comms.ACTION_SERVER: [
+        (rocon_python_comms.SUBSCRIBER, '/goal', 'ActionGoal', None),
+        (rocon_python_comms.SUBSCRIBER, '/cancel', None, 'actionlib_msgs/GoalID'),
+        (rocon_python_comms.PUBLISHER, '/status', None, 'actionlib_msgs/GoalStatusArray'),
+        (rocon_python_comms.PUBLISHER, '/feedback', 'ActionFeedback', None),
+        (rocon_python_comms.PUBLISHER, '/result', 'ActionResult', None),
+    ],
+    rocon_python_comms.ACTION_CLIENT: [
+        (rocon_python_comms.PUBLISHER, '/goal', 'ActionGoal', None),
+        (rocon_python_comms.PUBLISHER, '/cancel', None, 'actionlib_msgs/GoalID'),
+        (rocon_python_comms.SUBSCRIBER, '/status', None, 'actionlib_msgs/GoalStatusArray'),
+        (rocon_python_comms.SUBSCRIBER, '/feedback', 'ActionFeedback', None),
+        (rocon_python_comms.SUBSCRIBER, '/result', 'ActionResult', None),
+    ],
+}
+
+# Maximum number of master api calls sent in a single system.multicall request
+_multicall_batch_size = 200
+
+# Deadlines (seconds) for each xmlrpc call to the local master and to (possibly remote) nodes
+_master_timeout = 10.0
+_node_timeout = 3.0
+
+##############################################################################
+# Registration Calls
+##############################################################################
+
+
+def _get_registration_calls(connection):
+    '''
+      The master api calls needed to register a connection.
+
+      @param connection : the connection to register
+      @type utils.Connection
+
+      @return (method name, arguments after the caller id) for each call
+      @rtype [(str, tuple)]
+    '''
+    if connection.rule.type == rocon_python_comms.SERVICE:
+        return [('registerService', (connection.rule.name, connection.type_info, connection.xmlrpc_uri))]
+    calls = []
+    for (topic_type, name_suffix, type_suffix, fixed_type) in _registration_topics.get(connection.rule.type, []):
+        method = 'registerPublisher' if topic_type == rocon_python_comms.PUBLISHER else 'registerSubscriber'
+        type_info = fixed_type if type_suffix is None else connection.type_info + type_suffix
+        calls.append((method, (connection.rule.name + name_suffix, type_info, connection.xmlrpc_uri)))
+    return calls
+
+
+def _get_unregistration_calls(connection):
+    '''
+      The master api calls needed to unregister a connection.
+
+      @param connection : the registered connection
+      @type utils.Connection
+
+      @return (method name, arguments after the caller id) for each call
+      @rtype [(str, tuple)]
+    '''
+    if connection.rule.type == rocon_python_comms.SERVICE:
+        return [('unregisterService', (connection.rule.name, connection.type_info))]
+    calls = []
+    for (topic_type, name_suffix, unused_type_suffix, unused_fixed_type) in _registration_topics.get(connection.rule.type, []):
+        method = 'unregisterPublisher' if topic_type == rocon_python_comms.PUBLISHER else 'unregisterSubscriber'
+        calls.append((method, (connection.rule.name + name_suffix, connection.xmlrpc_uri)))
+    return calls
+
+##############################################################################
+# Local Master
+##############################################################################
 
 
 class LocalMaster(rosgraph.Master):
@@ -45,13 +131,37 @@ class LocalMaster(rosgraph.Master):
       been pulled or flipped in from another gateway.
     '''
 
-    def __init__(self, connection_cache_timeout=None):
+    def __init__(self, connection_cache_timeout=None, connection_change_hook=None):
+        '''
+          @param connection_cache_timeout : how long to wait for the connection cache to appear
+          @type rospy.Time
+
+          @param connection_change_hook : called (no arguments) whenever the connection cache
+                 reports a change in the local system state, used to wake up the watcher loop.
+          @type method
+        '''
         rosgraph.Master.__init__(self, rospy.get_name())
 
         timeout = connection_cache_timeout or rospy.Time(30)
 
         self.connections_lock = threading.Lock()
         self.connections = utils.create_empty_connection_type_dictionary(set)
+        self._connection_change_hook = connection_change_hook
+        # per consumer (added, lost) connection changes since it last looked, None if it needs a full resync
+        self._change_journals = {}
+        # lookup tables built off the cached connections, save master round trips when generating
+        # connection details. Each maps name -> {value : [number of cached connections giving that
+        # value, generation of the connection cache diff that last added it (0 if a full resync)]}
+        self._node_uris = {}  # node name -> xmlrpc uris
+        self._topic_types = {}  # topic name -> message types (includes the topics behind actions)
+        self._services = {}  # service name -> (service uri, service type)
+        self._lookup_generation = 0
+        self._lookup_tables_lock = threading.Lock()
+        # keep-alive connections for master and node xmlrpc calls
+        self._master_proxies = ServerProxyPool(_master_timeout)
+        self._node_proxies = ServerProxyPool(_node_timeout)
+        # calls to nodes (e.g. on another gateway's robot) run here, they mustn't hold up the watcher loop
+        self._node_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
         # in case this class is used directly (script call) we need to find the connection cache
 
         connection_cache_namespace = rocon_gateway_utils.resolve_connection_cache(timeout)
@@ -69,6 +179,12 @@ class LocalMaster(rosgraph.Master):
         self.get_system_state = self.connection_cache.getSystemState
 
 
+    def shutdown(self):
+        '''
+          Stop the worker threads used for calls to nodes.
+        '''
+        self._node_executor.shutdown(wait=False)
+
     ##########################################################################
     # Registration
     ##########################################################################
@@ -83,193 +199,7 @@ class LocalMaster(rosgraph.Master):
           @return the updated registration object (only adds an anonymously generated local node name)
           @rtype utils.Registration
         '''
-        # rograph.Master doesn't care whether the node is prefixed with slash or not, but we use it to
-        # compare registrations later in FlippedInterface._is_registration_in_remote_rule()
-        registration.local_node = "/" + self._get_anonymous_node_name(registration.connection.rule.node)
-        rospy.logdebug("Gateway : registering a new node [%s] for [%s]" % (registration.local_node, registration))
-
-        # Then do we need checkIfIsLocal? Needs lots of parsing time, and the outer class should
-        # already have handle that.
-
-        node_master = rosgraph.Master(registration.local_node)
-        if registration.connection.rule.type == rocon_python_comms.PUBLISHER:
-            try:
-                node_master.registerPublisher(
-                    registration.connection.rule.name,
-                    registration.connection.type_info,
-                    registration.connection.xmlrpc_uri)
-                return registration
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to register a publisher on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to register a publisher on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to register a publisher on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-        elif registration.connection.rule.type == rocon_python_comms.SUBSCRIBER:
-            try:
-                self._register_subscriber(
-                    node_master,
-                    registration.connection.rule.name,
-                    registration.connection.type_info,
-                    registration.connection.xmlrpc_uri)
-                return registration
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to register a subscriber on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to register a subscriber on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to register a subscriber on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-        elif registration.connection.rule.type == rocon_python_comms.SERVICE:
-            node_name = rosservice.get_service_node(registration.connection.rule.name)
-            if node_name is not None:
-                rospy.logwarn(
-                    "Gateway : tried to register a service that is already locally available, aborting [%s][%s]" %
-                    (registration.connection.rule.name, node_name))
-                return None
-            else:
-                if registration.connection.rule.name is None:
-                    rospy.logerr(
-                        "Gateway : tried to register a service with name set to None [%s, %s, %s]" %
-                        (registration.connection.rule.name,
-                         registration.connection.type_info,
-                         registration.connection.xmlrpc_uri))
-                    return None
-                if registration.connection.type_info is None:
-                    rospy.logerr(
-                        "Gateway : tried to register a service with type_info set to None [%s, %s, %s]" %
-                        (registration.connection.rule.name,
-                         registration.connection.type_info,
-                         registration.connection.xmlrpc_uri))
-                    return None
-                if registration.connection.xmlrpc_uri is None:
-                    rospy.logerr(
-                        "Gateway : tried to register a service with xmlrpc_uri set to None [%s, %s, %s]" %
-                        (registration.connection.rule.name,
-                         registration.connection.type_info,
-                         registration.connection.xmlrpc_uri))
-                    return None
-                try:
-                    node_master.registerService(
-                        registration.connection.rule.name,
-                        registration.connection.type_info,
-                        registration.connection.xmlrpc_uri)
-                    return registration
-                except (socket.error, socket.gaierror) as e:
-                    rospy.logerr("Gateway : got socket error trying to register a service on the local master [%s][%s]" % (
-                        registration.connection.rule.name, str(e)))
-                    return None
-                except rosgraph.masterapi.Error as e:
-                    rospy.logerr("Gateway : got error trying to register a service on the local master [%s][%s]" % (
-                        registration.connection.rule.name, str(e)))
-                    return None
-                except rosgraph.masterapi.Failure as e:
-                    rospy.logerr("Gateway : failed to register a service on the local master [%s][%s]" % (
-                        registration.connection.rule.name, str(e)))
-                    return None
-        elif registration.connection.rule.type == rocon_python_comms.ACTION_SERVER:
-            try:
-                # Need to update these with self._register_subscriber
-                self._register_subscriber(
-                    node_master,
-                    registration.connection.rule.name +
-                    "/goal",
-                    registration.connection.type_info +
-                    "ActionGoal",
-                    registration.connection.xmlrpc_uri)
-                self._register_subscriber(
-                    node_master,
-                    registration.connection.rule.name +
-                    "/cancel",
-                    "actionlib_msgs/GoalID",
-                    registration.connection.xmlrpc_uri)
-                node_master.registerPublisher(
-                    registration.connection.rule.name +
-                    "/status",
-                    "actionlib_msgs/GoalStatusArray",
-                    registration.connection.xmlrpc_uri)
-                node_master.registerPublisher(
-                    registration.connection.rule.name +
-                    "/feedback",
-                    registration.connection.type_info +
-                    "ActionFeedback",
-                    registration.connection.xmlrpc_uri)
-                node_master.registerPublisher(
-                    registration.connection.rule.name +
-                    "/result",
-                    registration.connection.type_info +
-                    "ActionResult",
-                    registration.connection.xmlrpc_uri)
-                return registration
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to register an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to register an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to register an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-        elif registration.connection.rule.type == rocon_python_comms.ACTION_CLIENT:
-            try:
-                node_master.registerPublisher(
-                    registration.connection.rule.name +
-                    "/goal",
-                    registration.connection.type_info +
-                    "ActionGoal",
-                    registration.connection.xmlrpc_uri)
-                node_master.registerPublisher(
-                    registration.connection.rule.name +
-                    "/cancel",
-                    "actionlib_msgs/GoalID",
-                    registration.connection.xmlrpc_uri)
-                self._register_subscriber(node_master, registration.connection.rule.name +
-                                          "/status", "actionlib_msgs/GoalStatusArray", registration.connection.xmlrpc_uri)
-                self._register_subscriber(
-                    node_master,
-                    registration.connection.rule.name +
-                    "/feedback",
-                    registration.connection.type_info +
-                    "ActionFeedback",
-                    registration.connection.xmlrpc_uri)
-                self._register_subscriber(
-                    node_master,
-                    registration.connection.rule.name +
-                    "/result",
-                    registration.connection.type_info +
-                    "ActionResult",
-                    registration.connection.xmlrpc_uri)
-                return registration
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to register an action server on the local master [%s][%s]" % (
-                        registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to register an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to register an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-                return None
-        else:
-            rospy.logerr("Gateway : tried to register unknown rule type [%s]" % (
-                registration.connection.rule.type))
-            return None
+        return self.register_multiple([registration])[0]
 
     def unregister(self, registration):
         '''
@@ -278,122 +208,169 @@ class LocalMaster(rosgraph.Master):
           @param registration : registration details for an existing gateway registered rule
           @type utils.Registration
         '''
-        node_master = rosgraph.Master(registration.local_node)
-        rospy.logdebug("Gateway : unregistering local node [%s] for [%s]" % (registration.local_node, registration))
-        if registration.connection.rule.type == rocon_python_comms.PUBLISHER:
-            try:
-                node_master.unregisterPublisher(registration.connection.rule.name, registration.connection.xmlrpc_uri)
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to unregister a publisher on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to unregister a publisher on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to unregister a publisher on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-        elif registration.connection.rule.type == rocon_python_comms.SUBSCRIBER:
-            try:
-                node_master.unregisterSubscriber(registration.connection.rule.name, registration.connection.xmlrpc_uri)
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to unregister a subscriber on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to unregister a subscriber on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to unregister a subscriber on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-        elif registration.connection.rule.type == rocon_python_comms.SERVICE:
-            try:
-                node_master.unregisterService(registration.connection.rule.name, registration.connection.type_info)
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to unregister a service on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to unregister a service on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to unregister a service on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-        elif registration.connection.rule.type == rocon_python_comms.ACTION_SERVER:
-            try:
-                node_master.unregisterSubscriber(
-                    registration.connection.rule.name + "/goal", registration.connection.xmlrpc_uri)
-                node_master.unregisterSubscriber(
-                    registration.connection.rule.name + "/cancel", registration.connection.xmlrpc_uri)
-                node_master.unregisterPublisher(
-                    registration.connection.rule.name + "/status", registration.connection.xmlrpc_uri)
-                node_master.unregisterPublisher(
-                    registration.connection.rule.name + "/feedback", registration.connection.xmlrpc_uri)
-                node_master.unregisterPublisher(
-                    registration.connection.rule.name + "/result", registration.connection.xmlrpc_uri)
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to unregister an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to unregister an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to unregister an action server on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-        elif registration.connection.rule.type == rocon_python_comms.ACTION_CLIENT:
+        self.unregister_multiple([registration])
+
+    def register_multiple(self, registrations):
+        '''
+          Registers rules with the local master. The master api calls for all of them
+          (five for an action) are batched into system.multicall requests rather than
+          making a round trip for each.
+
+          @param registrations : registration details
+          @type [utils.Registration]
+
+          @return for each registration, the updated registration object (only adds an anonymously
+                  generated local node name) or None if it could not be registered (in which case
+                  none of its calls are left registered)
+          @rtype [utils.Registration]
+        '''
+        results = [None] * len(registrations)
+        candidates = []
+        for index, registration in enumerate(registrations):
+            connection = registration.connection
+            if connection.rule.type not in _registration_topics and connection.rule.type != rocon_python_comms.SERVICE:
+                rospy.logerr("Gateway : tried to register unknown rule type [%s]" % connection.rule.type)
+            elif connection.rule.type == rocon_python_comms.SERVICE and \
+                    None in (connection.rule.name, connection.type_info, connection.xmlrpc_uri):
+                rospy.logerr("Gateway : tried to register a service with unset details [%s, %s, %s]" %
+                             (connection.rule.name, connection.type_info, connection.xmlrpc_uri))
+            else:
+                candidates.append(index)
+        # services that are already locally available are left alone
+        services = [index for index in candidates
+                    if registrations[index].connection.rule.type == rocon_python_comms.SERVICE]
+        lookups = self._multicall([(self.caller_id, 'lookupService', (registrations[index].connection.rule.name,))
+                                   for index in services])
+        for index, (found, service_uri) in zip(services, lookups):
+            if found:
+                rospy.logwarn("Gateway : tried to register a service that is already locally available, aborting [%s][%s]" %
+                              (registrations[index].connection.rule.name, service_uri))
+                candidates.remove(index)
+        calls = []
+        owners = []  # (registration index, position of the call amongst those for the registration)
+        for index in candidates:
+            registration = registrations[index]
+            # rograph.Master doesn't care whether the node is prefixed with slash or not, but we use it to
+            # compare registrations later in FlippedInterface._is_registration_in_remote_rule()
+            registration.local_node = "/" + self._get_anonymous_node_name(registration.connection.rule.node)
+            rospy.logdebug("Gateway : registering a new node [%s] for [%s]" % (registration.local_node, registration))
+            for position, (method, args) in enumerate(_get_registration_calls(registration.connection)):
+                calls.append((registration.local_node, method, args))
+                owners.append((index, position))
+            results[index] = registration
+        responses = self._multicall(calls)
+        for (index, unused_position), (unused_caller_id, unused_method, args), (succeeded, value) in zip(owners, calls, responses):
+            if not succeeded:
+                rospy.logerr("Gateway : failed to register a %s on the local master [%s][%s]" % (
+                    registrations[index].connection.rule.type, args[0], value))
+                results[index] = None
+        subscribers = []
+        # whatever did get registered for a failed registration (e.g. some of an action's topics) is
+        # taken off the master again, else each retry (under a new node name) would leave more behind
+        rollback = []
+        for (index, position), (caller_id, method, args), (succeeded, value) in zip(owners, calls, responses):
+            if not succeeded:
+                continue
+            if results[index] is None:
+                (unregister_method, unregister_args) = _get_unregistration_calls(registrations[index].connection)[position]
+                rollback.append((caller_id, unregister_method, unregister_args))
+            elif method == 'registerSubscriber':
+                subscribers.append((args[0], args[2], value))
+        for (unused_caller_id, unused_method, args), (succeeded, value) in zip(rollback, self._multicall(rollback)):
+            if not succeeded:
+                rospy.logerr("Gateway : failed to unregister a partial registration on the local master [%s][%s]" %
+                             (args[0], value))
+        for (name, xmlrpc_uri, pub_uri_list) in subscribers:
+            self._node_executor.submit(self._update_subscriber_publishers, name, xmlrpc_uri, pub_uri_list)
+        return results
+
+    def unregister_multiple(self, registrations):
+        '''
+          Unregisters rules with the local master, batching the master api calls as
+          for register_multiple. Failures are logged, not raised.
+
+          @param registrations : registration details for existing gateway registered rules
+          @type [utils.Registration]
+        '''
+        calls = []
+        owners = []
+        for registration in registrations:
+            rospy.logdebug("Gateway : unregistering local node [%s] for [%s]" % (registration.local_node, registration))
+            for (method, args) in _get_unregistration_calls(registration.connection):
+                calls.append((registration.local_node, method, args))
+                owners.append(registration)
+        for registration, (unused_caller_id, unused_method, args), (succeeded, value) in zip(owners, calls, self._multicall(calls)):
+            if not succeeded:
+                rospy.logerr("Gateway : failed to unregister a %s on the local master [%s][%s]" % (
+                    registration.connection.rule.type, args[0], value))
+
+    def _multicall(self, calls):
+        '''
+          Make master api calls, as few requests as possible (each a system.multicall).
+
+          @param calls : (caller id, method name, arguments after the caller id) tuples
+          @type [(str, str, tuple)]
+
+          @return for each call, (True, value) if it succeeded, (False, error message) if not
+          @rtype [(bool, object)]
+        '''
+        results = []
+        proxy = self._master_proxies.get(self.master_uri)
+        for start in range(0, len(calls), _multicall_batch_size):
+            batch = calls[start:start + _multicall_batch_size]
+            multicall = client.MultiCall(proxy)
+            for (caller_id, method, args) in batch:
+                getattr(multicall, method)(caller_id, *args)
             try:
-                node_master.unregisterPublisher(
-                    registration.connection.rule.name + "/goal", registration.connection.xmlrpc_uri)
-                node_master.unregisterPublisher(
-                    registration.connection.rule.name + "/cancel", registration.connection.xmlrpc_uri)
-                node_master.unregisterSubscriber(
-                    registration.connection.rule.name + "/status", registration.connection.xmlrpc_uri)
-                node_master.unregisterSubscriber(
-                    registration.connection.rule.name + "/feedback", registration.connection.xmlrpc_uri)
-                node_master.unregisterSubscriber(
-                    registration.connection.rule.name + "/result", registration.connection.xmlrpc_uri)
-            except (socket.error, socket.gaierror) as e:
-                rospy.logerr("Gateway : got socket error trying to unregister an action client on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Error as e:
-                rospy.logerr("Gateway : got error trying to unregister an action client on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-            except rosgraph.masterapi.Failure as e:
-                rospy.logerr("Gateway : failed to unregister an action client on the local master [%s][%s]" % (
-                    registration.connection.rule.name, str(e)))
-
-    def _register_subscriber(self, node_master, name, type_info, xmlrpc_uri):
-        '''
-          This one is not necessary, since you can pretty much guarantee the
-          existence of the subscriber here, but it pays to be safe - we've seen
-          some errors come out here when the ROS_MASTER_URI was only set to
-          localhost.
-
-          @param node_master : node-master xmlrpc method handler
-          @param type_info : type of the subscriber message
+                responses = multicall()
+            except (socket.error, client.Error) as e:
+                # can't reach the master, no point trying any more batches
+                results.extend([(False, "could not contact the master [%s]" % str(e))] * (len(calls) - start))
+                break
+            for i in range(len(batch)):
+                try:
+                    code, message, value = responses[i]
+                except client.Fault as e:
+                    results.append((False, e.faultString))
+                    continue
+                results.append((True, value) if code == 1 else (False, message))
+        return results
+
+    def _update_subscriber_publishers(self, name, xmlrpc_uri, pub_uri_list):
+        '''
+          Tell a newly registered subscriber to refresh its publisher list. Runs in
+          the node executor, failures are logged, not raised - you can pretty much guarantee the existence of the
+          subscriber here, but it pays to be safe - we've seen some errors come out
+          here when the ROS_MASTER_URI was only set to localhost.
+
+          @param name : fully resolved subscriber name
+          @type string
           @param xmlrpc_uri : the uri of the node (xmlrpc server)
           @type string
-          @param name : fully resolved subscriber name
+          @param pub_uri_list : the publisher uris returned by the master's registerSubscriber
+          @type [str]
         '''
         # This unfortunately is a game breaker - it destroys all connections, not just those
         # connected to this master, see #125.
-        pub_uri_list = node_master.registerSubscriber(name, type_info, xmlrpc_uri)
         # Be nice to the subscriber, inform it that is should refresh it's publisher list.
         try:
             rospy.loginfo(
                 "resetting publishers for this node's subscriber [%s][%s][%s]" % (name, xmlrpc_uri, pub_uri_list))
             # this publisherUpdate will overwrite any other publisher currently known by the subscriber
-            xmlrpcapi(xmlrpc_uri).publisherUpdate('/master', name, pub_uri_list)
+            self._node_proxies.get(xmlrpc_uri).publisherUpdate('/master', name, pub_uri_list)
 
+        except socket.timeout:
+            rospy.logwarn("Gateway : timed out resetting publishers for a subscriber [%s][%s]" % (name, xmlrpc_uri))
         except (socket.error, socket.gaierror) as v:
-            errorcode = v[0]
-            if errorcode != errno.ECONNREFUSED:
+            if v.errno != errno.ECONNREFUSED:
                 rospy.logerr(
                     "Gateway : error registering subscriber " +
                     "(is ROS_MASTER_URI and ROS_HOSTNAME or ROS_IP correctly set?)")
-                rospy.logerr("Gateway : errorcode [%s] xmlrpc_uri [%s]" % (str(errorcode), xmlrpc_uri))
-                raise  # better handling here would be ideal
+                rospy.logerr("Gateway : errorcode [%s] xmlrpc_uri [%s]" % (str(v.errno), xmlrpc_uri))
             else:
                 pass
                 # subscriber stopped on the other side, so don't worry about telling it to 'refresh' its publishers
-        except xmlrpclib.Fault as e:
+        except (client.Fault, client.ProtocolError) as e:
             # as above with the socket error, don't worry about telling it to 'refresh' its publishers
             rospy.logerr("Gateway : serious fault while communicating with a subscriber - its xmlrpc server was around but in a bad state [%s]" % str(e))
             rospy.logerr("Gateway : if this happened, add to the collected information gathered at https://github.com/robotics-in-concert/rocon_multimaster/issues/304")
@@ -423,6 +400,9 @@ class LocalMaster(rosgraph.Master):
         # come from) via master.get_connection_state. That means there is a small amount of time from
         # getting the topic name, to checking for hte xmlrpc_uri and especially topic_type here in which
         # the topic could have disappeared. When this happens, it returns None.
+        # Types and service uris come from the lookup tables built off the connection cache, so there
+        # are no master round trips here (unless the tables are ambiguous, see _lookup) - a missing
+        # entry means it disappeared in the meantime.
         connections = []
         xmlrpc_uri = node.split(",")[1]
         node = node.split(",")[0]
@@ -430,56 +410,21 @@ class LocalMaster(rosgraph.Master):
         if xmlrpc_uri is None:
             return connections
         if connection_type == rocon_python_comms.PUBLISHER or connection_type == rocon_python_comms.SUBSCRIBER:
-            type_info = rostopic.get_topic_type(name)[0]  # message type
+            type_info = self._lookup(self._topic_types, name, self._resolve_topic_type)  # message type
             if type_info is not None:
                 connections.append(utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_info, type_info, xmlrpc_uri))
             else:
                 rospy.logwarn('Gateway : [%s] does not have type_info. Cannot flip' % name)
         elif connection_type == rocon_python_comms.SERVICE:
-            type_info = rosservice.get_service_uri(name)
-            type_msg = rosservice.get_service_type(name)
+            type_info, type_msg = self._lookup(self._services, name, self._resolve_service) or (None, None)
             if type_info is not None:
                 connections.append(utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_msg, type_info, xmlrpc_uri))
-        elif connection_type == rocon_python_comms.ACTION_SERVER:
-            goal_type_info = rostopic.get_topic_type(name + '/goal')[0]  # message type
-            cancel_type_info = rostopic.get_topic_type(name + '/cancel')[0]  # message type
-            status_type_info = rostopic.get_topic_type(name + '/status')[0]  # message type
-            feedback_type_info = rostopic.get_topic_type(name + '/feedback')[0]  # message type
-            result_type_info = rostopic.get_topic_type(name + '/result')[0]  # message type
-            if (
-                goal_type_info is not None and cancel_type_info is not None and
-                status_type_info is not None and feedback_type_info is not None and
-                result_type_info is not None
-            ):
-                connections.append(utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/goal', node), goal_type_info, goal_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/cancel', node), cancel_type_info, cancel_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/status', node), status_type_info, status_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/feedback', node), feedback_type_info, feedback_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/result', node), result_type_info, result_type_info, xmlrpc_uri))
-        elif connection_type == rocon_python_comms.ACTION_CLIENT:
-            goal_type_info = rostopic.get_topic_type(name + '/goal')[0]  # message type
-            cancel_type_info = rostopic.get_topic_type(name + '/cancel')[0]  # message type
-            status_type_info = rostopic.get_topic_type(name + '/status')[0]  # message type
-            feedback_type_info = rostopic.get_topic_type(name + '/feedback')[0]  # message type
-            result_type_info = rostopic.get_topic_type(name + '/result')[0]  # message type
-            if (
-                goal_type_info is not None and cancel_type_info is not None and
-                status_type_info is not None and feedback_type_info is not None and
-                result_type_info is not None
-            ):
-                connections.append(utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/goal', node), goal_type_info, goal_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.PUBLISHER, name + '/cancel', node), cancel_type_info, cancel_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/status', node), status_type_info, status_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/feedback', node), feedback_type_info, feedback_type_info, xmlrpc_uri))
-                connections.append(
-                    utils.Connection(gateway_msgs.Rule(rocon_python_comms.SUBSCRIBER, name + '/result', node), result_type_info, result_type_info, xmlrpc_uri))
+        elif connection_type == rocon_python_comms.ACTION_SERVER or connection_type == rocon_python_comms.ACTION_CLIENT:
+            topics = [(topic_type, name + name_suffix, self._lookup(self._topic_types, name + name_suffix, self._resolve_topic_type))
+                      for (topic_type, name_suffix, unused_type_suffix, unused_fixed_type) in _registration_topics[connection_type]]
+            if None not in [type_info for (unused_topic_type, unused_name, type_info) in topics]:
+                for (topic_type, topic_name, type_info) in topics:
+                    connections.append(utils.Connection(gateway_msgs.Rule(topic_type, topic_name, node), type_info, type_info, xmlrpc_uri))
         return connections
 
     def generate_advertisement_connection_details(self, connection_type, name, node):
@@ -507,24 +452,23 @@ class LocalMaster(rosgraph.Master):
         # come from) via master.get_connection_state. That means there is a small amount of time from
         # getting the topic name, to checking for hte xmlrpc_uri and especially topic_type here in which
         # the topic could have disappeared. When this happens, it returns None.
+        # As above, types and service uris come from the lookup tables, not the master.
         connection = None
-        xmlrpc_uri = self.lookupNode(node)
+        xmlrpc_uri = self.lookup_node_uri(node)
         if xmlrpc_uri is None:
             return connection
         if connection_type == rocon_python_comms.PUBLISHER or connection_type == rocon_python_comms.SUBSCRIBER:
-            type_info = rostopic.get_topic_type(name)[0]  # message type
+            type_info = self._lookup(self._topic_types, name, self._resolve_topic_type)  # message type
             if type_info is not None:
                 connection = utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_info, type_info, xmlrpc_uri)
         elif connection_type == rocon_python_comms.SERVICE:
-            type_info = rosservice.get_service_uri(name)
-            type_msg = rosservice.get_service_type(name)
+            type_info, type_msg = self._lookup(self._services, name, self._resolve_service) or (None, None)
             if type_info is not None:
                 connection = utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_msg, type_info, xmlrpc_uri)
         elif connection_type == rocon_python_comms.ACTION_SERVER or connection_type == rocon_python_comms.ACTION_CLIENT:
-            goal_topic = name + '/goal'
-            goal_topic_type = rostopic.get_topic_type(goal_topic)
-            type_info = re.sub('ActionGoal$', '', goal_topic_type[0])  # Base type for action
-            if type_info is not None:
+            goal_topic_type = self._lookup(self._topic_types, name + '/goal', self._resolve_topic_type)
+            if goal_topic_type is not None:
+                type_info = re.sub('ActionGoal$', '', goal_topic_type)  # Base type for action
                 connection = utils.Connection(gateway_msgs.Rule(connection_type, name, node), type_info, type_info, xmlrpc_uri)
         return connection
 
@@ -564,85 +508,209 @@ class LocalMaster(rosgraph.Master):
 
     def _connection_cache_proxy_cb(self, system_state, added_system_state, lost_system_state):
 
+        changed = True
         self.connections_lock.acquire()
         # if there was no change but we got a callback,
         # it means it s the first and we need to set the whole list
         if added_system_state is None and lost_system_state is None:
-            self.connections[gateway_msgs.ConnectionType.ACTION_SERVER] =\
-                utils._get_connections_from_action_chan_dict(
-                        system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
-                )
-            self.connections[gateway_msgs.ConnectionType.ACTION_CLIENT] =\
-                utils._get_connections_from_action_chan_dict(
-                        system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
-                )
-            self.connections[gateway_msgs.ConnectionType.PUBLISHER] =\
-                utils._get_connections_from_pub_sub_chan_dict(
-                        system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
-                )
-            self.connections[gateway_msgs.ConnectionType.SUBSCRIBER] =\
-                utils._get_connections_from_pub_sub_chan_dict(
-                        system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
-                )
-            self.connections[gateway_msgs.ConnectionType.SERVICE] =\
-                utils._get_connections_from_service_chan_dict(
-                        system_state.services, gateway_msgs.ConnectionType.SERVICE
-                )
+            for connection_type, (channel, converter) in _connection_cache_channels.items():
+                self.connections[connection_type] = converter(getattr(system_state, channel), connection_type)
+            self._reset_lookup_tables()
+            # consumers can't rely on their change journals any longer
+            for consumer in self._change_journals:
+                self._change_journals[consumer] = None
         else:  # we got some diff, we can optimize
-            # this is not really needed as is ( since the list we get is always updated )
-            # However it is a first step towards an optimized gateway that can work with system state differences
-            new_action_servers = utils._get_connections_from_action_chan_dict(
-                added_system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_SERVER] |= new_action_servers
-
-            new_action_clients = utils._get_connections_from_action_chan_dict(
-                added_system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_CLIENT] |= new_action_clients
-
-            new_publishers = utils._get_connections_from_pub_sub_chan_dict(
-                added_system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
-            )
-            self.connections[gateway_msgs.ConnectionType.PUBLISHER] |= new_publishers
-
-            new_subscribers = utils._get_connections_from_pub_sub_chan_dict(
-                added_system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
-            )
-            self.connections[gateway_msgs.ConnectionType.SUBSCRIBER] |= new_subscribers
-
-            new_services = utils._get_connections_from_service_chan_dict(
-                added_system_state.services, gateway_msgs.ConnectionType.SERVICE
-            )
-            self.connections[gateway_msgs.ConnectionType.SERVICE] |= new_services
-
-
-            lost_action_servers = utils._get_connections_from_action_chan_dict(
-                lost_system_state.action_servers, gateway_msgs.ConnectionType.ACTION_SERVER
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_SERVER] -= lost_action_servers
-
-            lost_action_clients = utils._get_connections_from_action_chan_dict(
-                lost_system_state.action_clients, gateway_msgs.ConnectionType.ACTION_CLIENT
-            )
-            self.connections[gateway_msgs.ConnectionType.ACTION_CLIENT] -= lost_action_clients
-
-            lost_publishers = utils._get_connections_from_pub_sub_chan_dict(
-                lost_system_state.publishers, gateway_msgs.ConnectionType.PUBLISHER
-            )
-            self.connections[gateway_msgs.ConnectionType.PUBLISHER] -= lost_publishers
-
-            lost_subscribers = utils._get_connections_from_pub_sub_chan_dict(
-                lost_system_state.subscribers, gateway_msgs.ConnectionType.SUBSCRIBER
-            )
-            self.connections[gateway_msgs.ConnectionType.SUBSCRIBER] -= lost_subscribers
-
-            lost_services = utils._get_connections_from_service_chan_dict(
-                lost_system_state.services, gateway_msgs.ConnectionType.SERVICE
-            )
-            self.connections[gateway_msgs.ConnectionType.SERVICE] -= lost_services
+            added = utils.create_empty_connection_type_dictionary(set)
+            lost = utils.create_empty_connection_type_dictionary(set)
+            for connection_type, (channel, converter) in _connection_cache_channels.items():
+                # only keep what actually changed our view of the system state
+                added[connection_type] = converter(getattr(added_system_state, channel), connection_type) \
+                    - self.connections[connection_type]
+                self.connections[connection_type] |= added[connection_type]
+                lost[connection_type] = converter(getattr(lost_system_state, channel), connection_type) \
+                    & self.connections[connection_type]
+                self.connections[connection_type] -= lost[connection_type]
+            changed = any(added.values()) or any(lost.values())
+            if changed:
+                self._update_lookup_tables(added, lost)
+                for journal in self._change_journals.values():
+                    if journal is not None:
+                        self._journal_changes(journal, added, lost)
 
         self.connections_lock.release()
+        if changed and self._connection_change_hook is not None:
+            self._connection_change_hook()
+
+    def _reset_lookup_tables(self):
+        '''
+          Rebuild the lookup tables from scratch off the current connections.
+          Should be called with the connections lock held.
+        '''
+        self._lookup_tables_lock.acquire()
+        self._node_uris = {}
+        self._topic_types = {}
+        self._services = {}
+        for connection_type in utils.connection_types:
+            for connection in self.connections[connection_type]:
+                for (table, name, value) in self._get_lookup_table_entries(connection):
+                    # no telling which is newer when there are several values here (e.g. a restarted node)
+                    table.setdefault(name, {}).setdefault(value, [0, 0])[0] += 1
+        self._lookup_tables_lock.release()
+
+    def _update_lookup_tables(self, added, lost):
+        '''
+          Reference count lookup table entries in and out as the connections that
+          give them come and go. Should be called with the connections lock held.
+
+          @param added, lost : the connection changes to apply
+          @type connection type keyed dictionaries of utils.Connection sets
+        '''
+        self._lookup_tables_lock.acquire()
+        self._lookup_generation += 1
+        for connection_type in utils.connection_types:
+            for connection in added[connection_type]:
+                for (table, name, value) in self._get_lookup_table_entries(connection):
+                    entry = table.setdefault(name, {}).setdefault(value, [0, 0])
+                    entry[0] += 1
+                    entry[1] = self._lookup_generation
+            for connection in lost[connection_type]:
+                for (table, name, value) in self._get_lookup_table_entries(connection):
+                    values = table.get(name, {})
+                    entry = values.get(value, None)
+                    if entry is None:
+                        continue
+                    entry[0] -= 1
+                    if entry[0] <= 0:
+                        del values[value]
+                        if not values:
+                            table.pop(name, None)
+        self._lookup_tables_lock.release()
+
+    def _get_lookup_table_entries(self, connection):
+        '''
+          The lookup table entries a cached connection contributes.
+
+          @param connection : a connection from the connection cache
+          @type utils.Connection
+
+          @return (table, name, value) triples
+          @rtype list
+        '''
+        entries = [(self._node_uris, connection.rule.node, connection.xmlrpc_uri)]
+        if connection.rule.type == rocon_python_comms.SERVICE:
+            entries.append((self._services, connection.rule.name, (connection.type_info, connection.type_msg)))
+        elif connection.rule.type in (rocon_python_comms.PUBLISHER, rocon_python_comms.SUBSCRIBER):
+            entries.append((self._topic_types, connection.rule.name, connection.type_info))
+        elif connection.rule.type in _registration_topics and connection.type_info is not None:
+            # actions are cached with their goal (or base) type, the topics behind them follow from that
+            base_type = re.sub('ActionGoal$', '', connection.type_info)
+            for (unused_topic_type, name_suffix, type_suffix, fixed_type) in _registration_topics[connection.rule.type]:
+                entries.append((self._topic_types, connection.rule.name + name_suffix,
+                                fixed_type if type_suffix is None else base_type + type_suffix))
+        return entries
+
+    def _lookup(self, table, name, resolve=None):
+        '''
+          Look a name up in a lookup table. If it has several values (e.g. a
+          node restarted and both are still cached), the one from the most
+          recent connection cache diff wins. If that doesn't settle it (values
+          from a full resync come in no particular order), it is left to resolve.
+
+          @param resolve : picks one of several values by asking the master, arguments are the name and values
+          @type method
+
+          @return the value for the name, None if it has none (or it couldn't be resolved)
+        '''
+        self._lookup_tables_lock.acquire()
+        values = table.get(name, {})
+        newest = max([generation for unused_count, generation in values.values()]) if values else 0
+        candidates = [value for value, (unused_count, generation) in values.items() if generation == newest]
+        self._lookup_tables_lock.release()
+        if len(candidates) == 1:
+            return candidates[0]
+        if not candidates or resolve is None:
+            return None
+        try:
+            return resolve(name, candidates)
+        except (rosgraph.masterapi.MasterError, socket.error) as e:
+            rospy.logwarn("Gateway : could not resolve [%s] with the master [%s]" % (name, str(e)))
+            return None
+
+    def _resolve_topic_type(self, name, candidates):
+        '''
+          Resolve an ambiguous topic type lookup (see _lookup) with the master.
+        '''
+        topic_types = dict(self._succeed(self._master_proxies.get(self.master_uri).getTopicTypes(self.caller_id)))
+        type_info = topic_types.get(name, None)
+        return type_info if type_info in candidates else None
+
+    def _resolve_service(self, name, candidates):
+        '''
+          Resolve an ambiguous service lookup (see _lookup) with the master, by its current uri.
+        '''
+        service_uri = self._succeed(self._master_proxies.get(self.master_uri).lookupService(self.caller_id, name))
+        matches = [(type_info, type_msg) for (type_info, type_msg) in candidates if type_info == service_uri]
+        return matches[0] if len(matches) == 1 else None
+
+    def lookupNode(self, node_name):
+        '''
+          As rosgraph.Master.lookupNode, but over a keep-alive connection with a deadline.
+
+          @param node_name : fully qualified node name
+          @type str
+
+          @return the node's xmlrpc uri
+          @rtype str
+
+          @raise rosgraph.masterapi.Error, rosgraph.masterapi.Failure : if the master doesn't know the node
+          @raise socket.error : if the master couldn't be contacted (in time)
+        '''
+        return self._succeed(self._master_proxies.get(self.master_uri).lookupNode(self.caller_id, node_name))
+
+    def lookup_node_uri(self, node):
+        '''
+          Get the xmlrpc uri of a node, preferably from the uris the connection cache
+          has already given us. Only falls back to asking the master (lookupNode)
+          for nodes we don't have any connections cached for, or can't tell which
+          of several cached uris is current (see _lookup). Doesn't need the
+          connections lock, so is safe to call while using the connection state.
+
+          @param node : fully qualified node name
+          @type str
+
+          @return the node's xmlrpc uri
+          @rtype str
+
+          @raise rosgraph.masterapi.MasterError : if the master doesn't know the node either
+          @raise socket.error : if the master couldn't be contacted
+        '''
+        xmlrpc_uri = self._lookup(self._node_uris, node)
+        if xmlrpc_uri is None:
+            xmlrpc_uri = self.lookupNode(node)
+        return xmlrpc_uri
+
+    def _journal_changes(self, journal, added, lost):
+        '''
+          Merge connection changes into a consumer's change journal. Connections that
+          come and go between reads of the journal cancel each other out.
+
+          @param journal : (added, lost) pair of connection type keyed dictionaries of connection sets
+          @type tuple
+          @param added, lost : the connection changes to merge in
+          @type connection type keyed dictionaries of utils.Connection sets
+        '''
+        journal_added, journal_lost = journal
+        for connection_type in utils.connection_types:
+            for connection in added[connection_type]:
+                if connection in journal_lost[connection_type]:
+                    journal_lost[connection_type].remove(connection)
+                else:
+                    journal_added[connection_type].add(connection)
+            for connection in lost[connection_type]:
+                if connection in journal_added[connection_type]:
+                    journal_added[connection_type].remove(connection)
+                else:
+                    journal_lost[connection_type].add(connection)
 
     @contextmanager
     def get_connection_state(self):
@@ -650,3 +718,32 @@ class LocalMaster(rosgraph.Master):
         yield self.connections
         self.connections_lock.release()
 
+    @contextmanager
+    def get_connection_changes(self, consumer):
+        '''
+          Like get_connection_state, but also yields the connections that have been
+          added and lost since the last time this consumer called it. Added and lost
+          are None when the consumer has to do a full recompute instead (first call,
+          or the connection cache has resent the whole system state).
+
+          @param consumer : unique name for the consumer of the changes
+          @type str
+
+          @return connections, added, lost
+          @rtype connection type keyed dictionaries of utils.Connection sets
+        '''
+        self.connections_lock.acquire()
+        journal = self._change_journals.get(consumer, None)
+        self._change_journals[consumer] = (utils.create_empty_connection_type_dictionary(set),
+                                           utils.create_empty_connection_type_dictionary(set))
+        try:
+            if journal is None:
+                yield self.connections, None, None
+            else:
+                yield self.connections, journal[0], journal[1]
+        except Exception:
+            # changes have been dropped, make sure the consumer catches up next time
+            self._change_journals[consumer] = None
+            raise
+        finally:
+            self.connections_lock.release()
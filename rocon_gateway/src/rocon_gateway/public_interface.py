@@ -46,6 +46,13 @@ def publicRuleExists(public_rule, public_rules):
             return True
     return False
 
+
+def _rule_key(rule):
+    '''
+      Hashable key for a rule, equivalent to utils.Connection.hasSameRule comparisons.
+    '''
+    return (rule.type, rule.name, rule.node)
+
 ##############################################################################
 # Public Interface
 ##############################################################################
@@ -84,12 +91,22 @@ class PublicInterface(object):
         # Default + custom blacklist - used in AdvertiseAll mode
         self.blacklist = self._default_blacklist
 
-        # list Rules currently being advertised (gateway_msgs.Rule)
-        # should we store utils.Connections instead?
-        self.public = utils.create_empty_connection_type_dictionary()
+        # Connections currently being advertised, connection type keyed dicts of
+        # _rule_key : utils.Connection, in the order they were advertised
+        self.public = utils.create_empty_connection_type_dictionary(dict)
 
         self.advertise_all_enabled = False
 
+        # Local connections permitted by the watchlist/blacklist, kept between updates
+        # so only added/lost connections need to be matched (connection type keyed dicts
+        # of _rule_key : utils.Connection set). Bumping the rules version (any
+        # watchlist/blacklist change) forces them to be recomputed from scratch.
+        self.rules_version = 0
+        self._permitted = utils.create_empty_connection_type_dictionary(dict)
+        self._permitted_rules_version = None
+        # Permitted rule keys whose connection details couldn't be generated yet, retried each update
+        self._unpublished = utils.create_empty_connection_type_dictionary(set)
+
         self.lock = threading.Lock()
 
         # Load up static rules.
@@ -115,6 +132,7 @@ class PublicInterface(object):
         self.lock.acquire()
         if not publicRuleExists(rule, self.watchlist[rule.type]):
             self.watchlist[rule.type].append(rule)
+            self.rules_version += 1
             result = rule
         self.lock.release()
         rospy.loginfo("Gateway : adding rule to public watchlist %s" % utils.format_rule(rule))
@@ -141,6 +159,7 @@ class PublicInterface(object):
             try:
                 self.lock.acquire()
                 self.watchlist[rule.type].remove(rule)
+                self.rules_version += 1
                 self.lock.release()
                 return [rule]
             except ValueError:
@@ -156,6 +175,8 @@ class PublicInterface(object):
                     existing_rules.append(existing_rule)
             for rule in existing_rules:
                 self.watchlist[rule.type].remove(existing_rule)  # not terribly optimal
+            if existing_rules:
+                self.rules_version += 1
             self.lock.release()
             return existing_rules
 
@@ -193,6 +214,7 @@ class PublicInterface(object):
         for rule in blacklist:
             if not publicRuleExists(rule, self.blacklist[rule.type]):
                 self.blacklist[rule.type].append(rule)
+        self.rules_version += 1
 
         self.lock.release()
         return True
@@ -211,6 +233,7 @@ class PublicInterface(object):
         # easy hack for resetting the watchlist and blacklist
         self.watchlist = utils.create_empty_connection_type_dictionary()
         self.blacklist = self._default_blacklist
+        self.rules_version += 1
 
         self.lock.release()
 
@@ -224,7 +247,12 @@ class PublicInterface(object):
 
           @return dictionary of utils.Connections keyed by type.
         '''
-        return self.public
+        connections = utils.create_empty_connection_type_dictionary()
+        self.lock.acquire()
+        for connection_type in utils.connection_types:
+            connections[connection_type].extend(self.public[connection_type].values())
+        self.lock.release()
+        return connections
 
     def getInterface(self):
         '''
@@ -236,7 +264,7 @@ class PublicInterface(object):
         l = []
         self.lock.acquire()
         for connection_type in utils.connection_types:
-            l.extend([connection.rule for connection in self.public[connection_type]])
+            l.extend([connection.rule for connection in self.public[connection_type].values()])
         self.lock.release()
         return l
 
@@ -322,13 +350,18 @@ class PublicInterface(object):
             return Rule(rule)
         return None
 
-    def update(self, connections, generate_advertisement_connection_details):
+    def update(self, connections, generate_advertisement_connection_details,
+               added_connections=None, lost_connections=None):
         """
           Checks a list of rules and determines which ones should be
           added/removed to the public interface. Modifies the public interface
           accordingly, and returns the list of rules to the gateway for
           hub operations
 
+          Only the added and lost connections are matched against the rules
+          if they are provided. Everything is matched from scratch if they
+          aren't, or if the rules have changed since the last update.
+
           @param rules: the list of rules available locally
           @type dict of lists of Rule objects
 
@@ -336,36 +369,71 @@ class PublicInterface(object):
           that generates Connection.type_info and Connection.xmlrpc_uri
           @type method (see LocalMaster.generate_advertisement_connection_details)
 
+          @param added_connections : connections added to the local master since the last update
+          @type connection type keyed dictionary of utils.Connection sets or None
+
+          @param lost_connections : connections lost from the local master since the last update
+          @type connection type keyed dictionary of utils.Connection sets or None
+
           @return: new public connections, as well as connections to be removed
           @rtype: utils.Connection[], utils.Connection[]
         """
-        # SLOW, EASY METHOD
-        permitted_connections = utils.create_empty_connection_type_dictionary()
         new_public = utils.create_empty_connection_type_dictionary()
         removed_public = utils.create_empty_connection_type_dictionary()
+        self.lock.acquire()
+        rules_version = self.rules_version
+        self.lock.release()
+        # rule keys that may have gained/lost their last permitted connection
+        added_keys = utils.create_empty_connection_type_dictionary(set)
+        lost_keys = utils.create_empty_connection_type_dictionary(set)
+        if added_connections is None or lost_connections is None or rules_version != self._permitted_rules_version:
+            self._permitted_rules_version = rules_version
+            self._permitted = utils.create_empty_connection_type_dictionary(dict)
+            added_connections = connections
+            lost_connections = utils.create_empty_connection_type_dictionary(set)
+            self.lock.acquire()
+            for connection_type in utils.connection_types:
+                lost_keys[connection_type].update(self.public[connection_type].keys())
+            self.lock.release()
         for connection_type in utils.connection_types:
-            for connection in connections[connection_type]:
+            permitted = self._permitted[connection_type]
+            for connection in lost_connections[connection_type]:
+                key = _rule_key(connection.rule)
+                if key in permitted:
+                    permitted[key].discard(connection)
+                    if not permitted[key]:
+                        del permitted[key]
+                        lost_keys[connection_type].add(key)
+            for connection in added_connections[connection_type]:
                 #rospy.loginfo("PUBLIC IF : Checking: {0}...".format(connection))
                 if self._allowRule(connection.rule):
-                    permitted_connections[connection_type].append(connection)
+                    key = _rule_key(connection.rule)
+                    permitted.setdefault(key, set()).add(connection)
+                    added_keys[connection_type].add(key)
                     #rospy.loginfo("PUBLIC IF : Permitted: {0}".format(connection))
         self.lock.acquire()  # protect self.public
         for connection_type in utils.connection_types:
-            for connection in permitted_connections[connection_type]:
-                if not connection.inConnectionList(self.public[connection_type]):
-                    new_connection = generate_advertisement_connection_details(
-                        connection.rule.type, connection.rule.name, connection.rule.node)
-                    # can happen if connection disappeared in between getting the connection
-                    # index (watcher thread) and checking for the topic_type (preceding line)
-                    if new_connection is not None:
-                        new_public[connection_type].append(new_connection)
-                        self.public[connection_type].append(new_connection)
-                        #rospy.loginfo("PUBLIC IF : New connection: {0}".format(new_connection))
-            removed_public[connection_type][:] = [
-                x for x in self.public[connection_type] if not x.inConnectionList(
-                    permitted_connections[connection_type])]
-            self.public[connection_type][:] = [
-                x for x in self.public[connection_type] if not x.inConnectionList(removed_public[connection_type])]
+            permitted = self._permitted[connection_type]
+            public = self.public[connection_type]
+            for key in lost_keys[connection_type]:
+                if key not in permitted and key in public:
+                    removed_public[connection_type].append(public.pop(key))
+            unpublished = set()
+            for key in added_keys[connection_type] | self._unpublished[connection_type]:
+                if key not in permitted or key in public:
+                    continue
+                connection = next(iter(permitted[key]))
+                new_connection = generate_advertisement_connection_details(
+                    connection.rule.type, connection.rule.name, connection.rule.node)
+                # can happen if connection disappeared in between getting the connection
+                # index (watcher thread) and checking for the topic_type (preceding line)
+                if new_connection is None:
+                    unpublished.add(key)
+                    continue
+                new_public[connection_type].append(new_connection)
+                public[key] = new_connection
+                #rospy.loginfo("PUBLIC IF : New connection: {0}".format(new_connection))
+            self._unpublished[connection_type] = unpublished
         self.lock.release()
         #rospy.loginfo("PUBLIC IF : Removed connections: {0}".format(removed_public))
         return new_public, removed_public
@@ -9,8 +9,7 @@
 ##############################################################################
 
 import copy
-import re
-import rocon_gateway_utils
+from gateway_msgs.msg import RemoteRule, Rule
 
 from . import utils
 from . import interactive_interface
@@ -66,6 +65,8 @@ class PulledInterface(interactive_interface.InteractiveInterface):
         removed_pulls = utils.create_empty_connection_type_dictionary()
 
         self._lock.acquire()
+        rule_index = self.get_rule_index(unique_name)
+        rule_index.resolve_gateways(remote_connections.keys())
         # Totally regenerate a new pulled interface, compare with old
         for remote_gateway in remote_connections.keys():
             connections = remote_connections[remote_gateway]
@@ -77,10 +78,10 @@ class PulledInterface(interactive_interface.InteractiveInterface):
                             connection.rule.name,
                             connection.rule.node,
                             remote_gateway,
-                            unique_name))
+                            rule_index))
         for connection_type in utils.connection_types:
-            new_pulls[connection_type] = utils.difflist(pulled[connection_type], self.pulled[connection_type])
-            removed_pulls[connection_type] = utils.difflist(self.pulled[connection_type], pulled[connection_type])
+            new_pulls[connection_type], removed_pulls[connection_type] = utils.diff_remote_rules(
+                pulled[connection_type], self.pulled[connection_type])
         self.pulled = copy.deepcopy(pulled)
         self._lock.release()
         return new_pulls, removed_pulls
@@ -107,7 +108,7 @@ class PulledInterface(interactive_interface.InteractiveInterface):
     # Utility Methods
     ##########################################################################
 
-    def _generate_pulls(self, connection_type, name, node, gateway, unique_name):
+    def _generate_pulls(self, connection_type, name, node, gateway, rule_index):
         '''
           Checks if a local rule (obtained from master.get_system_state)
           is a suitable association with any of the rules or patterns. This can
@@ -130,38 +131,19 @@ class PulledInterface(interactive_interface.InteractiveInterface):
           @param gateway : remote gateway hash name.
           @type str
 
+          @param rule_index : the compiled watchlist, with gateways already resolved
+          @type interactive_interface.RuleIndex
+
           @return all the pull rules that match this local rule
           @return list of RemoteRule objects updated with node names from self.watchlist
         '''
         matched_pull_rules = []
-        for rule in self.watchlist[connection_type]:
+        for indexed_rule in rule_index.match(connection_type, name, node):
             # check for regular expression or perfect match
-            gateway_match_result = re.match(rule.gateway, gateway)
-            matched = False
-            if gateway_match_result and gateway_match_result.group() == gateway:
-                matched = True
-            elif rule.gateway == rocon_gateway_utils.gateway_basename(gateway):
-                matched = True
-            if not matched:
+            if gateway not in indexed_rule.matched_gateways:
                 continue
-
-            # Check names
-            rule_name = rule.rule.name
-            matched = self.is_matched(rule, rule_name, name, node)
-            if not matched:
-                rule_name = '/' + unique_name + '/' + rule.rule.name
-                matched = self.is_matched(rule, rule_name, name, node)
-
-            if not matched:
-                rule_name = '/' + rule.rule.name
-                matched = self.is_matched(rule, rule_name, name, node)
-
-            if matched:
-                matched_pull = copy.deepcopy(rule)
-                matched_pull.gateway = gateway  # just in case we used a regex or matched basename
-                matched_pull.rule.name = name   # just in case we used a regex
-                matched_pull.rule.node = node   # just in case we used a regex
-                matched_pull_rules.append(matched_pull)
+            # gateway, name and node set just in case we used a regex or matched basename
+            matched_pull_rules.append(RemoteRule(gateway, Rule(indexed_rule.remote_rule.rule.type, name, node)))
         return matched_pull_rules
 
     ##########################################################################
@@ -178,7 +160,7 @@ class PulledInterface(interactive_interface.InteractiveInterface):
         '''
         gateways = []
         for connection_type in utils.connection_types:
-            for registration in self.registrations[connection_type]:
+            for registration in self.registrations[connection_type].values():
                 if registration.remote_gateway not in gateways:
                     gateways.append(registration.remote_gateway)
         return gateways
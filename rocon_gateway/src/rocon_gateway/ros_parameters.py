@@ -52,11 +52,34 @@ def setup_ros_parameters():
     # goes through, for now we use semi-colon separated lists.
     param['hub_whitelist'] = rospy.get_param('~hub_whitelist', [])
     param['hub_blacklist'] = rospy.get_param('~hub_blacklist', [])
+    # Maximum number of hubs to talk to in parallel
+    param['hub_concurrency'] = rospy.get_param('~hub_concurrency', 4)
 
     # Gateway
     param['name'] = rospy.get_param('~name', 'gateway')
     param['watch_loop_period'] = rospy.get_param('~watch_loop_period', 10)  # in seconds
 
+    # Periods (in seconds) for the individual stages of the watcher loop. Stages also run
+    # immediately when triggered, so these are just the fallback resync periods. Any
+    # stages not specified take their defaults here.
+    param['watcher_periods'] = {
+        'hub_ping': 1.0,
+        'network_statistics': 5.0,
+        'remote_gateway_index': param['watch_loop_period'],
+        'flipped': param['watch_loop_period'],
+        'public': param['watch_loop_period'],
+        'pulled': param['watch_loop_period'],
+        'flip_ins': 1.0,
+        'statistics': 5.0,
+    }
+    for stage, period in rospy.get_param('~watcher_periods', {}).items():
+        if stage in param['watcher_periods']:
+            param['watcher_periods'][stage] = float(period)
+        else:
+            rospy.logwarn("Gateway : ignoring period for unknown watcher stage [%s]" % stage)
+    # Number of runs per stage to keep the timing statistics (~statistics) over
+    param['statistics_window'] = rospy.get_param('~statistics_window', 100)
+
     # Blacklist used for advertise all, flip all and pull all commands
     param['default_blacklist'] = rospy.get_param('~default_blacklist', [])  # list of Rule objects
 
@@ -66,6 +89,10 @@ def setup_ros_parameters():
     # The gateway can automagically detect zeroconf, but sometimes you want to force it off
     param['disable_zeroconf'] = rospy.get_param('~disable_zeroconf', False)
 
+    # Save the gateway's key under the ros home and reuse it on restarts (it's
+    # generated once per node start otherwise)
+    param['persistent_keys'] = rospy.get_param('~persistent_keys', True)
+
     # The gateway uses uui'd to guarantee uniqueness, but this can be disabled
     # if you want clean names without uuid's (but you have to manually
     # guarantee uniqueness)
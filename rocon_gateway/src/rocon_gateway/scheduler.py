@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+
+###############################################################################
+# Imports
+###############################################################################
+
+import collections
+import math
+import threading
+import time
+
+import rospy
+
+###############################################################################
+# Stages
+###############################################################################
+
+
+class WatcherStage(object):
+
+    '''
+      A single stage of the gateway update pipeline, run at its own cadence.
+
+       - name                   (string identifier for the stage)
+       - period                 (maximum time between runs, in seconds)
+       - callback               (function with no arguments doing the work)
+       - dirty_since            (when it was flagged to run asap, regardless of the period, None if not)
+       - overruns               (number of runs that took longer than the period)
+       - durations              (rolling window of run times, in seconds)
+       - round_trips            (rolling window of hub round trips made per run)
+    '''
+
+    def __init__(self, name, period, callback, window=100, round_trip_counter=None):
+        '''
+          @param name : string identifier for the stage
+          @type str
+          @param period : maximum time between runs (seconds)
+          @type float
+          @param callback : does the actual work for this stage
+          @type method with no arguments
+          @param window : number of runs to keep timing statistics for
+          @type int
+          @param round_trip_counter : returns the running total of hub round trips
+          @type method with no arguments
+        '''
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.dirty_since = 0.0  # run everything at least once on startup
+        self.last_run = 0.0
+        self.last_duration = 0.0
+        self.runs = 0
+        self.overruns = 0
+        self.durations = collections.deque(maxlen=window)
+        self.round_trips = collections.deque(maxlen=window)
+        self._round_trip_counter = round_trip_counter
+
+    def mark_dirty(self, now=None):
+        '''
+          Flag the stage to run as soon as possible. If it is already flagged, it
+          keeps its place, i.e. the time it was first flagged.
+
+          @param now : wall time at which it was flagged, defaults to the current time
+          @type float
+        '''
+        if self.dirty_since is None:
+            self.dirty_since = time.time() if now is None else now
+
+    def deadline(self):
+        '''
+          A dirty stage is due from the time it was flagged, but never later than
+          its period allows. Stages flagged after another became due therefore
+          queue up behind it, rather than pre-empting it.
+
+          @return the wall time at which this stage is due to run
+          @rtype float
+        '''
+        deadline = self.last_run + self.period
+        if self.dirty_since is not None:
+            return min(self.dirty_since, deadline)
+        return deadline
+
+    def run(self):
+        '''
+          Run the stage, keeping track of how long it took. The dirty flag is
+          cleared beforehand so that changes flagged while it is running
+          trigger another run.
+        '''
+        self.dirty_since = None
+        self.last_run = time.time()
+        round_trips = self._round_trip_counter() if self._round_trip_counter is not None else 0
+        try:
+            self.callback()
+        finally:
+            self.last_duration = time.time() - self.last_run
+            self.durations.append(self.last_duration)
+            if self._round_trip_counter is not None:
+                self.round_trips.append(self._round_trip_counter() - round_trips)
+            self.runs += 1
+            if self.last_duration > self.period:
+                self.overruns += 1
+                rospy.logdebug("Gateway : watcher stage overran its period [%s][%.3fs > %.3fs]" %
+                               (self.name, self.last_duration, self.period))
+
+    def statistics(self):
+        '''
+          Summary of the stage's recent performance.
+
+          @return p50/p95/max of the run durations (seconds) and hub round trips over the
+                  rolling window, along with the run and overrun counts
+          @rtype dict
+        '''
+        durations = sorted(self.durations)
+        round_trips = sorted(self.round_trips)
+        return {
+            'period': self.period,
+            'runs': self.runs,
+            'overruns': self.overruns,
+            'duration_p50': _percentile(durations, 50),
+            'duration_p95': _percentile(durations, 95),
+            'duration_max': durations[-1] if durations else 0.0,
+            'round_trips_p50': _percentile(round_trips, 50),
+            'round_trips_p95': _percentile(round_trips, 95),
+            'round_trips_max': round_trips[-1] if round_trips else 0,
+        }
+
+
+def _percentile(sorted_samples, percent):
+    '''
+      Nearest rank percentile of an already sorted list of samples (0 if empty).
+    '''
+    if not sorted_samples:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_samples)))
+    return sorted_samples[max(0, min(rank, len(sorted_samples)) - 1)]
+
+###############################################################################
+# Scheduler
+###############################################################################
+
+
+class WatcherScheduler(object):
+
+    '''
+      Runs the stages of the gateway update pipeline, each at its own period.
+      Only one stage runs at a time and the due stage with the earliest
+      deadline always goes first, so a slow stage only ever delays the others
+      by a single run. Stages flagged dirty are due from when they were flagged,
+      so a stage that keeps getting flagged can't starve those that came due
+      before it. Ties go to the order the stages were added to the scheduler.
+    '''
+
+    def __init__(self, window=100, round_trip_counter=None):
+        '''
+          @param window : number of runs to keep timing statistics for, per stage
+          @type int
+          @param round_trip_counter : returns the running total of hub round trips
+          @type method with no arguments
+        '''
+        self._stages = []  # in pipeline order
+        self._stages_by_name = {}
+        self._wakeup = threading.Event()
+        self._window = window
+        self._round_trip_counter = round_trip_counter
+
+    def add_stage(self, name, period, callback):
+        '''
+          Append a stage to the pipeline.
+
+          @param name : string identifier for the stage
+          @type str
+          @param period : maximum time between runs (seconds)
+          @type float
+          @param callback : does the actual work for this stage
+          @type method with no arguments
+
+          @return the new stage
+          @rtype WatcherStage
+        '''
+        stage = WatcherStage(name, period, callback, self._window, self._round_trip_counter)
+        self._stages.append(stage)
+        self._stages_by_name[name] = stage
+        return stage
+
+    def stages(self):
+        '''
+          @return the stages, in pipeline order
+          @rtype WatcherStage[]
+        '''
+        return list(self._stages)
+
+    def mark_dirty(self, names=None):
+        '''
+          Flag stages to be run as soon as possible. Safe to call from any thread.
+
+          @param names : names of the stages to flag, or None for all of them
+          @type str[]
+        '''
+        if names is None:
+            names = self._stages_by_name.keys()
+        now = time.time()
+        for name in names:
+            try:
+                self._stages_by_name[name].mark_dirty(now)
+            except KeyError:
+                rospy.logwarn("Gateway : tried to flag an unknown watcher stage [%s]" % name)
+        self._wakeup.set()
+
+    def wakeup(self):
+        '''
+          Interrupt the scheduler's sleep (e.g. on shutdown).
+        '''
+        self._wakeup.set()
+
+    def spin_once(self):
+        '''
+          Run the most urgent stage, if any is due.
+
+          @return the time to wait (seconds) before the next stage is due
+          @rtype float
+        '''
+        now = time.time()
+        due = [stage for stage in self._stages if stage.deadline() <= now]
+        if due:
+            # min() is stable, so ties go to the earliest stage in the pipeline
+            min(due, key=lambda stage: stage.deadline()).run()
+            now = time.time()
+        return max(0.0, min([stage.deadline() for stage in self._stages]) - now)
+
+    def spin(self):
+        '''
+          Run stages as they become due until ros shuts down.
+        '''
+        while not rospy.core.is_shutdown():
+            self._wakeup.clear()
+            timeout = self.spin_once()
+            if timeout > 0.0:
+                self._wakeup.wait(timeout)
@@ -9,12 +9,18 @@
 
 import copy
 import _pickle as cPickle
+import hashlib
+import hmac
+import json
 import os
 import re
+import struct
 
 import rospy
 
+from Crypto.Cipher import AES, PKCS1_OAEP
 from Crypto.PublicKey import RSA
+from Crypto.Util import Counter
 import Crypto.Util.number as CUN
 
 import gateway_msgs.msg as gateway_msgs
@@ -30,6 +36,7 @@ connection_types_list = [gateway_msgs.ConnectionType.PUBLISHER, gateway_msgs.Con
                          gateway_msgs.ConnectionType.SERVICE, gateway_msgs.ConnectionType.ACTION_CLIENT, gateway_msgs.ConnectionType.ACTION_SERVER]
 connection_type_strings_list = ["publisher", "subscriber", "service", "action_client", "action_server"]
 action_types = ['/goal', '/cancel', '/status', '/feedback', '/result']
+action_connection_types = frozenset([gateway_msgs.ConnectionType.ACTION_CLIENT, gateway_msgs.ConnectionType.ACTION_SERVER])
 
 ##############################################################################
 # Rule
@@ -226,6 +233,21 @@ def serialize_connection_request(command, source, connection):
                      )
 
 
+def flip_request_field(source, rule):
+    '''
+      Canonical field for a flip request in a gateway's flip_ins hash on the hub.
+
+      @param source : hash name of the gateway that sent the flip
+      @type str
+      @param rule : the flipped rule (node may be either 'node' or 'node,xmlrpc_uri')
+      @type gateway_msgs.msg.Rule
+
+      @return source|type|name|node
+      @rtype str
+    '''
+    return '%s|%s|%s|%s' % (source, rule.type, rule.name, rule.node.split(",")[0])
+
+
 def serialize_rule_request(command, source, rule):
     return serialize([command, source, rule.type, rule.name, rule.node])
 
@@ -279,10 +301,31 @@ def decrypt(ciphertext, key):
     # return ciphertext
 
 
-def decrypt_connection(connection, key):
+def decrypt_connection(connection, key, session_key=None, source=None):
+    '''
+      Decrypt the type_info and xmlrpc_uri of a connection, whether they were
+      sealed with a session key (seal_connection) or rsa encrypted with our
+      public key (the legacy encrypt_connection).
+
+      @param key : our private key
+      @type Crypto.PublicKey.RSA key object
+      @param session_key : the session key agreed with the sender, if any
+      @type bytes
+      @param source : hash name of the sender (needed for sealed connections)
+      @type str
+
+      @raise ValueError : if a sealed field can't be authenticated with the session key
+    '''
     decrypted_connection = copy.deepcopy(connection)
-    decrypted_connection.type_info = decrypt(connection.type_info, key)
-    decrypted_connection.xmlrpc_uri = decrypt(connection.xmlrpc_uri, key)
+    for field in ['type_info', 'xmlrpc_uri']:
+        ciphertext = getattr(connection, field)
+        if is_sealed(ciphertext):
+            if session_key is None:
+                raise ValueError('no session key to unseal the connection with')
+            setattr(decrypted_connection, field,
+                    unseal(ciphertext, session_key, sealed_field_context(field, source, connection.rule)))
+        else:
+            setattr(decrypted_connection, field, decrypt(ciphertext, key))
     return decrypted_connection
 
 
@@ -292,6 +335,171 @@ def encrypt_connection(connection, key):
     encrypted_connection.xmlrpc_uri = encrypt(connection.xmlrpc_uri, key)
     return encrypted_connection
 
+##########################################################################
+# Session Keys
+##########################################################################
+# Rsa is only used to hand a random session key over to the remote gateway
+# (once per pair of gateways), after which connection details are sealed with
+# aes (ctr mode) and authenticated with an hmac, which is fast and has no
+# limit on the length of the plaintext.
+
+SESSION_KEY_LENGTH = 64  # 32 bytes for the aes-256 key, 32 for the hmac-sha256 key
+SEALED_PREFIX = b'\x00rs1'  # rsa ciphertexts never start with a zero byte, so these can't be mistaken
+SEALED_NONCE_LENGTH = 8
+SEALED_TAG_LENGTH = 32
+
+
+def generate_session_key():
+    return os.urandom(SESSION_KEY_LENGTH)
+
+
+def wrap_session_key(session_key, public_key):
+    '''
+      Encrypt a session key for the remote gateway that owns the public key.
+    '''
+    return PKCS1_OAEP.new(public_key).encrypt(session_key)
+
+
+def unwrap_session_key(wrapped_session_key, key):
+    '''
+      Decrypt a session key that was wrapped with our public key.
+
+      @raise ValueError : if it wasn't wrapped with our public key
+    '''
+    return PKCS1_OAEP.new(key).decrypt(wrapped_session_key)
+
+
+def is_sealed(ciphertext):
+    return isinstance(ciphertext, bytes) and ciphertext.startswith(SEALED_PREFIX)
+
+
+def sealed_field_context(field, source, rule):
+    '''
+      Associated data for a sealed connection field, so that it only
+      authenticates as that field of that flip request (it can't be swapped
+      with another field, or moved to another flip).
+
+      @param field : the connection field, e.g. 'type_info' or 'xmlrpc_uri'
+      @type str
+      @param source : hash name of the gateway that sent the flip
+      @type str
+      @param rule : the flipped rule
+      @type gateway_msgs.msg.Rule
+
+      @return field|source|type|name|node
+      @rtype bytes
+    '''
+    return ('%s|%s' % (field, flip_request_field(source, rule))).encode('utf-8')
+
+
+def _sealed_tag(session_key, associated_data, ciphertext):
+    # the associated data is length prefixed, so it can't run into the ciphertext
+    authenticated = struct.pack('>I', len(associated_data)) + associated_data + ciphertext
+    return hmac.new(session_key[32:], authenticated, hashlib.sha256).digest()
+
+
+def seal(plaintext, session_key, associated_data=b''):
+    '''
+      Encrypt and authenticate (encrypt-then-mac) a string with a session key.
+
+      @param plaintext : string of any length
+      @type str or bytes
+      @param session_key : key from generate_session_key
+      @type bytes
+      @param associated_data : authenticated (but not encrypted or sent) along with it, see sealed_field_context
+      @type bytes
+
+      @return prefix + nonce + ciphertext + tag
+      @rtype bytes
+    '''
+    if not isinstance(plaintext, bytes):
+        plaintext = plaintext.encode('utf-8')
+    nonce = os.urandom(SEALED_NONCE_LENGTH)
+    cipher = AES.new(session_key[:32], AES.MODE_CTR, counter=Counter.new(64, prefix=nonce))
+    ciphertext = nonce + cipher.encrypt(plaintext)
+    return SEALED_PREFIX + ciphertext + _sealed_tag(session_key, associated_data, ciphertext)
+
+
+def unseal(sealed, session_key, associated_data=b''):
+    '''
+      Reverse seal(), the associated data must be the same as it was sealed with.
+
+      @return the plaintext
+      @rtype str
+
+      @raise ValueError : if the sealed string is malformed or doesn't authenticate with the session key
+    '''
+    body = sealed[len(SEALED_PREFIX):]
+    if len(body) < SEALED_NONCE_LENGTH + SEALED_TAG_LENGTH:
+        raise ValueError('sealed string is too short')
+    ciphertext, tag = body[:-SEALED_TAG_LENGTH], body[-SEALED_TAG_LENGTH:]
+    if not hmac.compare_digest(_sealed_tag(session_key, associated_data, ciphertext), tag):
+        raise ValueError('sealed string failed authentication')
+    nonce = ciphertext[:SEALED_NONCE_LENGTH]
+    cipher = AES.new(session_key[:32], AES.MODE_CTR, counter=Counter.new(64, prefix=nonce))
+    return cipher.decrypt(ciphertext[SEALED_NONCE_LENGTH:]).decode('utf-8')
+
+
+def seal_connection(connection, session_key, source):
+    '''
+      Seal the type_info and xmlrpc_uri of a connection, each bound to its
+      field and the flip request (see sealed_field_context).
+
+      @param source : hash name of this (the sending) gateway
+      @type str
+    '''
+    sealed_connection = copy.deepcopy(connection)
+    for field in ['type_info', 'xmlrpc_uri']:
+        setattr(sealed_connection, field,
+                seal(getattr(connection, field), session_key, sealed_field_context(field, source, connection.rule)))
+    return sealed_connection
+
+
+def seal_action_connection(rule, connections, session_key, source):
+    '''
+      Bundle the pub/sub connections of an action up into a single
+      (compound) connection for the action rule, so that the whole action
+      can be flipped as one. The parts go, sealed, in the type_info.
+
+      @param rule : the action rule (node may be either 'node' or 'node,xmlrpc_uri')
+      @type gateway_msgs.msg.Rule
+      @param connections : the action's pubs/subs (see LocalMaster.generate_connection_details)
+      @type Connection[]
+      @param session_key : key from generate_session_key
+      @type bytes
+      @param source : hash name of this (the sending) gateway
+      @type str
+
+      @return the sealed action connection
+      @rtype Connection
+    '''
+    parts = [[c.rule.type, c.rule.name, c.type_msg, c.type_info] for c in connections]
+    action_rule = gateway_msgs.Rule(rule.type, rule.name, rule.node.split(",")[0])
+    return Connection(action_rule,
+                      None,
+                      seal(json.dumps(parts), session_key, sealed_field_context('type_info', source, action_rule)),
+                      seal(connections[0].xmlrpc_uri, session_key, sealed_field_context('xmlrpc_uri', source, action_rule)))
+
+
+def unseal_action_connection(connection, session_key, source):
+    '''
+      Reverse seal_action_connection().
+
+      @param source : hash name of the gateway that sent it
+      @type str
+
+      @return the action's pubs/subs
+      @rtype Connection[]
+
+      @raise ValueError : if the parts can't be unsealed with the session key
+    '''
+    if session_key is None:
+        raise ValueError('no session key to unseal the action connection with')
+    xmlrpc_uri = unseal(connection.xmlrpc_uri, session_key, sealed_field_context('xmlrpc_uri', source, connection.rule))
+    parts = json.loads(unseal(connection.type_info, session_key, sealed_field_context('type_info', source, connection.rule)))
+    return [Connection(gateway_msgs.Rule(connection_type, name, connection.rule.node), type_msg, type_info, xmlrpc_uri)
+            for connection_type, name, type_msg, type_info in parts]
+
 ##########################################################################
 # Regex
 ##########################################################################
@@ -336,6 +544,71 @@ def create_empty_connection_type_dictionary(collection_type=list):
 
 difflist = lambda l1, l2: [x for x in l1 if x not in l2]  # diff of lists
 
+##########################################################################
+# Keyed Diffs
+##########################################################################
+
+
+def remote_rule_key(remote_rule):
+    '''
+      Hashable key for a remote rule, equivalent to comparing the
+      gateway_msgs.RemoteRule messages themselves (field by field), but
+      usable in sets and dictionaries.
+
+      @param remote_rule : the remote rule
+      @type gateway_msgs.msg.RemoteRule
+
+      @return (gateway, type, name, node)
+      @rtype tuple
+    '''
+    return (remote_rule.gateway, remote_rule.rule.type, remote_rule.rule.name, remote_rule.rule.node)
+
+
+def registration_key(registration):
+    '''
+      Hashable key for a registration, comparable with remote_rule_key of the
+      remote rule it was registered for (the local node doesn't come into it).
+
+      @param registration : the registration
+      @type Registration
+
+      @return (remote gateway, type, name, node)
+      @rtype tuple
+    '''
+    rule = registration.connection.rule
+    return (registration.remote_gateway, rule.type, rule.name, rule.node)
+
+
+def keyed_difference(l1, l2, key):
+    '''
+      Hash based equivalent of difflist, i.e. the elements of l1 not in l2,
+      in l1's order. Linear rather than quadratic in the size of the lists.
+
+      @param l1, l2 : lists of elements to compare
+      @type list
+      @param key : function returning a hashable key that is equal for equal elements
+      @type method
+
+      @return the elements of l1 that aren't in l2
+      @rtype list
+    '''
+    l2_keys = set([key(x) for x in l2])
+    return [x for x in l1 if key(x) not in l2_keys]
+
+
+def diff_remote_rules(new_rules, old_rules):
+    '''
+      New and removed rules between two lists of remote rules.
+
+      @param new_rules, old_rules : the updated and previous remote rules
+      @type gateway_msgs.msg.RemoteRule[]
+
+      @return added (in new_rules, not old_rules) and removed (in old_rules, not new_rules)
+      @rtype pair of gateway_msgs.msg.RemoteRule[]
+    '''
+    return (keyed_difference(new_rules, old_rules, remote_rule_key),
+            keyed_difference(old_rules, new_rules, remote_rule_key))
+
 ##########################################################################
 # Conversion from Connection Cache Proxy channels (as passed in callback)
 # to Gateway connections
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import collections
+import threading
+from xmlrpc import client
+
+###############################################################################
+# Transport
+###############################################################################
+
+
+class KeepAliveTransport(client.Transport):
+
+    '''
+      Http/1.1 transport that keeps its connection to the server open between
+      calls (the stock transport already does this, it is reused by the proxy
+      it belongs to), but with a timeout on every socket operation so an
+      unreachable server can't stall the caller indefinitely.
+    '''
+
+    def __init__(self, timeout):
+        '''
+          @param timeout : deadline (seconds) for connecting and for each send/receive
+          @type float
+        '''
+        client.Transport.__init__(self)
+        self._timeout = timeout
+
+    def make_connection(self, host):
+        connection = client.Transport.make_connection(self, host)
+        # only applied when the connection (re)connects, i.e. to the socket it creates
+        connection.timeout = self._timeout
+        return connection
+
+
+class ServerProxyPool(object):
+
+    '''
+      Keep-alive xmlrpc proxies, one per server uri, reused from call to call.
+      Proxies (and their connections) can't be shared between threads, so
+      each thread gets its own pool. The least recently used proxies are
+      closed once a thread is holding more than the maximum.
+    '''
+
+    def __init__(self, timeout, max_size=32):
+        '''
+          @param timeout : per call deadline (seconds), see KeepAliveTransport
+          @type float
+          @param max_size : maximum number of proxies (open connections) kept by each thread
+          @type int
+        '''
+        self._timeout = timeout
+        self._max_size = max_size
+        self._local = threading.local()
+
+    def get(self, uri):
+        '''
+          @param uri : the server's xmlrpc uri
+          @type str
+
+          @return a proxy for this thread, connected on first use
+          @rtype xmlrpc.client.ServerProxy
+        '''
+        proxies = getattr(self._local, 'proxies', None)
+        if proxies is None:
+            proxies = self._local.proxies = collections.OrderedDict()
+        proxy = proxies.pop(uri, None)
+        if proxy is None:
+            proxy = client.ServerProxy(uri, transport=KeepAliveTransport(self._timeout))
+            while len(proxies) >= self._max_size:
+                unused_uri, unused_proxy = proxies.popitem(last=False)
+                unused_proxy('close')()
+        proxies[uri] = proxy
+        return proxy
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import asyncio
+import threading
+import time
+import uuid
+
+import rospy
+import rocon_console.console as console
+import rocon_hub_client
+from gateway_msgs.msg import ConnectionType, Rule
+from rocon_gateway.gateway_hub import GatewayHub
+import rocon_gateway.utils as utils
+
+##############################################################################
+# Main
+##############################################################################
+#
+# Exercises rocon_hub_client.AsyncHub against a running hub with two throwaway
+# gateways (cleaned up again afterwards):
+#
+#  - times a batch of remote connection state lookups, one at a time with the
+#    blocking GatewayHub and all at once through the AsyncHub, recording how
+#    many were actually in flight at the same time
+#  - sends a batch of flips to the second gateway concurrently through the
+#    AsyncHub, then checks the second gateway can decrypt every one of them
+#    (i.e. concurrent flips to the same gateway agree on a single session key)
+#
+# Needs a ros master (for rospy) and a hub, e.g.
+#
+#   rosrun rocon_hub hub.py
+#   rosrun rocon_gateway_tests bench_async_hub.py --requests 500
+
+
+class InFlightCounter(object):
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, function, *args):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.current -= 1
+
+
+def connect_gateway(ip, port, name):
+    hub = GatewayHub(ip, port, [], [])
+    unique_name = name + uuid.uuid4().hex
+    hub.register_gateway(False, unique_name, lambda: None, ip)
+    return hub, unique_name
+
+
+def flip_connection(index):
+    return utils.Connection(Rule(ConnectionType.PUBLISHER, "/bench_async_hub/topic_%s" % index, "/bench_async_hub"),
+                            'std_msgs/String', 'std_msgs/String', 'http://localhost:12345/')
+
+
+async def lookups(async_hub, counter, remote_gateway, count):
+    return await asyncio.gather(*[async_hub.run(counter, async_hub.hub.get_remote_connection_state, remote_gateway)
+                                  for unused_i in range(count)])
+
+
+async def flips(async_hub, remote_gateway, count):
+    return await asyncio.gather(*[async_hub.send_flip_request(remote_gateway, flip_connection(i))
+                                  for i in range(count)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark and check the asyncio hub client')
+    parser.add_argument('--ip', default='localhost', help='hub ip')
+    parser.add_argument('--port', type=int, default=6380, help='hub port')
+    parser.add_argument('--requests', type=int, default=500, help='number of hub requests in each batch')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='AsyncHub worker threads')
+    args = parser.parse_args(rospy.myargv()[1:])
+    rospy.init_node('bench_async_hub', anonymous=True)
+
+    flipper, flipper_name = connect_gateway(args.ip, args.port, 'bench_flipper')
+    receiver, receiver_name = connect_gateway(args.ip, args.port, 'bench_receiver')
+    async_flipper = rocon_hub_client.AsyncHub(flipper, max_in_flight=args.max_in_flight)
+    loop = asyncio.get_event_loop()
+    failed = False
+    try:
+        print(console.bold + "Benchmarks [%s requests, %s in flight]" % (args.requests, args.max_in_flight) + console.reset)
+        start_time = time.time()
+        for unused_i in range(args.requests):
+            flipper.get_remote_connection_state(receiver_name)
+        print(console.cyan + "  blocking lookups: " + console.yellow + "%.4fs" % (time.time() - start_time) + console.reset)
+        counter = InFlightCounter()
+        start_time = time.time()
+        loop.run_until_complete(lookups(async_flipper, counter, receiver_name, args.requests))
+        print(console.cyan + "  async lookups: " + console.yellow + "%.4fs" % (time.time() - start_time) +
+              console.cyan + " [peak in flight " + console.yellow + "%s" % counter.peak + console.cyan + "]" + console.reset)
+        if counter.peak < 2:
+            print(console.red + "  requests never overlapped" + console.reset)
+            failed = True
+
+        start_time = time.time()
+        results = loop.run_until_complete(flips(async_flipper, receiver_name, args.requests))
+        print(console.cyan + "  async flips: " + console.yellow + "%.4fs" % (time.time() - start_time) + console.reset)
+        registrations = receiver.get_unblocked_flipped_in_connections()
+        if all(results) and len(registrations) == args.requests:
+            print(console.green + "  flips sent/decrypted: " + console.magenta +
+                  "%s/%s" % (results.count(True), len(registrations)) + console.reset)
+        else:
+            print(console.red + "  flips sent/decrypted: %s/%s" % (results.count(True), len(registrations)) + console.reset)
+            failed = True
+    finally:
+        for hub, name in [(flipper, flipper_name), (receiver, receiver_name)]:
+            hub.unregister_named_gateway(rocon_hub_client.create_rocon_key(name))
+        async_flipper.disconnect()
+        receiver.disconnect()
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# License: BSD
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/hydro-devel/rocon_gateway_tests/LICENSE
+#
+##############################################################################
+# Imports
+##############################################################################
+
+import argparse
+import random
+import time
+
+import rocon_console.console as console
+from gateway_msgs.msg import ConnectionType, RemoteRule, Rule
+import rocon_gateway.utils as utils
+
+##############################################################################
+# Main
+##############################################################################
+#
+# Compares the list based utils.difflist with the hash based utils.diff_remote_rules
+# the flipped and pulled interfaces use to work out new and removed rules each
+# watcher loop. The updated rule list is the old one with a fraction of its
+# rules swapped out for new ones (default 10%), i.e. a busy, but not unusual loop.
+#
+# No ros master is needed, e.g.
+#
+#   rosrun rocon_gateway_tests bench_rule_diff.py --rules 10000
+
+
+def generate_rules(count, offset=0):
+    connection_types = [ConnectionType.PUBLISHER, ConnectionType.SUBSCRIBER, ConnectionType.SERVICE]
+    rules = []
+    for i in range(offset, offset + count):
+        node = "/node_%s" % (i % 100)
+        rules.append(RemoteRule("gateway_%s" % (i % 5),
+                                Rule(connection_types[i % len(connection_types)], "/topic_%s" % i,
+                                     "%s,http://localhost:%s/" % (node, 40000 + i % 100))))
+    return rules
+
+
+def timed(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return time.time() - start_time, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark remote rule diffing')
+    parser.add_argument('--rules', type=int, default=10000, help='number of rules in each list')
+    parser.add_argument('--churn', type=float, default=0.1, help='fraction of rules replaced between the lists')
+    parser.add_argument('--skip-difflist', action='store_true', help="don't time the (slow) difflist")
+    args = parser.parse_args()
+
+    old_rules = generate_rules(args.rules)
+    churn = int(args.rules * args.churn)
+    new_rules = old_rules[churn:] + generate_rules(churn, offset=args.rules)
+    random.shuffle(new_rules)
+
+    print(console.bold + "Benchmarks [%s rules, %s replaced]" % (args.rules, churn) + console.reset)
+    hashed_time, (added, removed) = timed(utils.diff_remote_rules, new_rules, old_rules)
+    print(console.cyan + "  diff_remote_rules: " + console.yellow + "%.4fs" % hashed_time + console.reset)
+    if not args.skip_difflist:
+        list_time, list_added = timed(utils.difflist, new_rules, old_rules)
+        list_time_removed, list_removed = timed(utils.difflist, old_rules, new_rules)
+        print(console.cyan + "  difflist: " + console.yellow + "%.4fs" % (list_time + list_time_removed) + console.reset)
+        if list_added != added or list_removed != removed:
+            print(console.red + "  results differ!" + console.reset)
+    if len(added) == churn and len(removed) == churn:
+        print(console.green + "  added/removed: " + console.magenta + "%s/%s" % (len(added), len(removed)) + console.reset)
+    else:
+        print(console.red + "  unexpected added/removed: %s/%s" % (len(added), len(removed)) + console.reset)
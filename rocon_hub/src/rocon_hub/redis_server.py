@@ -13,6 +13,7 @@ import re
 import shutil
 import subprocess
 import signal
+import time
 
 # Delete this once we upgrade (hopefully anything after precise)
 # Refer to https://github.com/robotics-in-concert/rocon_multimaster/issues/248
@@ -132,6 +133,8 @@ class RedisServer:
                 if len(keys_to_delete) != 0:
                     pipe.delete(*keys_to_delete)  # * unpacks the list args - http://stackoverflow.com/questions/2921847/python-once-and-for-all-what-does-the-star-operator-mean-in-python
                 pipe.set("rocon:hub:name", self._parameters['name'])
+                # gateways cache advertisements by (epoch, generation), make sure they don't survive a restart
+                pipe.set("rocon:hub:epoch", int(time.time()))
                 pipe.execute()
                 rospy.loginfo("Hub : reset hub variables on the redis server.")
                 break
@@ -6,6 +6,7 @@
 
 from .hub_api import *
 from .hub_client import Hub, ping_hub
+from .async_hub import AsyncHub
 from .hub_discovery import HubDiscovery
 from .exceptions import HubError, \
                         HubNotFoundError, HubNameNotFoundError, \
@@ -0,0 +1,105 @@
+#
+# License: BSD
+#
+#   https://raw.github.com/robotics-in-concert/rocon_multimaster/license/LICENSE
+#
+###############################################################################
+# Imports
+###############################################################################
+
+import asyncio
+import concurrent.futures
+import functools
+
+from .hub_client import Hub
+
+##############################################################################
+# Async Hub
+##############################################################################
+
+
+class AsyncHub(object):
+
+    '''
+      Asyncio front end for a hub client (rocon_hub_client.Hub or any of its
+      subclasses, e.g. rocon_gateway.GatewayHub). It has the same public surface
+      as the hub it wraps, but every method returns a coroutine, e.g.
+
+        async_hub = AsyncHub(gateway_hub)
+        states = await asyncio.gather(*[async_hub.get_remote_connection_state(name) for name in names])
+
+      The redis client underneath is blocking, so calls are run on a bounded
+      pool of worker threads, each with its own connection from the hub's
+      connection pool. This lets an event loop keep many hub requests in flight
+      at once while the existing synchronous api carries on working unchanged
+      alongside it, so callers can move over one piece at a time.
+
+      Calls on the same hub do run concurrently, so the wrapped hub must be
+      safe to use from several threads at once. Hub and GatewayHub are (the
+      latter locks its session key, flip in and advertisement caches). See
+      rocon_gateway_tests/scripts/bench_async_hub.py for a check against a
+      running hub.
+    '''
+
+    def __init__(self, hub, max_in_flight=64, loop=None):
+        '''
+          @param hub : the blocking hub client to wrap
+          @type rocon_hub_client.Hub
+
+          @param max_in_flight : maximum number of hub requests to run at once, the rest are queued
+          @type int
+
+          @param loop : event loop to run on (defaults to the running loop when called)
+          @type asyncio.AbstractEventLoop
+        '''
+        self.hub = hub
+        self._loop = loop
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def __getattr__(self, name):
+        '''
+          Public methods of the wrapped hub come back as coroutine functions,
+          everything else (ip, port, name, uri...) is passed straight through.
+        '''
+        attribute = getattr(self.hub, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def coroutine(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+        return coroutine
+
+    async def run(self, function, *args, **kwargs):
+        '''
+          Run an arbitrary blocking function (typically a hub method or a batch
+          of redis calls) on the worker threads.
+
+          @param function : the blocking function to call
+          @type method
+
+          @return whatever the function returns (exceptions are raised here as well)
+        '''
+        loop = self._loop or asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    def disconnect(self):
+        '''
+          Stop the worker threads and disconnect the wrapped hub.
+        '''
+        self._executor.shutdown(wait=False)
+        self.hub.disconnect()
+
+    def __eq__(self, other):
+        '''
+          Equal to another AsyncHub, or a Hub, for the same hub uri.
+        '''
+        if isinstance(other, AsyncHub):
+            other = other.hub
+        return isinstance(other, Hub) and self.hub.uri == other.uri
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.hub.uri)
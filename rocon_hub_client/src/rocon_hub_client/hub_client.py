@@ -7,6 +7,7 @@
 # Imports
 ###############################################################################
 
+import threading
 from urllib.parse import urlparse
 
 import rospy
@@ -37,6 +38,23 @@ class HubConnection(redis.Connection):
                                             encoding_errors, decode_responses)
 
 
+class HubConnectionPool(redis.ConnectionPool):
+    '''
+      Connection pool that keeps count of the connections it hands out. Every
+      command, or whole pipeline, takes one connection, so this is the number
+      of round trips made to the hub.
+    '''
+    def __init__(self, *args, **kwargs):
+        super(HubConnectionPool, self).__init__(*args, **kwargs)
+        self.round_trips = 0
+        self._round_trips_lock = threading.Lock()
+
+    def get_connection(self, command_name, *keys, **options):
+        with self._round_trips_lock:
+            self.round_trips += 1
+        return super(HubConnectionPool, self).get_connection(command_name, *keys, **options)
+
+
 ##############################################################################
 # Ping
 ##############################################################################
@@ -95,7 +113,7 @@ class Hub(object):
             self._redis_server = None
             raise HubNotFoundError("couldn't connect to the redis server")
         try:
-            self.pool = redis.ConnectionPool(host=ip, port=port, db=0, socket_timeout=5.0)
+            self.pool = HubConnectionPool(host=ip, port=port, db=0, socket_timeout=5.0)
             self._redis_server = redis.Redis(connection_pool=self.pool)
             self._redis_pubsub_server = self._redis_server.pubsub()
             hub_key_name = self._redis_server.get("rocon:hub:name")
@@ -132,6 +150,13 @@ class Hub(object):
         if not ((len(whitelist) == 0) or (self.uri in uri_whitelist) or (self.name in whitelist)):
             raise HubConnectionNotWhitelistedError("hub/ip not in non-empty whitelist [%s, %s][%s]" % (self.name, self.uri, whitelist))
 
+    def round_trips(self):
+        '''
+          @return the number of requests made to the hub so far
+          @rtype int
+        '''
+        return self.pool.round_trips
+
     def disconnect(self):
         '''
           Kills any open socket connections to the redis server. This is